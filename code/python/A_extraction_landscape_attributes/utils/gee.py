@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import tqdm as tqdm
+
+# Columns added by GEE to every export that are not used:
+GEE_EXTRA_COLUMNS = ["system:index", ".geo"]
+
+
+def read_gee_csv(file, index_col="basin_id", dtype=None):
+    """
+    Read one csv-file exported from GEE, skipping the "system:index" and ".geo" columns.
+
+    The header is read first, so that only the needed columns are parsed and all of them with an
+    explicit dtype (the geometry column is never converted).
+
+    Parameters:
+    - file (str): Path to the csv-file.
+    - index_col (str): Column with the catchment identifier, always read as string.
+    - dtype (dict or type): Dtype of the other columns. If a type is given, it is used for all of
+    them. Default is float.
+
+    Returns:
+    - pd.DataFrame: Data of the file (the index_col is kept as a column).
+    """
+    header = pd.read_csv(file, nrows=0).columns
+    usecols = [col for col in header if col not in GEE_EXTRA_COLUMNS]
+
+    if dtype is None:
+        dtype = float
+    if not isinstance(dtype, dict):
+        dtype = {col: dtype for col in usecols}
+    dtype = {**dtype, index_col: str}
+
+    return pd.read_csv(file, usecols=usecols, dtype=dtype)
+
+
+def read_gee_shards(filenames, index_col="basin_id", dtype=None, num_workers=8):
+    """
+    Read several csv-files exported from GEE in parallel.
+
+    Parameters:
+    - filenames (list): List of paths to the csv-files.
+    - index_col (str): Column with the catchment identifier.
+    - dtype (dict or type): Dtype of the other columns (see read_gee_csv).
+    - num_workers (int): Number of threads used for reading.
+
+    Returns:
+    - list: List of pd.DataFrame in the same order as filenames.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        shards = list(tqdm.tqdm(executor.map(lambda file: read_gee_csv(file, index_col, dtype), filenames),
+                                total=len(filenames)))
+
+    return shards
+
+
+def get_cache_filename(filenames, cache_dir, *args):
+    """
+    Get the path of the Parquet cache for a set of csv-files. The name depends on the paths,
+    sizes and modification times of the files, so any change in the files gives a new cache.
+
+    Parameters:
+    - filenames (list): List of paths to the csv-files.
+    - cache_dir (str): Directory where the cache is stored.
+    - args: Other arguments that change the parsed result (e.g., scale factor).
+
+    Returns:
+    - str: Path to the Parquet file.
+    """
+    key = hashlib.sha1()
+    for file in sorted(filenames):
+        stat = os.stat(file)
+        key.update(f"{os.path.abspath(file)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    key.update(repr(args).encode())
+
+    return os.path.join(cache_dir, f"gee_{key.hexdigest()[:16]}.parquet")
+
+
+def read_gee_attributes(filenames, index_col="basin_id", dtype=None, num_workers=8, cache_dir=None):
+    """
+    Read the static attributes exported from GEE (e.g., elevation and slope), with one row per
+    catchment, into a single DataFrame.
+
+    Parameters:
+    - filenames (list or str): List of paths to the csv-files (or a single path).
+    - index_col (str): Column with the catchment identifier, used as index.
+    - dtype (dict or type): Dtype of the other columns (see read_gee_csv).
+    - num_workers (int): Number of threads used for reading.
+    - cache_dir (str): Directory to cache the parsed result as Parquet (optional).
+
+    Returns:
+    - pd.DataFrame: Attributes with index_col as index.
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    if cache_dir is not None:
+        cache_filename = get_cache_filename(filenames, cache_dir, "attributes", index_col, dtype)
+        if os.path.exists(cache_filename):
+            return pd.read_parquet(cache_filename)
+
+    # All the shards are concatenated only once:
+    attributes_df = pd.concat(read_gee_shards(filenames, index_col, dtype, num_workers), ignore_index=True)
+    attributes_df.set_index(index_col, inplace=True)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        attributes_df.to_parquet(cache_filename)
+
+    return attributes_df
+
+
+def read_gee_timeseries(filenames, dates, basin_ids=None, index_col="basin_id", scale_factor=1,
+                        num_workers=8, cache_dir=None):
+    """
+    Read the time-series exported from GEE (e.g., snow-cover, LAI and NDVI), where each row is a
+    catchment and each column ("0", "1", ...) is a time-step, into a single (dates x catchments)
+    DataFrame. A catchment found in more than one file is kept only once, with the first valid
+    value of each time-step.
+
+    Parameters:
+    - filenames (list): List of paths to the csv-files.
+    - dates (pd.DatetimeIndex): Dates of the time-steps "0", "1", ...
+    - basin_ids (list): Catchments of the final DataFrame (optional). The catchments not processed
+    in GEE are filled with NaN, and the columns are sorted.
+    - index_col (str): Column with the catchment identifier.
+    - scale_factor (float): Scale factor from GEE applied to the values (e.g., 0.01 for LAI).
+    - num_workers (int): Number of threads used for reading.
+    - cache_dir (str): Directory to cache the parsed result as Parquet (optional).
+
+    Returns:
+    - pd.DataFrame: Time-series with dates as index and the catchments as columns.
+    """
+    if cache_dir is not None:
+        cache_filename = get_cache_filename(filenames, cache_dir, "timeseries", list(dates),
+                                            None if basin_ids is None else list(basin_ids), index_col, scale_factor)
+        if os.path.exists(cache_filename):
+            return pd.read_parquet(cache_filename)
+
+    shards = read_gee_shards(filenames, index_col, float, num_workers)
+
+    # Pre-allocate the (catchments x time-steps) array and fill it shard by shard:
+    num_rows = sum(len(shard) for shard in shards)
+    values = np.full((num_rows, len(dates)), np.nan)
+    columns = []
+
+    row = 0
+    for shard in shards:
+        columns.extend(shard[index_col].tolist())
+        steps = shard.columns.drop(index_col)
+        positions = steps.astype(int).values
+        valid = positions < len(dates)
+        values[row:row + len(shard), positions[valid]] = shard.loc[:, steps[valid]].to_numpy()
+        row += len(shard)
+
+    timeseries_df = pd.DataFrame(values.T * scale_factor, index=dates, columns=columns)
+
+    # Catchments found in more than one shard are kept only once, with the first valid value of
+    # each time-step (duplicated columns cannot be reindexed):
+    if timeseries_df.columns.duplicated().any():
+        timeseries_df = timeseries_df.T.groupby(level=0, sort=False).first().T
+
+    if basin_ids is not None:
+        timeseries_df = timeseries_df.reindex(columns=sorted(set(basin_ids) | set(columns)))
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        timeseries_df.to_parquet(cache_filename)
+
+    return timeseries_df
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+from .instrumentation import record_item, stage
+
+
+def intersect_class_areas(geometries, source_geometries, source_codes, source_areas, tree, num_classes):
+    """
+    Compute the area of each class intersected by each geometry using only the candidate pairs
+    given by the spatial index.
+
+    Parameters:
+    - geometries (np.array): Array of shapely geometries (catchments or parts of them).
+    - source_geometries (np.array): Array of shapely geometries of the source layer (e.g., GLiM).
+    - source_codes (np.array): Array with the class position (0 to num_classes - 1) of each source geometry.
+    - source_areas (np.array): Array with the area of each source geometry.
+    - tree (shapely.STRtree): Spatial index built over source_geometries.
+    - num_classes (int): Number of classes.
+
+    Returns:
+    - np.array [n x num_classes]: Intersected area per geometry and class.
+    """
+    class_areas = np.zeros((len(geometries), num_classes))
+
+    # Candidate pairs (geometry, source polygon) with intersecting bounding boxes and geometries:
+    geometry_idx, source_idx = tree.query(geometries, predicate="intersects")
+    if len(geometry_idx) == 0:
+        return class_areas
+
+    # Source polygons fully inside the geometry do not need an intersection:
+    shapely.prepare(geometries)
+    inside = shapely.contains_properly(geometries[geometry_idx], source_geometries[source_idx])
+
+    areas = source_areas[source_idx].copy()
+    crossing = ~inside
+    areas[crossing] = shapely.area(shapely.intersection(geometries[geometry_idx[crossing]],
+                                                        source_geometries[source_idx[crossing]]))
+
+    np.add.at(class_areas, (geometry_idx, source_codes[source_idx]), areas)
+
+    return class_areas
+
+
+def get_direct_subcatchments(hierarchy, geometries, polygon_ids):
+    """
+    Get for each catchment the list of its direct nested sub-catchments (not nested within another
+    sub-catchment of the same catchment), keeping only sub-catchments that do not overlap each other.
+
+    Parameters:
+    - hierarchy (pd.DataFrame): Pairs of nested catchments with the columns "sub_catchment" and
+    "catchment", as in "estreams_catchments_hierarchy.csv".
+    - geometries (np.array): Array of shapely geometries of the catchments.
+    - polygon_ids (np.array): Array with the unique-identifier of each catchment.
+
+    Returns:
+    - dict: Catchment position as key and list of sub-catchment positions as values.
+    """
+    position = pd.Series(np.arange(len(polygon_ids)), index=polygon_ids)
+    areas = shapely.area(geometries)
+
+    # Keep only pairs where both catchments are available:
+    hierarchy = hierarchy[hierarchy.sub_catchment.isin(position.index) & hierarchy.catchment.isin(position.index)]
+    sub_positions = position.loc[hierarchy.sub_catchment].values
+    positions = position.loc[hierarchy.catchment].values
+
+    # Duplicated catchments may be nested in each other, so a sub-catchment must be smaller:
+    smaller = areas[sub_positions] < areas[positions]
+    sub_positions, positions = sub_positions[smaller], positions[smaller]
+
+    pairs = set(zip(sub_positions, positions))
+    nested = pd.Series(sub_positions).groupby(positions).agg(list)
+
+    subcatchments = {}
+    for parent, children in nested.items():
+        # Direct sub-catchments are the ones not nested within another sub-catchment:
+        direct = [child for child in children if not any((child, other) in pairs for other in children)]
+
+        # Overlapping sub-catchments would count the same area twice, so we keep the largest ones:
+        selected = []
+        for child in sorted(direct, key=lambda x: -areas[x]):
+            if not any(shapely.relate_pattern(geometries[child], geometries[other], "T********")
+                       for other in selected):
+                selected.append(child)
+
+        subcatchments[parent] = selected
+
+    return subcatchments
+
+
+def calculate_class_areas(source, polygons, class_column, polygon_id="id", hierarchy=None,
+                          simplify_tolerance=None, batch_size=500, run=None):
+    """
+    Calculate the area of each class of a polygon layer (e.g., lithological classes of GLiM) within
+    each catchment, without dissolving the layer and without a full overlay.
+
+    The source polygons are indexed once in a STRtree, and only the candidate pairs are intersected.
+    When the catchments hierarchy is given, the areas of each catchment are computed from the areas
+    of its nested sub-catchments plus only the remaining (not nested) part of the catchment.
+
+    Parameters:
+    - source (gpd.GeoDataFrame): Polygon layer with the classes (un-dissolved).
+    - polygons (gpd.GeoDataFrame): Catchment polygon boundaries.
+    - class_column (str): Column of source with the classes.
+    - polygon_id (str): Unique-identifier for each catchment polygon.
+    - hierarchy (pd.DataFrame): Pairs of nested catchments with the columns "sub_catchment" and
+    "catchment" (optional).
+    - simplify_tolerance (float): Tolerance used to simplify the source polygons before the
+    intersections, in the units of the crs (optional).
+    - batch_size (int): Number of catchments intersected at once.
+    - run (dict): Run from utils.instrumentation.create_run, where the wall time of the intersections
+    and the latency of each batch (per level of the hierarchy) are recorded (optional).
+
+    Returns:
+    - pd.DataFrame: Areas (km2, for a crs in meters) with polygon_id as index and the classes as
+    columns, the same as the pivot-table of the overlay.
+    """
+    # Both layers should be in the same coordinate system:
+    if source.crs is not None and polygons.crs is not None and source.crs != polygons.crs:
+        source = source.to_crs(polygons.crs)
+
+    source_geometries = np.asarray(source.geometry.values)
+    if simplify_tolerance is not None:
+        source_geometries = shapely.simplify(source_geometries, simplify_tolerance, preserve_topology=True)
+
+    classes, source_codes = np.unique(source[class_column].to_numpy(), return_inverse=True)
+    source_areas = shapely.area(source_geometries)
+    tree = STRtree(source_geometries)
+
+    geometries = np.asarray(polygons.geometry.values)
+    polygon_ids = polygons[polygon_id].to_numpy()
+    class_areas = np.zeros((len(geometries), len(classes)))
+
+    def intersect(geometries_batch):
+        return intersect_class_areas(geometries_batch, source_geometries, source_codes, source_areas,
+                                     tree, len(classes))
+
+    if hierarchy is None:
+        subcatchments = {}
+    else:
+        subcatchments = get_direct_subcatchments(hierarchy, geometries, polygon_ids)
+
+    # The sub-catchments are smaller than their catchments, so sorting by area gives the levels
+    # of the hierarchy (a catchment only after all its sub-catchments):
+    levels = np.zeros(len(geometries), dtype=int)
+    for position in np.argsort(shapely.area(geometries), kind="stable"):
+        children = subcatchments.get(position, [])
+        if children:
+            levels[position] = 1 + levels[children].max()
+
+    with stage(run, "calculate_class_areas"):
+        for level in range(levels.max() + 1):
+            positions = np.flatnonzero(levels == level)
+
+            for start in range(0, len(positions), batch_size):
+                batch = positions[start:start + batch_size]
+                batch_start = time.perf_counter()
+
+                if level == 0:
+                    class_areas[batch] = intersect(geometries[batch])
+                    record_item(run, "calculate_class_areas", f"level {level}, batch {start // batch_size}",
+                                seconds=time.perf_counter() - batch_start, num_catchments=len(batch))
+                    continue
+
+                # Remaining part of the catchment not covered by the sub-catchments, and the parts of
+                # the sub-catchments slightly outside the catchment (delineation differences):
+                children = [subcatchments[position] for position in batch]
+                children_union = [shapely.union_all(geometries[c]) for c in children]
+                remaining = shapely.difference(geometries[batch], np.array(children_union, dtype=object))
+
+                children_flat = np.concatenate(children)
+                children_parent = np.repeat(np.arange(len(batch)), [len(c) for c in children])
+                outside = shapely.difference(geometries[children_flat], geometries[batch][children_parent])
+
+                outside_areas = np.zeros((len(batch), len(classes)))
+                np.add.at(outside_areas, children_parent, intersect(outside))
+
+                children_areas = np.zeros((len(batch), len(classes)))
+                np.add.at(children_areas, children_parent, class_areas[children_flat])
+
+                class_areas[batch] = intersect(remaining) + children_areas - outside_areas
+                record_item(run, "calculate_class_areas", f"level {level}, batch {start // batch_size}",
+                            seconds=time.perf_counter() - batch_start, num_catchments=len(batch),
+                            num_sub_catchments=len(children_flat))
+
+    # Negative round-off values from the subtraction are set to 0:
+    class_areas = np.clip(class_areas, 0, None) / 1000000
+
+    class_areas_df = pd.DataFrame(class_areas, index=pd.Index(polygon_ids, name=polygon_id), columns=classes)
+    class_areas_df.columns.name = class_column
+
+    return class_areas_df
+
+
+def calculate_class_fractions(class_areas, prefix=""):
+    """
+    Calculate the percentage of each class within each catchment, relative to the total area
+    covered by the source layer (as done for the lithological classes).
+
+    Parameters:
+    - class_areas (pd.DataFrame): Areas per catchment and class from calculate_class_areas.
+    - prefix (str): Prefix added to the column names (e.g., "lit_fra_").
+
+    Returns:
+    - pd.DataFrame: Percentages (0 to 100) per catchment and class. Catchments not covered by the
+    source layer are set to NaN.
+    """
+    total_area = class_areas.sum(axis=1)
+    class_fractions = class_areas.div(total_area.where(total_area > 0), axis=0) * 100
+
+    return class_fractions.add_prefix(prefix)
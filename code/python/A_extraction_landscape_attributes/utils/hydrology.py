@@ -1,13 +1,115 @@
-# -*- coding: utf-8 -*-
-"""
+# -*- coding: utf-8 -*-
+"""
 This file is part of the EStreams dataset. See https://github.com/EStreams for details.
 
-Coded by: Thiago Nascimento
+Coded by: Thiago Nascimento
 """
+import time
+
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-
-def count_geometries_in_polygons(geometries, polygons, polygon_id="id", new_column="points_count"):
+from shapely import STRtree
+
+from .instrumentation import record_item
+
+def build_polygons_tree(polygons):
+    """
+    Inputs
+    ------------------
+    polygons: geodataframe with the catchment polygon boundaries   
+    --------------------
+    shapely.STRtree built over the catchment polygons. It can be given to 
+    aggregate_geometries_in_polygons to avoid rebuilding the index for every layer.
+        
+    """
+    
+    return STRtree(np.asarray(polygons.geometry.values))
+
+
+def aggregate_geometries_in_polygons(geometries, polygons, aggregations, polygon_id="id", 
+                                     predicate="intersects", tree=None, run=None):
+    """
+    Inputs
+    ------------------
+    geometries: geodataframe with the geometries (points or polygons) to be aggregated   
+    polygons: geodataframe with the catchment polygon boundaries   
+    aggregations: dictionary with the new column names as keys, and as values either "count",
+        or a tuple (column, how), where column is a column of geometries and how is one of
+        "sum", "min", "max" or "mean". Example:
+        {"res_num": "count", "res_tot_sto": ("rv_mcm_v11", "sum")}
+    polygon_id: string with the unique-identifier for each catchment polygon
+    predicate: string with the spatial predicate tested as predicate(geometry, polygon), 
+        e.g. "intersects" (same as the default of the sjoin) or "within"
+    tree: shapely.STRtree from build_polygons_tree. If None, it is built here. 
+    run: run from utils.instrumentation.create_run, where the latency and number of pairs of each 
+        layer are recorded (optional)
+    --------------------
+    pandas.DataFrame [n x len(aggregations)] with polygon_id as index and with columns:
+        'new_column': Aggregation for each catchment polygon. The counts are 0 for catchments 
+        without geometries, while the other aggregations are NaN (as from the sjoin + groupby). 
+        
+    """
+    
+    start = time.perf_counter()
+    
+    # Both layers should be in the same coordinate system:
+    if geometries.crs is not None and polygons.crs is not None and geometries.crs != polygons.crs:
+        geometries = geometries.to_crs(polygons.crs)
+    
+    # The index over the catchments is built only once and can be re-used between layers:
+    if tree is None:
+        tree = build_polygons_tree(polygons)
+        
+    # Pairs of (geometry, polygon) positions satisfying the predicate:
+    geometry_idx, polygon_idx = tree.query(np.asarray(geometries.geometry.values), predicate=predicate)
+    
+    num_polygons = len(polygons)
+    counts = np.bincount(polygon_idx, minlength=num_polygons)
+    
+    aggregated = {}
+    for new_column, aggregation in aggregations.items():
+        if aggregation == "count":
+            aggregated[new_column] = counts
+            continue
+            
+        column, how = aggregation
+        values = geometries[column].to_numpy(dtype=float)[geometry_idx]
+        valid = ~np.isnan(values)
+        
+        if how == "sum":
+            result = np.bincount(polygon_idx[valid], weights=values[valid], minlength=num_polygons)
+            
+        elif how == "mean":
+            result = np.bincount(polygon_idx[valid], weights=values[valid], minlength=num_polygons)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                result = result / np.bincount(polygon_idx[valid], minlength=num_polygons)
+            
+        elif how in ("min", "max"):
+            # Start from +-inf so that the ufunc only needs the valid values:
+            ufunc, initial = (np.minimum, np.inf) if how == "min" else (np.maximum, -np.inf)
+            result = np.full(num_polygons, initial)
+            ufunc.at(result, polygon_idx[valid], values[valid])
+            result[np.isinf(result)] = np.nan
+            
+        else:
+            raise ValueError(f"Aggregation '{how}' is not supported for the column '{new_column}'")
+        
+        # Catchments without any geometry receive NaN (as in the sjoin + groupby):
+        result = result.astype(float)
+        result[counts == 0] = np.nan
+        aggregated[new_column] = result
+        
+    # Create a dataframe:
+    aggregated_df = pd.DataFrame(aggregated, index=pd.Index(polygons[polygon_id].values, name=polygon_id))
+    
+    record_item(run, "aggregate_geometries_in_polygons", ", ".join(aggregations), seconds=time.perf_counter() - start,
+                num_geometries=len(geometries), num_pairs=len(polygon_idx))
+    
+    return aggregated_df
+
+
+def count_geometries_in_polygons(geometries, polygons, polygon_id="id", new_column="points_count", tree=None, run=None):
     """
     Inputs
     ------------------
@@ -15,6 +117,8 @@ def count_geometries_in_polygons(geometries, polygons, polygon_id="id", new_colu
     polygons: geodataframe with the catchment polygon boundaries   
     polygon_id: string with the unique-identifier for each catchment polygon
     new_column: string with the column's name
+    tree: shapely.STRtree from build_polygons_tree (optional)
+    run: run from utils.instrumentation.create_run (optional)
     --------------------
     pandas.DataFrame [n x 6] with columns:
         'Code': Code of the catchment.
@@ -23,19 +127,86 @@ def count_geometries_in_polygons(geometries, polygons, polygon_id="id", new_colu
     """
     
     # Count geometries in polygons
-    points_in_polygon = (
-        # Spatial join associates points and polygons that intersects each other
-        polygons.sjoin(
-            geometries,
-            how="inner",
-        )
-        .groupby(polygon_id)  # Group points by polygons
-        .size()  # Get number of points
-        .rename(new_column)  # Name your column as you want it to appear in polygons
-    )
+    count_df = aggregate_geometries_in_polygons(geometries, polygons, {new_column: "count"}, 
+                                                polygon_id=polygon_id, predicate="intersects", tree=tree, run=run)
+    count_df = count_df.astype(float)
+    
+    return count_df
 
+
+def count_stations_per_year(stations, polygons, first_year, last_year, polygon_id="id", 
+                            station_id="STATION", start_column="START", stop_column="STOP", tree=None, run=None):
+    """
+    Inputs
+    ------------------
+    stations: dictionary with the variable as key (e.g. "rr") and as value a geodataframe with the 
+        stations of the variable, with their period of measurements (start and stop dates)
+    polygons: geodataframe with the catchment polygon boundaries   
+    first_year: first year counted (e.g. 1950)
+    last_year: last year counted (e.g. 2023)
+    polygon_id: string with the unique-identifier for each catchment polygon
+    station_id: column with the unique-identifier of each station (the stations present in several
+        variables are located only once)
+    start_column, stop_column: columns with the first and last dates of each station. Stations without 
+        start are counted from the first year, and without stop until the last year.
+    tree: shapely.STRtree from build_polygons_tree. If None, it is built here. 
+    run: run from utils.instrumentation.create_run, where the latency and number of stations of the 
+        variables are recorded (optional)
+    --------------------
+    pandas.DataFrame [n x (variables * years)] with polygon_id as index and columns (variable, year):
+        Number of stations (intersecting each catchment polygon) with measurements in each year. 
+        
+    """
+    
+    start_time = time.perf_counter()
+    
+    if tree is None:
+        tree = build_polygons_tree(polygons)
+        
+    num_polygons, num_years = len(polygons), last_year - first_year + 1
+    variables = list(stations)
+    
+    # All the stations, with the position of their variable:
+    all_stations = pd.concat([stations[variable] for variable in variables], ignore_index=True)
+    variable_idx = np.repeat(np.arange(len(variables)), [len(stations[variable]) for variable in variables])
+    
+    if all_stations.crs is not None and polygons.crs is not None and all_stations.crs != polygons.crs:
+        all_stations = all_stations.to_crs(polygons.crs)
+    
+    # Each station is located only once (pairs of (station, polygon) positions, sorted by station):
+    codes, unique_idx = np.unique(all_stations[station_id].astype(str).values, return_inverse=True)
+    first_idx = np.unique(unique_idx, return_index=True)[1]
+    location_idx, polygon_idx = tree.query(np.asarray(all_stations.geometry.values[first_idx]), predicate="intersects")
+    order = np.argsort(location_idx, kind="stable")
+    location_idx, polygon_idx = location_idx[order], polygon_idx[order]
+    
+    # Pairs of each (variable, station), from the pairs of its location:
+    num_pairs = np.bincount(location_idx, minlength=len(codes))
+    offsets = np.concatenate([[0], np.cumsum(num_pairs)[:-1]])
+    repeats = num_pairs[unique_idx]
+    row_idx = np.repeat(np.arange(len(all_stations)), repeats)
+    pair_idx = np.repeat(offsets[unique_idx] - np.concatenate([[0], np.cumsum(repeats)[:-1]]), repeats) + np.arange(repeats.sum())
+    pair_polygon_idx = polygon_idx[pair_idx]
+    
+    # Years of measurements of each station (positions in the counted years):
+    start = pd.to_datetime(all_stations[start_column].astype(str).str.strip(), errors="coerce")
+    stop = pd.to_datetime(all_stations[stop_column].astype(str).str.strip(), errors="coerce")
+    first = np.clip(start.dt.year.fillna(first_year).to_numpy(dtype=int) - first_year, 0, num_years)
+    last = np.clip(stop.dt.year.fillna(last_year).to_numpy(dtype=int) - first_year + 1, 0, num_years)
+    active = (first < last)[row_idx]
+    
+    # Sweep over the years: +1 when a station starts and -1 after it stops, then a cumulative sum:
+    cell = (variable_idx[row_idx] * num_polygons + pair_polygon_idx)[active] * (num_years + 1)
+    changes = np.bincount(cell + first[row_idx][active], minlength=len(variables) * num_polygons * (num_years + 1))
+    changes = changes - np.bincount(cell + last[row_idx][active], minlength=len(changes))
+    counts = np.cumsum(changes.reshape(len(variables), num_polygons, num_years + 1), axis=2)[:, :, :num_years]
+    
     # Create a dataframe:
-    count_df = pd.DataFrame(index = polygons[polygon_id], data = points_in_polygon)
-    count_df.fillna(0, inplace=True)
+    columns = pd.MultiIndex.from_product([variables, range(first_year, last_year + 1)], names=["variable", "year"])
+    counts_df = pd.DataFrame(counts.transpose(1, 0, 2).reshape(num_polygons, -1), columns=columns,
+                             index=pd.Index(polygons[polygon_id].values, name=polygon_id))
     
-    return count_df
+    record_item(run, "count_stations_per_year", ", ".join(variables), seconds=time.perf_counter() - start_time,
+                num_stations=len(all_stations), num_locations=len(codes))
+    
+    return counts_df
@@ -9,6 +9,8 @@ Coded by: Thiago Nascimento
 import numpy as np
 import pandas as pd
 
+from .gee import read_gee_shards
+
 def get_majority_columns(row):
     """
     Get the majority column for each year based on the maximum value for columns containing "lulc_" in the DataFrame.
@@ -37,4 +39,91 @@ def get_majority_columns(row):
             # If any value is NaN, set the majority column to pd.NaT
             majority_columns[f'lulc_dom_{year}'] = np.nan
 
-    return pd.Series(majority_columns)
\ No newline at end of file
+    return pd.Series(majority_columns)
+
+def get_majority_columns_vectorized(df):
+    """
+    Get the majority column for each year and each row of the DataFrame at once, equivalent to 
+    df.apply(get_majority_columns, axis=1).
+
+    The "lulc_<year>_<class>" columns are parsed only once into a (rows x years x classes) array, 
+    and the majority class is taken along the classes axis.
+
+    Parameters:
+    - df (pd.DataFrame): DataFrame with the "lulc_<year>_<class>" columns (e.g., fraction of each class).
+
+    Returns:
+    - pd.DataFrame: A DataFrame containing the majority class for each year in the "lulc_dom_<year>" columns.
+    Years with any NaN value are set to NaN. 
+    """
+    # Parse the column names only once:
+    labels = df.columns.to_series().astype(str).str.extract(r'^lulc_(\d+)_(\d+)$').dropna()
+    years, year_idx = np.unique(labels[0].values, return_inverse=True)
+    
+    # The classes are kept in the order they first appear (same tie-breaking as idxmax):
+    classes, first_idx, class_idx = np.unique(labels[1].values, return_index=True, return_inverse=True)
+    order = np.argsort(first_idx)
+    classes = classes[order]
+    class_idx = np.argsort(order)[class_idx]
+    
+    # Build the (rows x years x classes) array. Classes missing in a year are set to -inf:
+    values = df.loc[:, labels.index].to_numpy(dtype=float)
+    cube = np.full((len(df), len(years), len(classes)), -np.inf)
+    cube[:, year_idx, class_idx] = values
+    
+    # Years with any NaN value do not receive a majority class:
+    any_nan = np.isnan(cube).any(axis=2)
+    majority = np.argmax(np.where(np.isnan(cube), -np.inf, cube), axis=2)
+    
+    majority_columns = np.where(any_nan, np.nan, classes.astype(int)[majority])
+
+    return pd.DataFrame(majority_columns, index=df.index, columns=['lulc_dom_' + year for year in years])
+
+
+def read_landcover_files(filenames, num_workers=8):
+    """
+    Read and concatenate the landcover outputs from GEE (one file per year or per chunk of catchments).
+
+    Each file is organized as a pivot-table with the fraction of each "lulc_<year>_<class>" and the 
+    "tot_area_<year>" per catchment. The tables are concatenated only once at the end, and when more 
+    than one file is available for the same year, the first non-NaN value is kept for each catchment.
+
+    Parameters:
+    - filenames (list): List of paths to the GEE csv files.
+    - num_workers (int): Number of threads used for reading the files.
+
+    Returns:
+    - pd.DataFrame: Landcover fractions and total areas with the catchment code as index.
+    """
+    landcover_pivots = []
+    
+    # First we read all the files in parallel:
+    landcover_files = read_gee_shards(filenames, index_col="code", 
+                                      dtype={"year": str, "class": str, "area_sqm": float}, num_workers=num_workers)
+    
+    for landcover_file in landcover_files:
+        
+        landcover_file["class_name"] = "lulc_" + landcover_file["year"].astype(str) + "_" + landcover_file["class"].astype(str)
+        year = landcover_file.loc[0, "year"]
+        
+        # Here we can create a pivot-table to organize our dataset:
+        landcover_pivot = pd.pivot_table(
+            landcover_file,
+            values='area_sqm',          
+            index='code',               # Rows are based on 'code'
+            columns='class_name',       # Columns are based on 'class_name'
+            fill_value=np.nan)
+        
+        # Total are per year:
+        landcover_pivot["tot_area_"+str(year)] = landcover_pivot.sum(axis = 1)
+        landcover_pivot.iloc[:, :-1] = landcover_pivot.iloc[:, :-1].div(landcover_pivot["tot_area_"+str(year)], axis=0)
+        
+        landcover_pivots.append(landcover_pivot)
+        
+    # Now we proceed with the concatenation (only once):
+    landcover_df = pd.concat(landcover_pivots, axis=1)
+    
+    # Here we deal with the case we have more than one file for the same year:
+    landcover_df = landcover_df.T.groupby(level=0).first().T
+    
+    return landcover_df
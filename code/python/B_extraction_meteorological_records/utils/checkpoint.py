@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below keep a ledger of the processed items (e.g., one line per catchment), appended
+and flushed to disk as soon as each item finishes. After a crash, the processing can be started
+again with only the items that are missing or failed, and the reasons of the failures are kept.
+"""
+
+import datetime
+import json
+import os
+import threading
+import traceback
+
+
+def open_ledger(path, reset=False):
+    """
+    Open (or create) a ledger, an append-only JSON-lines file with one line per finished item.
+
+    Parameters:
+    - path (str): Path to the ledger (e.g., "data/meteorology/eobs/preprocessing/rr/ledger_rr.jsonl").
+    - reset (bool): If True, the previous ledger is removed and all the items are processed again.
+
+    Returns:
+    - dict: Ledger with the last record of each item (key "records").
+    """
+    if reset and os.path.exists(path):
+        os.remove(path)
+
+    records = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line of a run interrupted while writing:
+                    continue
+                records[record["item"]] = record
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    return {"path": path, "records": records, "lock": threading.Lock()}
+
+
+def append_record(ledger, item, status, **info):
+    """
+    Append the record of one item to the ledger and flush it to disk (thread-safe).
+
+    Parameters:
+    - ledger (dict): Ledger from open_ledger.
+    - item (str): Name of the item (e.g., the basin_id).
+    - status (str): "done" or "failed".
+    - info: Other information of the item (e.g., "output" or "error").
+    """
+    record = {"item": str(item), "status": status, "time": datetime.datetime.now().isoformat(timespec="seconds"), **info}
+    line = json.dumps(record) + "\n"
+
+    with ledger["lock"]:
+        with open(ledger["path"], "a", encoding="utf-8") as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+        ledger["records"][record["item"]] = record
+
+
+def is_done(ledger, item):
+    """
+    True if the item finished without errors and its output (if recorded) still exists.
+    """
+    record = ledger["records"].get(str(item))
+    if record is None or record["status"] != "done":
+        return False
+
+    return record.get("output") is None or os.path.exists(record["output"])
+
+
+def get_pending(ledger, items):
+    """
+    Items not finished yet (missing or failed in the ledger), in the original order.
+
+    Parameters:
+    - ledger (dict): Ledger from open_ledger.
+    - items (list): All the items to be processed.
+
+    Returns:
+    - list: Items to be processed.
+    """
+    return [item for item in items if not is_done(ledger, item)]
+
+
+def get_failures(ledger):
+    """
+    Items whose last record is a failure, with the reason.
+
+    Returns:
+    - dict: Name of the item as key and the error message as value.
+    """
+    return {item: record.get("error") for item, record in ledger["records"].items() if record["status"] == "failed"}
+
+
+def run_checkpointed(ledger, item, function, /, *args, **kwargs):
+    """
+    Call a function for one item and record in the ledger if it finished or failed. The errors are
+    recorded and not raised, so that the other items keep running. If the function returns the
+    path of its output, the path is recorded and checked on restart.
+
+    Parameters:
+    - ledger (dict): Ledger from open_ledger.
+    - item (str): Name of the item (e.g., the basin_id).
+    - function (callable): Function to be called with args and kwargs.
+
+    Returns:
+    - bool: True if the function finished without errors.
+    """
+    try:
+        result = function(*args, **kwargs)
+    except Exception as error:
+        append_record(ledger, item, "failed", error=f"{type(error).__name__}: {error}",
+                      traceback=traceback.format_exc(limit=-3))
+        return False
+
+    append_record(ledger, item, "done", output=result if isinstance(result, str) else None)
+
+    return True
@@ -10,6 +10,15 @@ from shapely.geometry import Polygon
 import geopandas as gpd
 from shapely.geometry import Point
 from geopandas import GeoDataFrame
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import netCDF4 as nc
+import pandas as pd
+import pyet
+import os
+import time
+
+from .instrumentation import record_item
 
 def get_pixel_indices_and_coords(latitude, longitude, polygon):
     # Create a list to store pixel indices within the polygon
@@ -54,7 +63,9 @@ def get_pixel_indices_and_coords(latitude, longitude, polygon):
 chunk_size = 100  # Adjust this value based on your available memory
 
 # Function to process a single catchment polygon
-def process_catchment(catchmentname, shapefile_all, values, latitude, longitude, path_out, variable_name):
+# run (optional): Run from utils.instrumentation.create_run, where the size of each catchment is recorded
+# Returns the path of the CSV file (or None when there are no pixels within the catchment)
+def process_catchment(catchmentname, shapefile_all, values, latitude, longitude, path_out, variable_name, run=None):
     # Retrieve shapefile data and polygon for the given catchment
     shapefile = shapefile_all[shapefile_all.basin_id == catchmentname]
     polygon = shapefile.geometry.unary_union
@@ -65,6 +76,8 @@ def process_catchment(catchmentname, shapefile_all, values, latitude, longitude,
     # Check if there are no pixels within the catchment
     if len(pixel_indices) == 0:
         print(f"No pixels within catchment {catchmentname}. Skipping.")
+        if run is not None:
+            record_item(run, "process_catchment", catchmentname, num_pixels=0)
         return
 
     # Create pixel polygons and calculate intersection areas
@@ -99,9 +112,13 @@ def process_catchment(catchmentname, shapefile_all, values, latitude, longitude,
     # Initialize an array to store weighted time series data
     weighted_time_series = np.zeros((num_time_steps, num_pixels))
 
+    # Bytes of the dataset read for the catchment (the full grid of each chunk of time-steps):
+    bytes_read = 0
+
     for start_idx in range(0, num_time_steps, chunk_size):
         end_idx = min(start_idx + chunk_size, num_time_steps)
         chunk = values[start_idx:end_idx]
+        bytes_read += chunk.nbytes
         
         # Extract chunk data for the selected pixels
         chunk_weighted = chunk[:, pixel_indices[:, 0], pixel_indices[:, 1]]
@@ -133,7 +150,108 @@ def process_catchment(catchmentname, shapefile_all, values, latitude, longitude,
     ##                          weights_time_series.reshape((len(weights_time_series), 1))))
 
     # Save pixel data and weighted sum data to CSV files
-    np.savetxt(path_out+str(variable_name)+"_"+catchmentname+".csv", timeseries_array, delimiter=',')
+    file_out = path_out+str(variable_name)+"_"+catchmentname+".csv"
+    # The file is written under a temporary name and renamed when complete, so that an interrupted
+    # run never leaves a partial CSV behind (and running a catchment again just replaces its file):
+    np.savetxt(file_out + ".tmp", timeseries_array, delimiter=',')
+    os.replace(file_out + ".tmp", file_out)
     #np.savetxt(path_out+str(variable_name)+"_"+catchmentname+"_pixels"+".csv", pixels_array, delimiter=',')
 
-    print(f"Catchment {catchmentname}. Processed.")
\ No newline at end of file
+    if run is not None:
+        record_item(run, "process_catchment", catchmentname, num_pixels=num_pixels, num_time_steps=num_time_steps,
+                    area_deg2=polygon.area, bytes_read=bytes_read, bytes_written=os.path.getsize(file_out))
+
+    print(f"Catchment {catchmentname}. Processed.")
+
+    return file_out
+
+#%%
+# Function to compute the PET (Hargreaves) by blocks of time-steps and write it incrementally
+def compute_pet_hargreaves(tmean, tmax, tmin, path_out, time_chunk=365, num_workers=2, complevel=4, run=None):
+    """
+    Compute the potential evapotranspiration (Hargreaves) block by block along the time dimension 
+    and write each block to a compressed and chunked NetCDF file as soon as it is ready. 
+    Only about num_workers blocks are held in memory at once, instead of the full cubes.
+
+    Parameters:
+    - tmean, tmax, tmin (xr.DataArray): Mean, maximum and minimum daily temperature [°C] with the 
+    dimensions (time, latitude, longitude). They should be opened lazily (e.g., xr.open_dataset), 
+    so that each block is only read when needed.
+    - path_out (str): Path of the NetCDF file to be created. The variable is named "Hargreaves".
+    - time_chunk (int): Number of time-steps computed in each block.
+    - num_workers (int): Maximum number of blocks computed (and kept in memory) at the same time.
+    - complevel (int): Compression level (zlib) of the NetCDF file.
+    - run (dict): Optional run from utils.instrumentation.create_run, where the latency and size of each
+    block are recorded (stage "compute_pet_hargreaves").
+
+    Returns:
+    - None
+    """
+    # Create the lat file:
+    lat = tmean.latitude * np.pi / 180
+    lat = lat.expand_dims(dim={"longitude": tmean.longitude}, axis=1)
+    
+    num_time_steps = tmean.sizes["time"]
+    num_lat = tmean.sizes["latitude"]
+    num_lon = tmean.sizes["longitude"]
+    
+    def compute_block(start_idx):
+        start_time = time.perf_counter()
+        end_idx = min(start_idx + time_chunk, num_time_steps)
+        block = slice(start_idx, end_idx)
+        
+        # Only the time-steps of this block are read from the files:
+        hargreaves = pyet.hargreaves(tmean.isel(time=block).load(), tmax.isel(time=block).load(), 
+                                     tmin.isel(time=block).load(), lat=lat)
+        
+        block_values = hargreaves.values.astype(np.float32)
+        if run is not None:
+            record_item(run, "compute_pet_hargreaves", f"{start_idx}-{end_idx}", seconds=time.perf_counter() - start_time,
+                        bytes_written=block_values.nbytes)
+        
+        return start_idx, end_idx, block_values
+    
+    with nc.Dataset(path_out, mode="w", format="NETCDF4") as nc_out:
+        # Dimensions and coordinates:
+        nc_out.createDimension("time", None)
+        nc_out.createDimension("latitude", num_lat)
+        nc_out.createDimension("longitude", num_lon)
+        
+        times = nc_out.createVariable("time", "f8", ("time",))
+        times.units = "days since 1950-01-01 00:00:00"
+        times.calendar = "standard"
+        
+        latitudes = nc_out.createVariable("latitude", "f8", ("latitude",))
+        latitudes.units = "degrees_north"
+        latitudes[:] = tmean.latitude.values
+        
+        longitudes = nc_out.createVariable("longitude", "f8", ("longitude",))
+        longitudes.units = "degrees_east"
+        longitudes[:] = tmean.longitude.values
+        
+        pet = nc_out.createVariable("Hargreaves", "f4", ("time", "latitude", "longitude"), 
+                                    zlib=True, complevel=complevel, fill_value=np.nan,
+                                    chunksizes=(min(time_chunk, num_time_steps), min(num_lat, 64), min(num_lon, 64)))
+        pet.units = "mm d-1"
+        pet.long_name = "Potential evapotranspiration (Hargreaves)"
+        
+        dates = pd.to_datetime(tmean.time.values).to_pydatetime()
+        
+        # The blocks are computed in parallel, but written in order. At most num_workers blocks
+        # are submitted at the same time to bound the memory used:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            pending = deque()
+            for start_idx in range(0, num_time_steps, time_chunk):
+                pending.append(executor.submit(compute_block, start_idx))
+                
+                if len(pending) >= num_workers:
+                    start_done, end_done, values_done = pending.popleft().result()
+                    pet[start_done:end_done] = values_done
+                    times[start_done:end_done] = nc.date2num(dates[start_done:end_done], times.units, times.calendar)
+                    
+            while pending:
+                start_done, end_done, values_done = pending.popleft().result()
+                pet[start_done:end_done] = values_done
+                times[start_done:end_done] = nc.date2num(dates[start_done:end_done], times.units, times.calendar)
+                
+    print(f"PET written to {path_out}.")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below align several daily time series (e.g., streamflow, precipitation, PET and
+temperature) on the same dates and basin_id, in a single contiguous array [variables x days x gauges].
+The quality masks are stored as packed bits (1 bit per day and gauge), and the values are handed out
+as views (no copies) for one gauge or a batch of gauges.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def align_timeseries(timeseries, dates=None, gauges=None, dtype=None):
+    """
+    Load several time series into a single array [variables x days x gauges] aligned on the dates
+    and on the gauges. The time series already aligned are written directly into the array (no
+    intermediate copies), so the source DataFrames can be released afterwards (see get_frame).
+
+    Parameters:
+    - timeseries (dict): Name of the variable as key and pd.DataFrame [dates x gauges] as values.
+    - dates (pd.DatetimeIndex): Dates of the array. Default is the index of the first time series.
+    - gauges (pd.Index): Gauges of the array. Default is the columns of the first time series.
+    - dtype (type): Dtype of the array (e.g., np.float32 for halving the memory). Default is the
+    common dtype of the time series, so the values are not changed.
+
+    Returns:
+    - dict: Aligned inputs with the keys "values" (np.array), "variables" (list), "dates"
+    (pd.DatetimeIndex), "gauges" (pd.Index) and "masks" (dict, see add_quality_mask). Dates or
+    gauges missing in one time series are filled with NaN.
+    """
+    first = next(iter(timeseries.values()))
+    dates = pd.DatetimeIndex(first.index if dates is None else dates)
+    gauges = pd.Index(first.columns if gauges is None else gauges)
+
+    if dtype is None:
+        # At least float32, so that the missing values can be stored as NaN:
+        dtype = np.result_type(np.float32, *[column_dtype for data in timeseries.values() for column_dtype in data.dtypes])
+
+    values = np.empty((len(timeseries), len(dates), len(gauges)), dtype=dtype)
+
+    for i, data in enumerate(timeseries.values()):
+        if not (data.index.equals(dates) and data.columns.equals(gauges)):
+            data = data.reindex(index=dates, columns=gauges)
+
+        # The values are cast while written into the array:
+        values[i] = data.to_numpy()
+
+    return {"values": values, "variables": list(timeseries), "dates": dates, "gauges": gauges, "masks": {}}
+
+
+def add_quality_mask(aligned, name, variables, batch_size=1000):
+    """
+    Compute the quality mask of a group of variables (bad quality where any of them is NaN) and
+    store it as packed bits along the days.
+
+    Parameters:
+    - aligned (dict): Aligned inputs from align_timeseries.
+    - name (str): Name of the mask (e.g., "discharge_precipitation").
+    - variables (list): Variables used for the mask.
+    - batch_size (int): Number of gauges processed at once.
+    """
+    num_days, num_gauges = aligned["values"].shape[1:]
+    mask = np.empty(((num_days + 7) // 8, num_gauges), dtype=np.uint8)
+
+    for start in range(0, num_gauges, batch_size):
+        batch = slice(start, min(start + batch_size, num_gauges))
+        bad = np.zeros((num_days, batch.stop - batch.start), dtype=bool)
+        for variable in variables:
+            bad |= np.isnan(get_values(aligned, variable, batch))
+        mask[:, batch] = np.packbits(bad, axis=0)
+
+    aligned["masks"][name] = mask
+
+
+def get_values(aligned, variable, gauges=slice(None)):
+    """
+    Get the values of one variable for one gauge or a batch of gauges, as a view of the array.
+
+    Parameters:
+    - aligned (dict): Aligned inputs from align_timeseries.
+    - variable (str): Name of the variable.
+    - gauges (int or slice): Position of the gauge or slice of gauges (see get_batches).
+
+    Returns:
+    - np.array: Values [days] for one gauge or [days x gauges] for a batch.
+    """
+    return aligned["values"][aligned["variables"].index(variable), :, gauges]
+
+
+def get_frame(aligned, variable):
+    """
+    Get one variable as a pd.DataFrame [dates x gauges] sharing the memory of the array (no copy),
+    e.g., to replace its source DataFrame after the alignment.
+
+    Parameters:
+    - aligned (dict): Aligned inputs from align_timeseries.
+    - variable (str): Name of the variable.
+
+    Returns:
+    - pd.DataFrame: Values with the dates as index and the gauges as columns.
+    """
+    return pd.DataFrame(get_values(aligned, variable), index=aligned["dates"], columns=aligned["gauges"], copy=False)
+
+
+def get_quality(aligned, name, gauges=slice(None)):
+    """
+    Get the quality code of one gauge or a batch of gauges from a packed mask.
+
+    Parameters:
+    - aligned (dict): Aligned inputs from align_timeseries.
+    - name (str): Name of the mask (see add_quality_mask).
+    - gauges (int or slice): Position of the gauge or slice of gauges (see get_batches).
+
+    Returns:
+    - np.array: Quality code (uint8) [days] or [days x gauges]. Data with good quality is "0", data
+    with bad quality is "1".
+    """
+    return np.unpackbits(aligned["masks"][name][:, gauges], axis=0, count=len(aligned["dates"]))
+
+
+def get_batches(aligned, batch_size=1000):
+    """
+    Get the slices of batch_size gauges covering all the gauges.
+
+    Parameters:
+    - aligned (dict): Aligned inputs from align_timeseries.
+    - batch_size (int): Number of gauges per batch.
+
+    Returns:
+    - list: List of slices.
+    """
+    num_gauges = len(aligned["gauges"])
+
+    return [slice(start, min(start + batch_size, num_gauges)) for start in range(0, num_gauges, batch_size)]
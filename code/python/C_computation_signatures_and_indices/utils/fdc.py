@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below build a flow duration curve (FDC) cache: the valid values of each gauge are
+sorted only once, for the full record or for each window of time (e.g., years or months), and any
+percentile or exceedance probability is then answered by linear interpolation, with the same result
+as np.percentile over the valid values.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def get_windows(dates, rule):
+    """
+    Get the windows of time used by build_fdc, with the same labels as pd.DataFrame.resample.
+
+    Parameters
+    ----------
+    dates : pd.DatetimeIndex
+        Dates of the time series (sorted).
+    rule : str
+        Frequency of the windows (e.g., "Y", "M", "W" or "QS-MAR").
+
+    Returns
+    -------
+    tuple
+        Position of the first day of each window, number of days of each window and the labels of
+        the windows.
+    """
+    sizes = pd.Series(0, index=dates).resample(rule).size()
+    starts = np.concatenate([[0], np.cumsum(sizes.to_numpy())[:-1]])
+
+    return starts, sizes.to_numpy(), sizes.index
+
+
+def build_fdc(values, valid=None, dates=None, rule=None):
+    """
+    This function sorts the valid values of each gauge within each window of time.
+
+    Parameters
+    ----------
+    values : pd.DataFrame or np.array
+        Daily values [days x gauges] (e.g., streamflow). The sorted values keep their float dtype
+        (e.g., float32 for halving the memory of the cache).
+    valid : np.array
+        Boolean array [days x gauges], True for data with good quality. Default is the non-NaN values.
+    dates : pd.DatetimeIndex
+        Dates of the values, needed only for the windows. Default is the index of values.
+    rule : str
+        Frequency of the windows (see get_windows). None for the full record.
+
+    Returns
+    -------
+    dict
+        FDC cache with the keys "sorted" (values sorted within each window, with NaN at the end),
+        "starts" and "sizes" (first day and number of days of each window), "counts" (number of
+        valid values [windows x gauges]), "windows" (labels of the windows) and "gauges".
+    """
+    gauges = getattr(values, "columns", None)
+    if dates is None and isinstance(values, pd.DataFrame):
+        dates = values.index
+
+    values = np.asarray(values)
+    dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64
+    if valid is None:
+        valid = ~np.isnan(values)
+
+    if rule is None:
+        starts, sizes, windows = np.array([0]), np.array([len(values)]), None
+    else:
+        starts, sizes, windows = get_windows(dates, rule)
+
+    # Only one copy of the values (the one sorted):
+    sorted_values = np.array(values, dtype=dtype)
+    sorted_values[~valid] = np.nan
+
+    # NaN values are sorted to the end of each window, and the valid values of each window are counted:
+    counts = np.zeros((len(starts), values.shape[1]), dtype=np.int64)
+    for window, (start, size) in enumerate(zip(starts, sizes)):
+        sorted_values[start:start + size].sort(axis=0)
+        counts[window] = np.count_nonzero(valid[start:start + size], axis=0)
+
+    return {"sorted": sorted_values, "starts": starts, "sizes": sizes, "counts": counts,
+            "windows": windows, "gauges": gauges}
+
+
+def fdc_percentile(fdc, percentiles, min_count=1, complete=False):
+    """
+    This function calculates percentiles of the valid values of each gauge and window, with the
+    linear interpolation of np.percentile.
+
+    Parameters
+    ----------
+    fdc : dict
+        FDC cache from build_fdc.
+    percentiles : list
+        Percentiles (0 to 100).
+    min_count : int
+        Minimum number of valid values in the window.
+    complete : bool
+        If True, only windows without gaps are used (as np.percentile over a window with NaN).
+
+    Returns
+    -------
+    np.array
+        Percentiles [percentiles x windows x gauges], or [percentiles x gauges] for the full record.
+        NaN for the windows without enough valid values.
+    """
+    quantiles = np.true_divide(np.asarray(percentiles, dtype=float), 100)[:, None, None]
+    counts = fdc["counts"][None]
+
+    # Same indexes and interpolation as numpy (method "linear"):
+    virtual = (counts - 1) * quantiles
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    above = virtual >= counts - 1
+    previous = np.where(above, counts - 1, previous).astype(np.intp)
+    following = np.where(above, counts - 1, previous + 1).astype(np.intp)
+
+    offsets = fdc["starts"][None, :, None]
+    lower = np.take_along_axis(fdc["sorted"], np.maximum(offsets + previous, 0).reshape(-1, counts.shape[2]), axis=0)
+    upper = np.take_along_axis(fdc["sorted"], np.maximum(offsets + following, 0).reshape(-1, counts.shape[2]), axis=0)
+    lower = lower.reshape(virtual.shape)
+    upper = upper.reshape(virtual.shape)
+
+    diff = upper - lower
+    result = lower + diff * gamma
+    np.subtract(upper, diff * (1 - gamma), out=result, where=gamma >= 0.5)
+
+    invalid = (counts < max(min_count, 1)) | np.zeros(virtual.shape, dtype=bool)
+    if complete:
+        invalid |= counts < fdc["sizes"][None, :, None]
+    result[invalid] = np.nan
+
+    return result[:, 0] if fdc["windows"] is None else result
+
+
+def fdc_exceedance(fdc, probabilities, min_count=1, complete=False):
+    """
+    This function calculates the values exceeded a given percentage of the time (e.g., 95 gives the
+    low flow Q95 of the hydrological literature, which is the percentile 5).
+
+    Parameters
+    ----------
+    fdc : dict
+        FDC cache from build_fdc.
+    probabilities : list
+        Exceedance probabilities (0 to 100).
+    min_count : int
+        Minimum number of valid values in the window.
+    complete : bool
+        If True, only windows without gaps are used.
+
+    Returns
+    -------
+    np.array
+        Values [probabilities x windows x gauges], or [probabilities x gauges] for the full record.
+    """
+    return fdc_percentile(fdc, 100 - np.asarray(probabilities, dtype=float), min_count, complete)
+
+
+def fdc_to_dataframe(fdc, values):
+    """
+    This function organizes the result of one query [windows x gauges] as a pd.DataFrame, with the
+    same index as pd.DataFrame.resample.
+
+    Parameters
+    ----------
+    fdc : dict
+        FDC cache from build_fdc.
+    values : np.array
+        Result of one query [windows x gauges] (e.g., fdc_percentile(fdc, [10])[0]).
+
+    Returns
+    -------
+    pd.DataFrame
+        Values with the windows as index and the gauges as columns.
+    """
+    return pd.DataFrame(values, index=fdc["windows"], columns=fdc["gauges"])
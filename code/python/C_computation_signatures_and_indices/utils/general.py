@@ -84,7 +84,7 @@ def longest_gap_measurements(timeseries: pd.DataFrame):
     # Calculate the longest continuous range with no gaps for each gauge
     longest_gap_periods = pd.DataFrame(index=timeseries.columns, columns=['longest_gap_period'])
 
-    for col in tqdm(timeseries.columns):
+    for col in tqdm.tqdm(timeseries.columns):
         max_gap = 0
         current_gap = 0
         for value in timeseries[col]:
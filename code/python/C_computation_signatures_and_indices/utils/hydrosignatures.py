@@ -0,0 +1,816 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below compute the hydrological signatures of Addor et al. (2017) for all the gauges at
+once, on 2-D arrays [days x gauges], following the definitions of the module "hydroanalysis"
+(https://hydroanalysis.readthedocs.io/) used in the notebook "estreams_hydrometeorological_signatures".
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+import tqdm as tqdm
+from scipy.optimize import least_squares
+
+from .fdc import build_fdc, fdc_percentile
+from .instrumentation import record_item, stage
+
+try:
+    from numba import njit, prange
+except ImportError:
+    # Without numba the kernels run as plain (slow) Python:
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda function: function
+
+# Signatures computed by calculate_streamflow_signatures (same names as in the notebook):
+STREAMFLOW_SIGNATURES = ["q_corr", "q_mean", "q_runoff_ratio", "q_elas_Sawicz", "q_elas_Sankarasubramanian",
+                         "slope_sawicz", "slope_yadav", "slope_mcmillan", "slope_addor", "baseflow_index",
+                         "hfd_mean", "hfd_std", "q_5", "q_95", "hq_freq", "hq_dur", "lq_freq", "lq_dur",
+                         "zero_q_freq"]
+
+# Signatures computed by calculate_meteo_signatures (same names as in the notebook):
+METEO_SIGNATURES = ["p_mean", "pet_mean", "aridity", "frac_snow", "hp_freq", "hp_dur", "hp_time", "lp_freq",
+                    "lp_dur", "lp_time"]
+
+# Seasons of the months, as in hydroanalysis.meteo_indexes.calculate_season:
+SEASONS = {1: "Winter", 2: "Winter", 3: "Spring", 4: "Spring", 5: "Spring", 6: "Summer", 7: "Summer",
+           8: "Summer", 9: "Fall", 10: "Fall", 11: "Fall", 12: "Winter"}
+
+
+def get_year_starts(hydro_year):
+    """
+    This function returns the position of the first day of each (hydrological) year.
+
+    Parameters
+    ----------
+    hydro_year : np.array
+        Array expressing the hydrological year of the measurements (sorted by date).
+
+    Returns
+    -------
+    np.array
+        Position of the first day of each year.
+    """
+    hydro_year = np.asarray(hydro_year)
+
+    return np.concatenate([[0], np.flatnonzero(hydro_year[1:] != hydro_year[:-1]) + 1])
+
+
+def calculate_corr(streamflow, precipitation, valid):
+    """
+    This function calculates the Pearson correlation between streamflow and precipitation for each
+    gauge, using only the days with good quality (as pandas.Series.corr).
+
+    Parameters
+    ----------
+    streamflow : np.array
+        Array [days x gauges] of daily streamflow measurements.
+    precipitation : np.array
+        Array [days x gauges] of daily precipitation.
+    valid : np.array
+        Boolean array [days x gauges], True for data with good quality.
+
+    Returns
+    -------
+    np.array
+        Correlation for each gauge.
+    """
+    num_valid = valid.sum(axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        q = np.where(valid, streamflow, 0)
+        p = np.where(valid, precipitation, 0)
+        q = np.where(valid, q - q.sum(axis=0) / num_valid, 0)
+        p = np.where(valid, p - p.sum(axis=0) / num_valid, 0)
+
+        corr = (q * p).sum(axis=0) / np.sqrt((q * q).sum(axis=0) * (p * p).sum(axis=0))
+
+    corr[num_valid < 2] = np.nan
+
+    return corr
+
+
+def calculate_stream_elas(streamflow, precipitation, valid, year_starts):
+    """
+    This function calculates the signature "stream_elas" for each gauge, according to Sawicz et al.
+    (2011) and Sankarasubramanian et al. (2001). The years without any data with good quality are
+    skipped (the anomaly of Sawicz et al. is computed with respect to the previous year with data).
+
+    Parameters
+    ----------
+    streamflow : np.array
+        Array [days x gauges] of daily streamflow measurements.
+    precipitation : np.array
+        Array [days x gauges] of daily precipitation.
+    valid : np.array
+        Boolean array [days x gauges], True for data with good quality.
+    year_starts : np.array
+        Position of the first day of each hydrological year (see get_year_starts).
+
+    Returns
+    -------
+    tuple of np.array
+        Signatures 'Sawicz' and 'Sankarasubramanian' for each gauge. 'Sankarasubramanian' is NaN
+        when the annual streamflow has no anomalies (zero variance).
+    """
+    q = np.where(valid, streamflow, 0)
+    p = np.where(valid, precipitation, 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Global and annual means:
+        num_valid = valid.sum(axis=0)
+        mean_tot_q = q.sum(axis=0) / num_valid
+        mean_tot_p = p.sum(axis=0) / num_valid
+
+        num_valid_year = np.add.reduceat(valid, year_starts, axis=0)
+        mean_year_q = np.add.reduceat(q, year_starts, axis=0) / num_valid_year
+        mean_year_p = np.add.reduceat(p, year_starts, axis=0) / num_valid_year
+
+        # Anomaly computed with respect to previous year with data (Sawicz et al., 2011, HESS)
+        years = np.arange(len(year_starts))[:, None]
+        last_year = np.maximum.accumulate(np.where(num_valid_year > 0, years, -1), axis=0)
+        previous_year = np.vstack([np.full((1, q.shape[1]), -1), last_year[:-1]])
+        has_previous = (previous_year >= 0) & (num_valid_year > 0)
+        previous_year = np.maximum(previous_year, 0)
+
+        diff_q = mean_year_q - np.take_along_axis(mean_year_q, previous_year, axis=0)
+        diff_p = mean_year_p - np.take_along_axis(mean_year_p, previous_year, axis=0)
+        e_sawicz = (diff_q / mean_tot_q) / (diff_p / mean_tot_p)
+        e_sawicz[~has_previous] = np.nan
+
+        # Anomaly computed with respect to long-term mean (Sankarasubramanian et al., 2001, WRR)
+        e_sanka = ((mean_year_q - mean_tot_q) / mean_tot_q) / ((mean_year_p - mean_tot_p) / mean_tot_p)
+
+        # Streamflow without annual anomalies (zero variance, up to round-off) has no elasticity:
+        anomaly_q = np.where(num_valid_year > 0, np.abs(mean_year_q - mean_tot_q), 0)
+        no_variance = ~(anomaly_q > 1e-12 * np.abs(mean_tot_q)).any(axis=0)
+        e_sanka[:, no_variance] = np.nan
+
+    return nanmedian(e_sawicz), nanmedian(e_sanka)
+
+
+def nanmedian(values):
+    """
+    Median along the first axis ignoring NaNs, returning NaN (without warnings) for empty columns.
+    """
+    median = np.full(values.shape[1], np.nan)
+    has_values = (~np.isnan(values)).any(axis=0)
+    if has_values.any():
+        median[has_values] = np.nanmedian(values[:, has_values], axis=0)
+
+    return median
+
+
+def calculate_slope_fdc(fdc, q_mean):
+    """
+    This function calculates the signature "slope_fdc" for each gauge, according to Sawicz et al.
+    (2011), Yadav et al. (2007), McMillan et al. (2017) and Addor et al. (2017).
+
+    Parameters
+    ----------
+    fdc : dict
+        FDC cache of the daily streamflow with good quality (see utils.fdc.build_fdc).
+    q_mean : np.array
+        Mean daily streamflow of each gauge.
+
+    Returns
+    -------
+    tuple of np.array
+        Signatures 'Sawicz', 'Yadav', 'McMillan' and 'Addor' for each gauge.
+    """
+    # The flow exceeded 33 % and 66 % of the time are the percentiles 67 and 34 (same floats as in
+    # the 0.1 % steps of the flow duration curve of hydroanalysis):
+    quantiles = np.arange(start=0, stop=1.001, step=0.001) * 100
+    q33, q66, q33_perc, q66_perc, q_median = fdc_percentile(fdc, [quantiles[670], quantiles[340], 33, 66, 50])
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope_sawicz = (np.log(q33) - np.log(q66)) / (0.66 - 0.33)
+        slope_yadav = ((q33 / q_mean) - (q66 / q_mean)) / (0.66 - 0.33)
+        slope_mcmillan = (np.log(q33 / q_median) - np.log(q66 / q_median)) / (0.66 - 0.33)
+        slope_addor = (np.log(q66_perc) - np.log(q33_perc)) / (0.66 - 0.33)
+
+    # The slopes are not defined when the flow exceeded 66 % of the time is 0:
+    undefined = (q66 == 0) | np.isnan(q66)
+    slopes = []
+    for slope in [slope_sawicz, slope_yadav, slope_mcmillan, slope_addor]:
+        slope[undefined] = np.nan
+        slopes.append(slope)
+
+    return tuple(slopes)
+
+
+def calculate_flag_freq_dur(flag, valid):
+    """
+    This function calculates the frequency (number of days per year) and the mean duration (days) of
+    the events where flag is True (e.g., high flows). As in hydroanalysis, the days with bad quality
+    are removed from the time series, so that they do not interrupt an event.
+
+    Parameters
+    ----------
+    flag : np.array
+        Boolean array [days x gauges] flagging the days of the events.
+    valid : np.array
+        Boolean array [days x gauges], True for data with good quality.
+
+    Returns
+    -------
+    tuple of np.array
+        Frequency and mean duration for each gauge (NaN if there are no events).
+    """
+    flag = flag & valid
+
+    # Flag of the previous day with good quality:
+    days = np.arange(len(flag))[:, None]
+    last_valid = np.maximum.accumulate(np.where(valid, days, -1), axis=0)
+    previous_valid = np.vstack([np.full((1, flag.shape[1]), -1), last_valid[:-1]])
+    previous_flag = np.take_along_axis(flag, np.maximum(previous_valid, 0), axis=0) & (previous_valid >= 0)
+
+    num_flag = flag.sum(axis=0)
+    num_events = (flag & ~previous_flag).sum(axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        freq = num_flag / valid.sum(axis=0) * 365.25
+        dur = num_flag / num_events
+
+    freq[num_flag == 0] = np.nan
+    dur[num_flag == 0] = np.nan
+
+    return freq, dur
+
+
+def calculate_hfd(streamflow, valid, year_starts, threshold_days=360):
+    """
+    This function calculates the signature "hfd" (half-flow date) for each gauge. Only years with at
+    least threshold_days of data with good quality are considered.
+
+    Parameters
+    ----------
+    streamflow : np.array
+        Array [days x gauges] of daily streamflow measurements.
+    valid : np.array
+        Boolean array [days x gauges], True for data with good quality.
+    year_starts : np.array
+        Position of the first day of each hydrological year (see get_year_starts).
+    threshold_days : int
+        Minimum number of days with good quality in a year.
+
+    Returns
+    -------
+    tuple of np.array
+        Mean and standard deviation of the annual half-flow date for each gauge.
+    """
+    q = np.where(valid, streamflow, 0)
+    year_ends = np.append(year_starts[1:], len(q))
+
+    hfd = np.full((len(year_starts), q.shape[1]), np.nan)
+    for i, (start, end) in enumerate(zip(year_starts, year_ends)):
+        q_year = q[start:end]
+        cumsum = np.cumsum(q_year, axis=0)
+
+        # The +1 is needed to get the same definition of Addor
+        hfd[i] = ((cumsum < 0.5 * q_year.sum(axis=0)) & valid[start:end]).sum(axis=0) + 1
+        hfd[i, valid[start:end].sum(axis=0) < threshold_days] = np.nan
+
+    num_years = (~np.isnan(hfd)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hfd_mean = np.nansum(hfd, axis=0) / num_years
+        hfd_std = np.sqrt(np.nansum((hfd - hfd_mean) ** 2, axis=0) / (num_years - 1))
+
+    hfd_mean[num_years == 0] = np.nan
+    hfd_std[num_years < 2] = np.nan
+
+    return hfd_mean, hfd_std
+
+
+@njit(parallel=True, cache=True)
+def lyne_hollick_kernel(streamflow, valid, alpha, num_filters, num_reflect, min_length, baseflow, baseflow_index):
+    """
+    Compiled kernel of the Lyne & Hollick filter as implemented in hydroanalysis (Ladson et al., 2013),
+    run in parallel over the gauges. The filter is applied to each sequence of more than min_length
+    consecutive days with good quality (or to the whole time series if there are no gaps), with
+    num_reflect values reflected at both ends of each sequence.
+
+    The results are written into baseflow [days x gauges] (NaN for the days not filtered) and
+    baseflow_index [gauges] (average of the sequences weighted by their length).
+    """
+    num_days, num_gauges = streamflow.shape
+
+    for gauge in prange(num_gauges):
+        all_valid = True
+        for t in range(num_days):
+            baseflow[t, gauge] = np.nan
+            if not valid[t, gauge]:
+                all_valid = False
+
+        weighted_sum = 0.0
+        total_length = 0
+        start = 0
+        while start < num_days:
+            if not valid[start, gauge]:
+                start += 1
+                continue
+            end = start
+            while end < num_days and valid[end, gauge]:
+                end += 1
+            length = end - start
+
+            if all_valid or length > min_length:
+                # Add reflected values
+                reflect = min(num_reflect, length)
+                q = np.empty(length + 2 * reflect)
+                for i in range(reflect):
+                    q[i] = streamflow[start + reflect - 1 - i, gauge]
+                    q[reflect + length + i] = streamflow[end - 1 - i, gauge]
+                for i in range(length):
+                    q[reflect + i] = streamflow[start + i, gauge]
+
+                # Run the filters (forward, backward, forward, ...), in place:
+                for f in range(num_filters):
+                    first, last, step = (0, len(q), 1) if f % 2 == 0 else (len(q) - 1, -1, -1)
+                    qf = q[first]
+                    previous = q[first]
+                    if qf > 0:
+                        q[first] = q[first] - qf
+                    for t in range(first + step, last, step):
+                        current = q[t]
+                        qf = alpha * qf + 0.5 * (1 + alpha) * (current - previous)
+                        previous = current
+                        if qf > 0:
+                            q[t] = current - qf
+
+                # Remove the reflected values
+                sum_baseflow = 0.0
+                sum_streamflow = 0.0
+                for i in range(length):
+                    baseflow[start + i, gauge] = q[reflect + i]
+                    sum_baseflow += q[reflect + i]
+                    sum_streamflow += streamflow[start + i, gauge]
+
+                weighted_sum += length * (sum_baseflow / sum_streamflow)
+                total_length += length
+
+            start = end
+
+        baseflow_index[gauge] = weighted_sum / total_length if total_length > 0 else np.nan
+
+
+def calculate_baseflow(streamflow, valid, alpha=0.925, num_filters=3, num_reflect=30):
+    """
+    This function separates the baseflow of all the gauges with the Lyne & Hollick filter, as in
+    hydroanalysis: the filter is applied to each sequence of more than num_reflect consecutive days
+    with good quality.
+
+    Parameters
+    ----------
+    streamflow : np.array
+        Array [days x gauges] of daily streamflow measurements.
+    valid : np.array
+        Boolean array [days x gauges], True for data with good quality.
+    alpha : float
+        Parameter of the Lyne & Hollick filter.
+    num_filters : int
+        Number of filter passages (forward, backward, forward, ...).
+    num_reflect : int
+        Minimum length of the sequences with good quality.
+
+    Returns
+    -------
+    tuple of np.array
+        Baseflow [days x gauges] (NaN for the days not filtered) and baseflow index for each gauge
+        (NaN if there are no long enough sequences).
+    """
+    # Fortran order keeps the time series of each gauge contiguous in memory:
+    streamflow = np.asfortranarray(streamflow, dtype=float)
+    valid = np.asfortranarray(valid, dtype=bool)
+    baseflow = np.empty(streamflow.shape, order="F")
+    baseflow_index = np.empty(streamflow.shape[1])
+
+    # hydroanalysis reflects num_filters values at both ends of each sequence:
+    lyne_hollick_kernel(streamflow, valid, alpha, num_filters, num_filters, num_reflect, baseflow, baseflow_index)
+
+    return baseflow, baseflow_index
+
+
+def calculate_baseflow_index(streamflow, valid, alpha=0.925, num_filters=3, num_reflect=30):
+    """
+    This function calculates the signature "baseflow_index" for each gauge (see calculate_baseflow).
+
+    Returns
+    -------
+    np.array
+        Baseflow index for each gauge (NaN if there are no long enough sequences).
+    """
+    return calculate_baseflow(streamflow, valid, alpha, num_filters, num_reflect)[1]
+
+
+def calculate_streamflow_signatures(streamflow, precipitation, quality, hydro_year, batch_size=1000, run=None):
+    """
+    This function calculates all the streamflow signatures of the notebook for all gauges at once.
+    The gauges are processed in batches of batch_size columns, and the results are written into a
+    pre-allocated array.
+
+    Parameters
+    ----------
+    streamflow : pd.DataFrame
+        Daily specific discharge [days x gauges].
+    precipitation : pd.DataFrame
+        Daily precipitation [days x gauges], with the same index and columns as streamflow.
+    quality : pd.DataFrame or np.array
+        Quality code [days x gauges]. Data with good quality is "0", data with bad quality is "1".
+    hydro_year : np.array
+        Array expressing the hydrological year of the measurements.
+    batch_size : int
+        Number of gauges processed at once.
+    run : dict, optional
+        Run from utils.instrumentation.create_run, where the wall time of the function and the
+        latency of each batch are recorded.
+
+    Returns
+    -------
+    pd.DataFrame
+        Signatures [gauges x STREAMFLOW_SIGNATURES]. Signatures that cannot be computed are NaN.
+    """
+    streamflow_values = np.asarray(streamflow, dtype=float)
+    precipitation_values = np.asarray(precipitation, dtype=float)
+    valid_values = np.asarray(quality) == 0
+    year_starts = get_year_starts(hydro_year)
+
+    num_gauges = streamflow_values.shape[1]
+    signatures = np.full((num_gauges, len(STREAMFLOW_SIGNATURES)), np.nan)
+    col = {name: i for i, name in enumerate(STREAMFLOW_SIGNATURES)}
+
+    with stage(run, "calculate_streamflow_signatures"):
+        for start in tqdm.tqdm(range(0, num_gauges, batch_size)):
+            batch = slice(start, min(start + batch_size, num_gauges))
+            batch_start = time.perf_counter()
+            q = streamflow_values[:, batch]
+            p = precipitation_values[:, batch]
+            valid = valid_values[:, batch]
+            num_valid = valid.sum(axis=0)
+
+            with np.errstate(invalid="ignore", divide="ignore"):
+                q_mean = np.where(valid, q, 0).sum(axis=0) / num_valid
+                p_mean = np.where(valid, p, 0).sum(axis=0) / num_valid
+
+            signatures[batch, col["q_corr"]] = calculate_corr(q, p, valid)
+            signatures[batch, col["q_mean"]] = q_mean
+            with np.errstate(invalid="ignore", divide="ignore"):
+                signatures[batch, col["q_runoff_ratio"]] = q_mean / p_mean
+
+            (signatures[batch, col["q_elas_Sawicz"]],
+             signatures[batch, col["q_elas_Sankarasubramanian"]]) = calculate_stream_elas(q, p, valid, year_starts)
+
+            # The valid streamflow of the batch is sorted once, for the slopes, quantiles and thresholds:
+            fdc = build_fdc(q, valid)
+            (signatures[batch, col["slope_sawicz"]], signatures[batch, col["slope_yadav"]],
+             signatures[batch, col["slope_mcmillan"]], signatures[batch, col["slope_addor"]]) = calculate_slope_fdc(fdc, q_mean)
+
+            signatures[batch, col["baseflow_index"]] = calculate_baseflow_index(q, valid)
+
+            (signatures[batch, col["hfd_mean"]],
+             signatures[batch, col["hfd_std"]]) = calculate_hfd(q, valid, year_starts)
+
+            q_5, q_50, q_95 = fdc_percentile(fdc, [5, 50, 95])
+            signatures[batch, col["q_5"]] = q_5
+            signatures[batch, col["q_95"]] = q_95
+
+            # High-flow (> 9 times the median) and low-flow (<= 0.2 times the mean) frequency and duration:
+            with np.errstate(invalid="ignore"):
+                high_flow = q > 9 * q_50
+                low_flow = q <= 0.2 * q_mean
+            (signatures[batch, col["hq_freq"]],
+             signatures[batch, col["hq_dur"]]) = calculate_flag_freq_dur(high_flow, valid)
+            (signatures[batch, col["lq_freq"]],
+             signatures[batch, col["lq_dur"]]) = calculate_flag_freq_dur(low_flow, valid)
+
+            with np.errstate(invalid="ignore", divide="ignore"):
+                signatures[batch, col["zero_q_freq"]] = ((q == 0) & valid).sum(axis=0) / num_valid
+
+            record_item(run, "calculate_streamflow_signatures", f"gauges {start}-{batch.stop - 1}",
+                        seconds=time.perf_counter() - batch_start, num_gauges=batch.stop - start)
+
+    signatures_df = pd.DataFrame(signatures, index=getattr(streamflow, "columns", None),
+                                 columns=STREAMFLOW_SIGNATURES)
+
+    return signatures_df
+
+
+def calculate_flag_season(flag, valid, seasons):
+    """
+    This function calculates the season with the most days flagged (e.g., high precipitation). Ties
+    are resolved by the alphabetical order of the seasons (as scipy.stats.mode).
+
+    Parameters
+    ----------
+    flag : np.array
+        Boolean array [days x gauges] flagging the days of the events.
+    valid : np.array
+        Boolean array [days x gauges], True for data with good quality.
+    seasons : np.array
+        Season of each day (see SEASONS).
+
+    Returns
+    -------
+    np.array
+        Season for each gauge (NaN if there are no events).
+    """
+    flag = flag & valid
+    names = np.array(sorted(set(SEASONS.values())))
+    counts = np.stack([flag[seasons == name].sum(axis=0) for name in names])
+
+    season = names[np.argmax(counts, axis=0)].astype(object)
+    season[counts.sum(axis=0) == 0] = np.nan
+
+    return season
+
+
+def calculate_meteo_signatures(precipitation, pet, temperature, quality, date, batch_size=1000, run=None):
+    """
+    This function calculates the meteorological signatures of the notebook (except "p_seasonality",
+    see calculate_p_seasonality_vectorized) for all gauges at once, following the definitions of
+    hydroanalysis.meteo_indexes.
+
+    Parameters
+    ----------
+    precipitation : pd.DataFrame
+        Daily precipitation [days x gauges].
+    pet : pd.DataFrame
+        Daily potential evapotranspiration [days x gauges].
+    temperature : pd.DataFrame
+        Daily temperature [days x gauges].
+    quality : pd.DataFrame or np.array
+        Quality code [days x gauges]. Data with good quality is "0", data with bad quality is "1".
+    date : pd.DatetimeIndex
+        Dates of the time series.
+    batch_size : int
+        Number of gauges processed at once.
+    run : dict, optional
+        Run from utils.instrumentation.create_run, where the wall time of the function and the
+        latency of each batch are recorded.
+
+    Returns
+    -------
+    pd.DataFrame
+        Signatures [gauges x METEO_SIGNATURES]. Signatures that cannot be computed are NaN.
+    """
+    precipitation_values = np.asarray(precipitation, dtype=float)
+    pet_values = np.asarray(pet, dtype=float)
+    temperature_values = np.asarray(temperature, dtype=float)
+    valid_values = np.asarray(quality) == 0
+    seasons = pd.DatetimeIndex(date).month.map(SEASONS).values
+
+    num_gauges = precipitation_values.shape[1]
+    numeric = [name for name in METEO_SIGNATURES if not name.endswith("_time")]
+    signatures = np.full((num_gauges, len(numeric)), np.nan)
+    col = {name: i for i, name in enumerate(numeric)}
+    hp_time = np.full(num_gauges, np.nan, dtype=object)
+    lp_time = np.full(num_gauges, np.nan, dtype=object)
+
+    with stage(run, "calculate_meteo_signatures"):
+        for start in tqdm.tqdm(range(0, num_gauges, batch_size)):
+            batch = slice(start, min(start + batch_size, num_gauges))
+            batch_start = time.perf_counter()
+            p = precipitation_values[:, batch]
+            valid = valid_values[:, batch]
+            p_valid = np.where(valid, p, 0)
+
+            with np.errstate(invalid="ignore", divide="ignore"):
+                num_valid = valid.sum(axis=0)
+                p_mean = p_valid.sum(axis=0) / num_valid
+                pet_mean = np.where(valid, pet_values[:, batch], 0).sum(axis=0) / num_valid
+
+                signatures[batch, col["p_mean"]] = p_mean
+                signatures[batch, col["pet_mean"]] = pet_mean
+                signatures[batch, col["aridity"]] = pet_mean / p_mean
+
+                # Fraction of precipitation falling on days with temperature below 0 degrees:
+                snow = valid & (temperature_values[:, batch] < 0.0)
+                signatures[batch, col["frac_snow"]] = np.where(snow, p, 0).sum(axis=0) / p_valid.sum(axis=0)
+
+                # High-precipitation (> 5 times the mean) and low-precipitation (< 1 mm/day) days:
+                high_prec = p > 5 * p_mean
+                low_prec = p < 1
+
+            (signatures[batch, col["hp_freq"]],
+             signatures[batch, col["hp_dur"]]) = calculate_flag_freq_dur(high_prec, valid)
+            (signatures[batch, col["lp_freq"]],
+             signatures[batch, col["lp_dur"]]) = calculate_flag_freq_dur(low_prec, valid)
+            hp_time[batch] = calculate_flag_season(high_prec, valid, seasons)
+            lp_time[batch] = calculate_flag_season(low_prec, valid, seasons)
+
+            record_item(run, "calculate_meteo_signatures", f"gauges {start}-{batch.stop - 1}",
+                        seconds=time.perf_counter() - batch_start, num_gauges=batch.stop - start)
+
+    signatures_df = pd.DataFrame(signatures, index=getattr(precipitation, "columns", None), columns=numeric)
+    signatures_df["hp_time"] = hp_time
+    signatures_df["lp_time"] = lp_time
+
+    return signatures_df[METEO_SIGNATURES]
+
+
+def calculate_doy_climatology(values, valid, doy):
+    """
+    This function reduces daily time series to their day-of-year climatology, i.e., the number of
+    days with good quality and the sum of the values for each day of the year.
+
+    Parameters
+    ----------
+    values : np.array
+        Array [days x gauges] of daily values.
+    valid : np.array
+        Boolean array [days x gauges], True for data with good quality.
+    doy : np.array
+        Day of the year of each day (0 to 365).
+
+    Returns
+    -------
+    tuple of np.array
+        Number of days and sum of the values [366 x gauges].
+    """
+    order = np.argsort(doy, kind="stable")
+    doy_sorted = np.asarray(doy)[order]
+    starts = np.concatenate([[0], np.flatnonzero(doy_sorted[1:] != doy_sorted[:-1]) + 1])
+
+    counts = np.zeros((366, values.shape[1]))
+    sums = np.zeros((366, values.shape[1]))
+    counts[doy_sorted[starts]] = np.add.reduceat(valid[order], starts, axis=0)
+    sums[doy_sorted[starts]] = np.add.reduceat(np.where(valid, values, 0)[order], starts, axis=0)
+
+    return counts, sums
+
+
+def fit_harmonic(counts, sums):
+    """
+    This function fits y = mean(y) + a*sin(2*pi*t/365.25) + b*cos(2*pi*t/365.25) by linear least
+    squares for each gauge, where mean(y) is the mean of the data with good quality. The fit over the
+    day-of-year climatology is the same as the fit over all the daily values.
+
+    Parameters
+    ----------
+    counts : np.array
+        Number of days with good quality [366 x gauges] (see calculate_doy_climatology).
+    sums : np.array
+        Sum of the values [366 x gauges] (see calculate_doy_climatology).
+
+    Returns
+    -------
+    tuple of np.array
+        Mean, amplitude and phase (days) of the sine for each gauge. The amplitude and phase are NaN
+        when the fit is not defined (e.g., data for only one day of the year).
+    """
+    omega = 2 * np.pi / 365.25
+    sin_t = np.sin(omega * np.arange(366))
+    cos_t = np.cos(omega * np.arange(366))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums.sum(axis=0) / counts.sum(axis=0)
+        residual = sums - counts * mean
+
+        # Normal equations of the two coefficients:
+        s_ss = (sin_t ** 2) @ counts
+        s_cc = (cos_t ** 2) @ counts
+        s_sc = (sin_t * cos_t) @ counts
+        r_s = sin_t @ residual
+        r_c = cos_t @ residual
+
+        det = s_ss * s_cc - s_sc ** 2
+        a = (s_cc * r_s - s_sc * r_c) / det
+        b = (s_ss * r_c - s_sc * r_s) / det
+
+    # a*sin(wt) + b*cos(wt) = amplitude*sin(w(t - phase))
+    amplitude = np.hypot(a, b)
+    phase = np.mod(np.arctan2(-b, a) / omega, 365.25)
+
+    singular = ~(det > 1e-9 * s_ss * s_cc)
+    amplitude[singular] = np.nan
+    phase[singular] = np.nan
+
+    return mean, amplitude, phase
+
+
+def fit_p_seasonality_bounded(counts, sums, within_ss, sp_first_guess):
+    """
+    This function fits the sine of the precipitation of one gauge with the bounded non-linear least
+    squares of hydroanalysis (corrected function of the notebook), over the day-of-year climatology
+    instead of the daily values.
+
+    The residual of each day of the year is the mean residual of its days weighted by sqrt(number of
+    days), and one constant residual holds the spread of the daily values around their day-of-year
+    mean. The cost, gradient and Jacobian are then the same as with the daily values, so the fit
+    follows the same steps with 367 residuals instead of one per day.
+
+    Parameters
+    ----------
+    counts : np.array
+        Number of days with good quality for each day of the year [366] (see calculate_doy_climatology).
+    sums : np.array
+        Sum of the precipitation for each day of the year [366].
+    within_ss : float
+        Sum of the squared differences between the daily values and their day-of-year mean.
+    sp_first_guess : float
+        First guess of the phase (days), as in the notebook.
+
+    Returns
+    -------
+    tuple of float
+        Relative amplitude (delta_p) and phase (s_p) of the precipitation.
+    """
+    observed = counts > 0
+    t_julian = np.flatnonzero(observed)  # 1 Jan is zero
+    weights = np.sqrt(counts[observed])
+    prec_doy = sums[observed] / counts[observed]
+    prec_mean = sums.sum() / counts.sum()
+    spread = np.sqrt(max(within_ss, 0.0))
+
+    def fit_p(pars):
+        prec = prec_mean * (1 + pars[0] * np.sin(2 * np.pi * (t_julian - pars[1]) / 365.25))
+        return np.append(weights * (prec_doy - prec), spread)
+
+    prec_pars = least_squares(fun=fit_p, x0=[0.4, sp_first_guess], bounds=([-1, 0], [1, 365.25]))
+
+    return prec_pars.x[0], prec_pars.x[1]
+
+
+def calculate_p_seasonality_vectorized(precipitation, temperature, quality, date, batch_size=1000, run=None):
+    """
+    This function calculates the signature "p_seasonality" of Addor et al. (2017) for all the
+    gauges at once, with the same definition as the corrected function of the notebook.
+
+    The sine of the temperature (unbounded fit) is fitted in closed form by linear least squares over
+    the day-of-year climatology of all the gauges at once. The sine of the precipitation is fitted
+    for each gauge with the same bounded non-linear fit as the notebook (see
+    fit_p_seasonality_bounded), since this fit may stop at a local optimum or at the bounds of the
+    phase (e.g., for weakly seasonal catchments), which the closed form would not reproduce. Both
+    fits use the day-of-year climatology (366 points) instead of the daily values.
+
+    Parameters
+    ----------
+    precipitation : pd.DataFrame
+        Daily precipitation [days x gauges].
+    temperature : pd.DataFrame
+        Daily temperature [days x gauges], with the same index and columns as precipitation.
+    quality : pd.DataFrame or np.array
+        Quality code [days x gauges]. Data with good quality is "0", data with bad quality is "1".
+    date : pd.DatetimeIndex
+        Dates of the time series.
+    batch_size : int
+        Number of gauges processed at once.
+    run : dict, optional
+        Run from utils.instrumentation.create_run, where the wall time of the function and the
+        latency of each batch are recorded.
+
+    Returns
+    -------
+    pd.Series
+        Signature for each gauge (NaN for gauges without data with good quality).
+    """
+    precipitation_values = np.asarray(precipitation, dtype=float)
+    temperature_values = np.asarray(temperature, dtype=float)
+    valid_values = np.asarray(quality) == 0
+    date = pd.DatetimeIndex(date)
+    doy = np.asarray(date.dayofyear - 1)  # 1 Jan is zero
+    month = np.asarray(date.month - 1)
+
+    num_gauges = precipitation_values.shape[1]
+    p_seasonality = np.full(num_gauges, np.nan)
+
+    with stage(run, "calculate_p_seasonality_vectorized"):
+        for start in range(0, num_gauges, batch_size):
+            batch = slice(start, min(start + batch_size, num_gauges))
+            batch_start = time.perf_counter()
+            p = precipitation_values[:, batch]
+            valid = valid_values[:, batch]
+
+            counts, sums_t = calculate_doy_climatology(temperature_values[:, batch], valid, doy)
+            _, delta_t, st = fit_harmonic(counts, sums_t)
+
+            _, sums_p = calculate_doy_climatology(p, valid, doy)
+            p_valid = np.where(valid, p, 0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                within_ss = (p_valid ** 2).sum(axis=0) - np.where(counts > 0, sums_p ** 2 / counts, 0).sum(axis=0)
+
+                # First guess of the phase as in the notebook -> month with the most precipitation:
+                counts_month, sums_month = calculate_doy_climatology(p, valid, month)
+                mean_month_prec = sums_month[:12] / counts_month[:12]
+
+            delta_p = np.full(p.shape[1], np.nan)
+            sp = np.full(p.shape[1], np.nan)
+            for gauge in np.flatnonzero(valid.any(axis=0)):
+                sp_first_guess = 90 - np.nanargmax(mean_month_prec[:, gauge]) * 30
+                sp_first_guess = sp_first_guess + 360 if sp_first_guess < 0 else sp_first_guess
+                delta_p[gauge], sp[gauge] = fit_p_seasonality_bounded(counts[:, gauge], sums_p[:, gauge],
+                                                                      within_ss[gauge], sp_first_guess)
+
+            p_seasonality[batch] = delta_p * np.sign(delta_t) * np.cos(2 * np.pi * (sp - st) / 365.25)
+
+            record_item(run, "calculate_p_seasonality_vectorized", f"gauges {start}-{batch.stop - 1}",
+                        seconds=time.perf_counter() - batch_start, num_gauges=batch.stop - start)
+
+    return pd.Series(p_seasonality, index=getattr(precipitation, "columns", None), name="p_seasonality")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below handle the tables of results (e.g., signatures per catchment) with a declared
+schema: each column has a fixed dtype (float32, Int16, datetime or category), units, a description
+and, when applicable, the threshold used. The tables are pre-allocated, filled by whole columns and
+written to Parquet with the schema as metadata.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Seasons used for the timing of high and low precipitation:
+SEASONS_DTYPE = pd.CategoricalDtype(["Fall", "Spring", "Summer", "Winter"])
+
+# Schema of the hydro-meteorological signatures (notebook "estreams_hydrometeorological_signatures"):
+SIGNATURES_SCHEMA = {
+    "q_corr": {"dtype": "float32", "units": "-",
+               "description": "Pearson correlation between daily streamflow and precipitation"},
+    "q_mean": {"dtype": "float32", "units": "mm/day", "description": "Mean daily streamflow"},
+    "q_runoff_ratio": {"dtype": "float32", "units": "-", "description": "Ratio of mean streamflow to mean precipitation"},
+    "q_elas_Sawicz": {"dtype": "float32", "units": "-",
+                      "description": "Streamflow-precipitation elasticity (Sawicz et al., 2011)"},
+    "q_elas_Sankarasubramanian": {"dtype": "float32", "units": "-",
+                                  "description": "Streamflow-precipitation elasticity (Sankarasubramanian et al., 2001)"},
+    "slope_sawicz": {"dtype": "float32", "units": "-",
+                     "description": "Slope of the flow duration curve (Sawicz et al., 2011)",
+                     "threshold": "between the flows exceeded 33 % and 66 % of the time"},
+    "slope_yadav": {"dtype": "float32", "units": "-",
+                    "description": "Slope of the flow duration curve normalized by the mean (Yadav et al., 2007)",
+                    "threshold": "between the flows exceeded 33 % and 66 % of the time"},
+    "slope_mcmillan": {"dtype": "float32", "units": "-",
+                       "description": "Slope of the flow duration curve normalized by the median (McMillan et al., 2017)",
+                       "threshold": "between the flows exceeded 33 % and 66 % of the time"},
+    "slope_addor": {"dtype": "float32", "units": "-",
+                    "description": "Slope of the flow duration curve (Addor et al., 2017)",
+                    "threshold": "between the percentiles 33 and 66"},
+    "baseflow_index": {"dtype": "float32", "units": "-",
+                       "description": "Ratio of mean baseflow to mean streamflow (Lyne & Hollick filter)",
+                       "threshold": "alpha = 0.925, 3 passes, sequences of more than 30 days"},
+    "hfd_mean": {"dtype": "float32", "units": "days",
+                 "description": "Mean half-flow date (days since the start of the hydrological year)",
+                 "threshold": "years with at least 360 days"},
+    "hfd_std": {"dtype": "float32", "units": "days", "description": "Standard deviation of the half-flow date",
+                "threshold": "years with at least 360 days"},
+    "q_5": {"dtype": "float32", "units": "mm/day", "description": "5 % flow quantile (low flow)"},
+    "q_95": {"dtype": "float32", "units": "mm/day", "description": "95 % flow quantile (high flow)"},
+    "hq_freq": {"dtype": "float32", "units": "days/year", "description": "Frequency of high-flow days",
+                "threshold": "Q > 9 * median(Q)"},
+    "hq_dur": {"dtype": "float32", "units": "days", "description": "Mean duration of high-flow events",
+               "threshold": "Q > 9 * median(Q)"},
+    "lq_freq": {"dtype": "float32", "units": "days/year", "description": "Frequency of low-flow days",
+                "threshold": "Q <= 0.2 * mean(Q)"},
+    "lq_dur": {"dtype": "float32", "units": "days", "description": "Mean duration of low-flow events",
+               "threshold": "Q <= 0.2 * mean(Q)"},
+    "zero_q_freq": {"dtype": "float32", "units": "-", "description": "Fraction of days with zero streamflow",
+                    "threshold": "Q = 0"},
+    "p_mean": {"dtype": "float32", "units": "mm/day", "description": "Mean daily precipitation"},
+    "pet_mean": {"dtype": "float32", "units": "mm/day", "description": "Mean daily potential evapotranspiration"},
+    "aridity": {"dtype": "float32", "units": "-", "description": "Ratio of mean PET to mean precipitation"},
+    "p_seasonality": {"dtype": "float32", "units": "-",
+                      "description": "Seasonality and timing of precipitation (Woods, 2009)"},
+    "frac_snow": {"dtype": "float32", "units": "-", "description": "Fraction of precipitation falling as snow",
+                  "threshold": "T < 0 degC"},
+    "hp_freq": {"dtype": "float32", "units": "days/year", "description": "Frequency of high-precipitation days",
+                "threshold": "P > 5 * mean(P)"},
+    "hp_dur": {"dtype": "float32", "units": "days", "description": "Mean duration of high-precipitation events",
+               "threshold": "P > 5 * mean(P)"},
+    "hp_time": {"dtype": SEASONS_DTYPE, "units": "season", "description": "Season with most high-precipitation days",
+                "threshold": "P > 5 * mean(P)"},
+    "lp_freq": {"dtype": "float32", "units": "days/year", "description": "Frequency of dry days",
+                "threshold": "P < 1 mm/day"},
+    "lp_dur": {"dtype": "float32", "units": "days", "description": "Mean duration of dry periods",
+               "threshold": "P < 1 mm/day"},
+    "lp_time": {"dtype": SEASONS_DTYPE, "units": "season", "description": "Season with most dry days",
+                "threshold": "P < 1 mm/day"},
+    "num_years_hydro": {"dtype": "Int16", "units": "years", "description": "Number of years with streamflow data"},
+    "start_date_hydro": {"dtype": "datetime64[ns]", "units": "date", "description": "First date with streamflow data"},
+    "end_date_hydro": {"dtype": "datetime64[ns]", "units": "date", "description": "Last date with streamflow data"},
+    "num_years_climatic": {"dtype": "Int16", "units": "years", "description": "Number of years with climatic data"},
+    "start_date_climatic": {"dtype": "datetime64[ns]", "units": "date", "description": "First date with climatic data"},
+    "end_date_climatic": {"dtype": "datetime64[ns]", "units": "date", "description": "Last date with climatic data"},
+}
+
+
+def allocate_results(index, schema=SIGNATURES_SCHEMA, dtype="float32"):
+    """
+    Pre-allocate a table of results with the dtypes of the schema, filled with missing values.
+
+    Parameters:
+    - index (pd.Index): Rows of the table (e.g., the basin_id of the catchments or the years).
+    - schema (dict or list): Column name as key and a dict with "dtype", "units", "description" and
+    optionally "threshold" as values. A list of column names gives columns of the same dtype.
+    - dtype (str): Dtype of the columns when schema is a list of column names (e.g., "float64" for
+    tables exported with full precision).
+
+    Returns:
+    - pd.DataFrame: Table with one typed column per entry of the schema.
+    """
+    if not isinstance(schema, dict):
+        schema = {name: {"dtype": dtype} for name in schema}
+
+    missing = pd.Series(np.nan, index=index)
+    columns = {name: missing.astype(field["dtype"]) for name, field in schema.items()}
+
+    return pd.DataFrame(columns, index=index)
+
+
+def fill_column(results, column, values):
+    """
+    Write values into one pre-allocated column of results, in place and keeping its dtype.
+
+    Parameters:
+    - results (pd.DataFrame): Table from allocate_results.
+    - column (str): Column to be filled.
+    - values (scalar, np.array or pd.Series): One value for all rows, one value per row, or a
+    pd.Series aligned on the index of results (the rows not in values are not changed).
+    """
+    position = results.columns.get_loc(column)
+    dtype = results.dtypes.iloc[position]
+
+    if isinstance(values, pd.Series):
+        rows = results.index.get_indexer(values.index)
+        if (rows < 0).any():
+            raise KeyError(f"{(rows < 0).sum()} rows of {column} are not in the results")
+        values = values.to_numpy()
+    else:
+        rows = slice(None)
+        values = np.broadcast_to(values, len(results))
+
+    values = pd.Series(values).astype(dtype)
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        results.iloc[rows, position] = values.array
+    else:
+        results.iloc[rows, position] = values.to_numpy()
+
+
+def fill_results(results, values):
+    """
+    Write all the columns of values (e.g., the signatures of a group of catchments) into the
+    pre-allocated results, keeping the dtypes of the schema.
+
+    Parameters:
+    - results (pd.DataFrame): Table from allocate_results.
+    - values (pd.DataFrame): Values with rows in the index and columns in the columns of results.
+    """
+    for column in values.columns:
+        fill_column(results, column, values[column])
+
+
+def write_results(results, path, schema=SIGNATURES_SCHEMA, metadata=None):
+    """
+    Write a table of results to Parquet, with the units, description and threshold of each column
+    as field metadata and the full schema as table metadata.
+
+    Parameters:
+    - results (pd.DataFrame): Table of results.
+    - path (str): Path to the Parquet file.
+    - schema (dict): Schema of the columns (see allocate_results).
+    - metadata (dict): Other information saved with the table (e.g., period or version).
+    """
+    table = pa.Table.from_pandas(results, preserve_index=True)
+
+    fields = []
+    for field in table.schema:
+        info = {key: str(value) for key, value in schema.get(field.name, {}).items() if key != "dtype"}
+        fields.append(field.with_metadata(info) if info else field)
+
+    description = {"columns": {name: {key: str(value) for key, value in field.items()}
+                               for name, field in schema.items() if name in results.columns},
+                   **(metadata or {})}
+    table_metadata = {**table.schema.metadata, b"estreams": json.dumps(description).encode()}
+
+    pq.write_table(pa.Table.from_arrays(table.columns, schema=pa.schema(fields, metadata=table_metadata)), path)
+
+
+def read_results_metadata(path):
+    """
+    Read the schema and the other information saved with write_results.
+
+    Parameters:
+    - path (str): Path to the Parquet file.
+
+    Returns:
+    - dict: "columns" with the units, description and threshold of each column, and the other
+    information given to write_results.
+    """
+    metadata = pq.read_schema(path).metadata or {}
+
+    return json.loads(metadata.get(b"estreams", b"{}"))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+Checks the HTTP recipes of the streamflow providers (see utils.providers) against the responses in
+the folder "recorded_responses" (one sub-folder per provider): the requests of each station are
+replayed, and the response is saved as the provider file and read back by the provider reader. A
+change of the requests (e.g., the date windows of Hub'Eau) or of the parsing makes the check fail.
+
+The responses can be recorded again with utils.providers.record_responses, e.g.:
+    record_responses("FR", ["A021005050"], "recorded_responses/FR")
+
+Usage (from the folder "code/python/D_demonstration_streamflow_data"):
+    python check_providers.py
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+from utils.providers import PROVIDERS, check_provider
+
+# Folder with the recorded responses (one sub-folder per provider, e.g., "FR" or "IT_ISPRA"):
+PATH_RECORDED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorded_responses")
+
+
+def main():
+    results = []
+    for name in sorted(os.listdir(PATH_RECORDED)):
+        if name not in PROVIDERS:
+            continue
+        status = check_provider(name, os.path.join(PATH_RECORDED, name))
+        status.insert(0, "provider", name)
+        results.append(status)
+
+    results = pd.concat(results, ignore_index=True)
+    print(results.to_string(index=False))
+
+    # Non-zero exit code when a station failed (e.g., for a CI job):
+    return int((results.status != "done").any())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,127 +4,116 @@ This file is part of the EStreams dataset. See https://github.com/EStreams for d
 
 Coded by: Thiago Nascimento
 """
-import geopandas as gpd
-import pandas as pd
-from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import WebDriverException
+from .browser import create_session, close_session, create_pool, close_pool, run_pool, wait_for, list_downloads, wait_for_download
 
-def download_data_FR(Code):
+# URL for accessing the hydrological data for a specific station, and for searching old stations
+URL_FR = "https://www.hydro.eaufrance.fr/stationhydro/station_name/series"
+URL_SEARCH_FR = "https://www.hydro.eaufrance.fr/rechercher/entites-hydrometriques"
+
+def export_series_FR(driver, start_date, end_date):
     """
-    Downloads streamflow data from the French national hydrology database (eaufrance.fr) for a specified station code.
+    Fills the form of the series page (daily mean streamflow between two dates) and exports it as a csv-file.
     
     Args:
+    - driver (webdriver.Chrome): Browser at the series page of the station
+    - start_date (str): Start date (dd/mm/yyyy)
+    - end_date (str): End date (dd/mm/yyyy)
+    """
+    # Set the start and end date for the data retrieval
+    wait_for(driver, '//*[@id="hydro_series_startAt"]').send_keys(start_date)
+    wait_for(driver, '//*[@id="hydro_series_endAt"]').send_keys(end_date)
+    
+    # Refresh the page
+    wait_for(driver, '//*[@id="hydro_series_endAt"]').send_keys(Keys.RETURN)
+
+    # Selecting options and clicking buttons
+    wait_for(driver, '//*[@id="hydro_series_variableType_1"]').click()
+    wait_for(driver, '//*[@id="hydro_series_dailyVariable"]/option[3]').click()
+    wait_for(driver, '//*[@id="hydro_series_step"]').send_keys("1")
+
+    # Click the search button
+    wait_for(driver, '/html/body/div[2]/main/div/div[2]/div/div[1]/div[2]/div/form/div[5]/button').click()
+
+    # Perform actions to configure units, change to table format, and download data (each button is awaited until it is loaded)
+    for xpath in ["/html/body/div[2]/main/div/div[2]/div/div[2]/div/div/div[4]/div/div[1]/div/div[1]/div/button[1]",
+                  "/html/body/div[2]/main/div/div[2]/div/div[2]/div/div/div[2]/div/div/a[2]",
+                  "/html/body/div[2]/main/div/div[2]/div/div[2]/div/div/div[5]/div[1]/button"]:
+        button = wait_for(driver, xpath)
+        driver.execute_script("arguments[0].click();", button)
+
+def download_station_FR(session, Code, timeout=60):
+    """
+    Downloads the streamflow data of one station with an open browser session (see utils.browser).
+    
+    Args:
+    - session (dict): Browser session
     - Code (str): Station code
+    - timeout (float): Maximum seconds to wait for the download
     
     Returns:
-    - None
+    - str: Path to the downloaded file
     """
-    # URL for accessing the hydrological data for a specific station
-    URL = "https://www.hydro.eaufrance.fr/stationhydro/station_name/series"
-    station = Code
+    driver = session["driver"]
+    before = list_downloads(session)
 
-    # Path to the Chrome driver executable
-    chrome_driver_path = 'code/python/D_demonstration_streamflow_data/chromedriver.exe'
-
-    # Configure Chrome options
-    options = Options()
-    #options.add_argument('--headless')  # Run Chrome in headless mode (optional)
-    #options.add_argument('--disable-gpu')  # Disable GPU acceleration (optional)
-    #options.add_argument('--no-sandbox')  # Bypass OS security model (optional)
-
-    # Set up the service
-    service = Service(chrome_driver_path)
-
-    # Create a WebDriver instance with the specified path
-    driver = webdriver.Chrome(service=service, options=options)
-
-    path = URL.replace("station_name", station)
+    path = URL_FR.replace("station_name", Code)
     
     # Access the URL
     driver.get(path)
     
     # Handling cases where the station might be deprecated
     try:
-        # Set the start and end date for the data retrieval
-        driver.find_element(By.XPATH, '//*[@id="hydro_series_startAt"]').send_keys("01/09/1840")
-        driver.find_element(By.XPATH, '//*[@id="hydro_series_endAt"]').send_keys("30/09/2023")
-        
-        # Refresh the page
-        driver.find_element(By.XPATH, '//*[@id="hydro_series_endAt"]').send_keys(Keys.RETURN)
+        export_series_FR(driver, "01/09/1840", "30/09/2023")
+    except WebDriverException:
+        # Refresh the system to search for old stations
+        driver.get(URL_SEARCH_FR)
+        wait_for(driver, '//*[@id="shortcut-0"]').click()
+        wait_for(driver, '//*[@id="hydro_entities_search_code"]').send_keys(Code)
+        wait_for(driver, '//*[@id="form-search"]/form/div[1]/div/div[4]/button[1]').click()
     
-        # Selecting options and clicking buttons
-        driver.find_element(By.XPATH, '//*[@id="hydro_series_variableType_1"]').click()
-        driver.find_element(By.XPATH, '//*[@id="hydro_series_dailyVariable"]/option[3]').click()
-        driver.find_element(By.XPATH, '//*[@id="hydro_series_step"]').send_keys("1")
-
-        # Click the search button
-        driver.find_element(By.XPATH, '/html/body/div[2]/main/div/div[2]/div/div[1]/div[2]/div/form/div[5]/button').click()
+        # Refresh the page and try again
+        driver.get(path)
+        export_series_FR(driver, "01/01/1840", "31/12/2023")
 
-        # Set a longer wait time to ensure all elements are loaded
-        driver.implicitly_wait(10)
-        
-        # Perform actions to configure units, change to table format, and download data
-        button = driver.find_element(By.XPATH, "/html/body/div[2]/main/div/div[2]/div/div[2]/div/div/div[4]/div/div[1]/div/div[1]/div/button[1]")
-        driver.execute_script("arguments[0].click();", button)
-
-        button = driver.find_element(By.XPATH, "/html/body/div[2]/main/div/div[2]/div/div[2]/div/div/div[2]/div/div/a[2]")
-        driver.execute_script("arguments[0].click();", button)
+    # Wait for the download to complete
+    return wait_for_download(session, before, timeout)
 
-        button = driver.find_element(By.XPATH, "/html/body/div[2]/main/div/div[2]/div/div[2]/div/div/div[5]/div[1]/button")
-        driver.execute_script("arguments[0].click();", button)
-        
-        # Wait for the download to complete
-        time.sleep(2)  # Increase the sleep time if necessary
-        #while not any(fname.endswith('.csv') for fname in os.listdir(download_dir)):
-        #    time.sleep(1)
-        
-    except Exception as e:
-        
-        try:
-            # Refresh the system to search for old stations
-            driver.get("https://www.hydro.eaufrance.fr/rechercher/entites-hydrometriques")
-            driver.find_element(By.XPATH, '//*[@id="shortcut-0"]').click()
-            driver.find_element(By.XPATH, '//*[@id="hydro_entities_search_code"]').send_keys(station)
-            driver.find_element(By.XPATH, '//*[@id="form-search"]/form/div[1]/div/div[4]/button[1]').click()
-        
-            # Refresh the page and try again
-            driver.get(path)
-        
-            # Set the start and end date for the data retrieval
-            driver.find_element(By.XPATH, '//*[@id="hydro_series_startAt"]').send_keys("01/01/1840")
-            driver.find_element(By.XPATH, '//*[@id="hydro_series_endAt"]').send_keys("31/12/2023")
-        
-            # Refresh the page
-            driver.find_element(By.XPATH, '//*[@id="hydro_series_endAt"]').send_keys(Keys.RETURN)
+def download_data_FR(Code):
+    """
+    Downloads streamflow data from the French national hydrology database (eaufrance.fr) for a specified station code.
     
-            # Selecting options and clicking buttons
-            driver.find_element(By.XPATH, '//*[@id="hydro_series_variableType_1"]').click()
-            driver.find_element(By.XPATH, '//*[@id="hydro_series_dailyVariable"]/option[3]').click()
-            driver.find_element(By.XPATH, '//*[@id="hydro_series_step"]').send_keys("1")
-
-            # Click the search button
-            driver.find_element(By.XPATH, '/html/body/div[2]/main/div/div[2]/div/div[1]/div[2]/div/form/div[5]/button').click()
-
-            # Set a longer wait time to ensure all elements are loaded
-            driver.implicitly_wait(10)
-        
-            # Perform actions to configure units, change to table format, and download data
-            button = driver.find_element(By.XPATH, "/html/body/div[2]/main/div/div[2]/div/div[2]/div/div/div[4]/div/div[1]/div/div[1]/div/button[1]")
-            driver.execute_script("arguments[0].click();", button)
-
-            button = driver.find_element(By.XPATH, "/html/body/div[2]/main/div/div[2]/div/div[2]/div/div/div[2]/div/div/a[2]")
-            driver.execute_script("arguments[0].click();", button)
-
-            button = driver.find_element(By.XPATH, "/html/body/div[2]/main/div/div[2]/div/div[2]/div/div/div[5]/div[1]/button")
-            driver.execute_script("arguments[0].click();", button)     
-        
-        except Exception as e:
-            print(f"Failed to download data for station {station} after retry. Exception: {str(e)}")
-        else:
-            pass
+    Args:
+    - Code (str): Station code
+    
+    Returns:
+    - None
+    """
+    session = create_session(headless=False)
+    try:
+        download_station_FR(session, Code)
+    except (WebDriverException, TimeoutError) as e:
+        print(f"Failed to download data for station {Code} after retry. Exception: {str(e)}")
+    finally:
+        close_session(session)
 
-    else:
-        pass
+def download_many_FR(Codes, num_sessions=4, download_dir=None, headless=True, run=None):
+    """
+    Downloads the streamflow data of many stations, sharing a pool of browser sessions (see utils.browser).
+    
+    Args:
+    - Codes (list): Station codes
+    - num_sessions (int): Number of browser sessions working at the same time
+    - download_dir (str): Folder of the downloaded files (default: the Downloads folder)
+    - headless (bool): Run the browsers without a window
+    - run (dict): Run from utils.instrumentation.create_run, where the latency of each station is recorded (optional)
+    
+    Returns:
+    - pd.DataFrame: Status of each station (item, status, seconds, error and path to the file)
+    """
+    pool = create_pool(num_sessions, headless=headless, download_dir=download_dir)
+    try:
+        return run_pool(pool, download_station_FR, Codes, run=run)
+    finally:
+        close_pool(pool)
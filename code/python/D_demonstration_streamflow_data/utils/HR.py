@@ -4,23 +4,16 @@ This file is part of the EStreams dataset. See https://github.com/EStreams for d
 
 Coded by: Thiago Nascimento
 """
-import geopandas as gpd
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-import requests
-import xml.etree.ElementTree as ET
 import pandas as pd
 from selenium.webdriver.common.by import By
 import re
 import numpy as np
-import tqdm
-import time
 import warnings
 warnings.simplefilter(action='ignore', category=Warning)
 from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
+from .browser import create_pool, close_pool, run_pool, wait_for, wait_for_change, get_html
+
+URL_HR = "https://hidro.dhz.hr"
 
 def extract_first_table_to_dataframe(tables_in_new_panel):
     # Check if there are tables available
@@ -61,47 +54,62 @@ def extract_protok_data_range(text):
     else:
         return np.nan
 
-def get_metadata_HR(num_stations):
-    tables_dict_1 = {}
-    tables_dict_2 = {}
-
-    URL = "https://hidro.dhz.hr"
-    chrome_driver_path = 'code/python/D_demonstration_streamflow_data/chromedriver.exe'
-    
-    chrome_options = Options()
-    chrome_options.add_argument('--headless')
-    service = Service(chrome_driver_path)
-    driver = webdriver.Chrome(service=service, options=chrome_options)
-
-    driver.get(URL)
-    driver.implicitly_wait(10)
+def open_stations_list_HR(session):
+    """
+    Opens the list of hydrological stations (the menus are followed from the home page once per browser session).
+    """
+    driver = session["driver"]
+    driver.get(URL_HR)
     
-    driver.find_element(By.XPATH, '//*[@id="ext-gen139"]/em/span/span/span').click()
-    button = driver.find_element(By.XPATH, "/html/body/div[1]/div/div/div[2]/div[1]/div[1]/ul/li[3]/a[2]/em/span/span")
+    wait_for(driver, '//*[@id="ext-gen139"]/em/span/span/span').click()
+    button = wait_for(driver, "/html/body/div[1]/div/div/div[2]/div[1]/div[1]/ul/li[3]/a[2]/em/span/span", "present")
     driver.execute_script("arguments[0].click();", button)
-    button = driver.find_element(By.XPATH, "/html/body/div[8]/div[2]/div[2]/div/div/div/div[1]/table/tbody/tr/td[2]/table/tbody/tr/td[1]/table/tbody/tr/td/table/tbody/tr[2]/td[2]/em/button")
+    button = wait_for(driver, "/html/body/div[8]/div[2]/div[2]/div/div/div/div[1]/table/tbody/tr/td[2]/table/tbody/tr/td[1]/table/tbody/tr/td/table/tbody/tr[2]/td[2]/em/button", "present")
     driver.execute_script("arguments[0].click();", button)
 
-    for station in tqdm.tqdm(range(1, num_stations + 1)):
-        driver.find_element(By.XPATH, f'//*[@id="ext-gen239"]/div[{station}]').click()
-        driver.implicitly_wait(1)
-
-        iframe_xpath = '/html/body/div[1]/div/div/div[2]/div[2]/div/div[3]/div/div/div[1]/div[2]/div/iframe'
-        iframe_element = driver.find_element(By.XPATH, iframe_xpath)
-        driver.switch_to.frame(iframe_element)
+def get_station_metadata_HR(session, station):
+    """
+    Reads the tables of one station of the list (see open_stations_list_HR).
+    
+    Returns:
+    - tuple: First table as a DataFrame and the text of the second table
+    """
+    driver = session["driver"]
+    wait_for(driver, f'//*[@id="ext-gen239"]/div[{station}]').click()
 
+    iframe_xpath = '/html/body/div[1]/div/div/div[2]/div[2]/div/div[3]/div/div/div[1]/div[2]/div/iframe'
+    iframe_element = wait_for(driver, iframe_xpath, "present")
+    driver.switch_to.frame(iframe_element)
+    try:
+        wait_for(driver, '(//table)[2]', "present")
         tables_in_new_panel = driver.find_elements(By.TAG_NAME, 'table')
         first_table_df = extract_first_table_to_dataframe(tables_in_new_panel)
-        tables_dict_1[station] = first_table_df
-        tables_dict_2[station] = tables_in_new_panel[1].text
-
+        text = tables_in_new_panel[1].text
+    finally:
         driver.switch_to.default_content()
 
-    dataframes_list = list(tables_dict_1.values())
-    stations_infos = pd.concat(dataframes_list, ignore_index=True)
+    return first_table_df, text
+
+def get_metadata_HR(num_stations, num_sessions=1):
+    """
+    Reads the metadata of the first num_stations stations, sharing the stations between num_sessions browser sessions.
+    """
+    pool = create_pool(num_sessions, headless=True, setup=open_stations_list_HR)
+    try:
+        status = run_pool(pool, get_station_metadata_HR, range(1, num_stations + 1))
+    finally:
+        close_pool(pool)
+
+    status = status.sort_values("item")
+    for _, row in status[status.status != "done"].iterrows():
+        print(f"Failed to read the metadata of station {row['item']}: {row['error']}")
+    status = status[status.status == "done"]
 
-    for i in tqdm.tqdm(range(1, num_stations + 1)):
-        stations_infos.loc[i - 1, "years_streamflow"] = extract_protok_data_range(tables_dict_2[i])
+    stations_infos = pd.concat([result[0] for result in status.result], ignore_index=True)
+
+    # The index is the position of the station in the list minus one (as if no station failed):
+    stations_infos.index = status["item"].values - 1
+    stations_infos["years_streamflow"] = [extract_protok_data_range(text) for _, text in status.result]
 
     return stations_infos
 
@@ -120,66 +128,157 @@ def extract_years_from_ranges(range_str):
     all_years.sort()
     return all_years
 
-def download_data_HR(network_HR, PATH_EXP):
-    URL = "https://hidro.dhz.hr"
-    chrome_driver_path = 'code/python/D_demonstration_streamflow_data/chromedriver.exe'
+def open_daily_data_HR(session):
+    """
+    Opens the list of stations with the daily streamflow data (once per browser session).
+    """
+    open_stations_list_HR(session)
+
+    driver = session["driver"]
+    wait_for(driver, '//*[@id="ext-gen239"]/div[7]').click()
+    wait_for(driver, '//*[@id="prik_tippod"]').click()
+    button = wait_for(driver, '//*[@id="ext-gen355"]', "present")
+    driver.execute_script("arguments[0].click();", button)
+
+def create_collector_HR(stations, dates=None):
+    """
+    Creates a preallocated matrix (dates x stations) where the downloaded stations are written.
     
-    chrome_options = Options()
-    #chrome_options.add_argument('--headless')
-    service = Service(chrome_driver_path)
-    driver = webdriver.Chrome(service=service, options=chrome_options)
+    Args:
+    - stations (list): Names of the stations (columns)
+    - dates (pd.DatetimeIndex): Daily dates (rows), by default from 1926 to 2023
     
-    driver.get(URL)
-    driver.implicitly_wait(10)
+    Returns:
+    - dict: Collector with the "dates", the "stations", the position of each station ("columns") and the "values"
+    """
+    if dates is None:
+        dates = pd.date_range('01-01-1926', '12-31-2023', freq='D')
+
+    return {"dates": dates, "stations": list(stations), "columns": {station: j for j, station in enumerate(stations)},
+            "values": np.full((len(dates), len(stations)), np.nan)}
+
+def add_station_HR(collector, station, dates, values):
+    """
+    Writes the series of one station into its column of the collector (the dates out of the 
+    collector range are ignored).
+    """
+    positions = collector["dates"].get_indexer(dates)
+    valid = positions >= 0
+    collector["values"][positions[valid], collector["columns"][station]] = values[valid]
+
+def collector_to_dataframe_HR(collector):
+    """
+    Returns the matrix of the collector as a DataFrame (dates as index and stations as columns).
+    """
+    return pd.DataFrame(collector["values"], index=collector["dates"], columns=collector["stations"])
+
+def parse_year_table_HR(tbl):
+    """
+    Reads the daily table of one year (each row of the grid is a separate table).
     
-    driver.find_element(By.XPATH, '//*[@id="ext-gen139"]/em/span/span/span').click()
-    button = driver.find_element(By.XPATH, "/html/body/div[1]/div/div/div[2]/div[1]/div[1]/ul/li[3]/a[2]/em/span/span")
-    driver.execute_script("arguments[0].click();", button)
-    button = driver.find_element(By.XPATH, "/html/body/div[8]/div[2]/div[2]/div/div/div/div[1]/table/tbody/tr/td[2]/table/tbody/tr/td[1]/table/tbody/tr/td/table/tbody/tr[2]/td[2]/em/button")
-    driver.execute_script("arguments[0].click();", button)
-    driver.find_element(By.XPATH, '//*[@id="ext-gen239"]/div[7]').click()
-    driver.find_element(By.XPATH, '//*[@id="prik_tippod"]').click()
-    button = driver.find_element(By.XPATH, '//*[@id="ext-gen355"]')
-    driver.execute_script("arguments[0].click();", button)
+    Returns:
+    - tuple: Arrays with the days ("dd.mm. 00:00") and the streamflow values (numbers or "---")
+    """
+    df = pd.read_html(tbl, decimal=',', thousands='.')
+    rows = np.concatenate([table.iloc[:, :2].values for table in df])
+
+    return rows[:, 0], rows[:, 1]
+
+def build_series_HR(days, values, years):
+    """
+    Builds the daily series of one station from the arrays of each year, with a single 
+    concatenation and a single parsing of the dates.
+    
+    Args:
+    - days (list): Arrays with the days of each year (see parse_year_table_HR)
+    - values (list): Arrays with the streamflow values of each year
+    - years (list): Year of each array
+    
+    Returns:
+    - tuple: Dates (pd.DatetimeIndex) and streamflow values (np.ndarray)
+    """
+    if not days:
+        return pd.DatetimeIndex([]), np.array([], dtype=float)
 
+    year_of_day = np.concatenate([np.full(len(day), str(year)) for day, year in zip(days, years)])
+    days = pd.Series(np.concatenate(days)).astype(str)
+    days = days.str.replace('00:00', '', regex=False).str.replace(' ', '', regex=False)
+    dates = pd.DatetimeIndex(pd.to_datetime(days + year_of_day, format='%d.%m.%Y'))
+
+    values = pd.Series(np.concatenate(values)).replace('---', np.nan).astype(float).values
+
+    return dates, values
+
+def download_station_HR(session, z, network_HR, PATH_EXP, collector=None):
+    """
+    Downloads the daily streamflow of one station (row z of network_HR) with an open browser session
+    (see open_daily_data_HR), year by year, writes it into the collector and exports it.
+    
+    Args:
+    - session (dict): Browser session
+    - z (int): Row of the station in network_HR
+    - network_HR (pd.DataFrame): Stations (see get_metadata_HR)
+    - PATH_EXP (str): Path to export the downloaded data
+    - collector (dict): Collector shared by the stations (see create_collector_HR), by default one for this station
+    
+    Returns:
+    - str: Path to the exported csv-file
+    """
+    driver = session["driver"]
     xpath_i = '//*[@id="ext-gen239"]/div[number]'
+    table_xpath = '//*[@id="ext-gen331"]'
 
-    for z, station in tqdm.tqdm(enumerate(network_HR.num)):
-        timeseriesfinal = pd.DataFrame(index=pd.date_range('01-01-1926', '12-31-2023', freq='D'))
-        dados_full = pd.DataFrame()
-        namestation = network_HR.iloc[z, 1]
-        xpath = xpath_i.replace("number", str(station))
-        time.sleep(2)
-        driver.find_element(By.XPATH, xpath).click()
-        years = extract_years_from_ranges(network_HR.iloc[z, -2])
-        years.reverse()
+    station = network_HR.num.iloc[z]
+    namestation = network_HR.iloc[z, 1]
+    xpath = xpath_i.replace("number", str(station))
+    wait_for(driver, xpath).click()
+    years = extract_years_from_ranges(network_HR.iloc[z, -2])
+    years.reverse()
+
+    # The days and values of each year are kept as arrays and concatenated once at the end:
+    days_years, values_years = [], []
+    for ano in years:
+        element = wait_for(driver, '//*[@id="izbgod_b1"]')
+        previous = get_html(driver, table_xpath)
+        action = ActionChains(driver)
+        action.click(on_element=element)
+        action.perform()
+        # The table is read when it is refreshed (or, if its content did not change, after the timeout)
+        tbl = wait_for_change(driver, table_xpath, previous) or wait_for(driver, table_xpath, "present").get_attribute('outerHTML')
+        days, values = parse_year_table_HR(tbl)
+        days_years.append(days)
+        values_years.append(values)
+
+    dates, values = build_series_HR(days_years, values_years, years)
+
+    if collector is None:
+        collector = create_collector_HR([int(namestation)])
+    add_station_HR(collector, int(namestation), dates, values)
+
+    timeseriesfinal = pd.DataFrame({int(namestation): collector["values"][:, collector["columns"][int(namestation)]]},
+                                   index=collector["dates"])
+
+    path = f'{PATH_EXP}/Qm3s_{station}_{namestation}.csv'
+    timeseriesfinal.to_csv(path)
+
+    return path
+
+def download_data_HR(network_HR, PATH_EXP, num_sessions=1, headless=False, run=None):
+    """
+    Downloads the daily streamflow of the stations of network_HR, sharing the stations between 
+    num_sessions browser sessions. The stations are written into a single matrix (1926-2023). The 
+    latency of each station is recorded in run (from utils.instrumentation.create_run), when given.
     
-        for ano in years:
-            time.sleep(2)
-            element = driver.find_element(By.XPATH, '//*[@id="izbgod_b1"]')
-            action = ActionChains(driver)
-            action.click(on_element=element)
-            action.perform()
-            tbl = driver.find_element(By.XPATH, '//*[@id="ext-gen331"]').get_attribute('outerHTML')
-            df = pd.read_html(tbl, decimal=',', thousands='.')
-            dados_pluv = pd.DataFrame(index=range(len(df)), columns=[0, 1])
-
-            for i in range(len(df)):
-                dados_pluv.iloc[i, :] = df[i].iloc[:, :2].values
-            
-
-            dados_pluv["dates"] = dados_pluv[0].astype(str) + str(ano)
-            dados_pluv["dates"] = dados_pluv["dates"].astype(str)
-            dados_pluv["dates"].replace({'00:00': ''}, regex=True, inplace=True)
-            dados_pluv["dates"].replace({' ': ''}, regex=True, inplace=True)
-            dados_full = pd.concat([dados_full, dados_pluv], ignore_index=True)
-            
-
-        dados_full.drop(0, axis=1, inplace=True)
-        dados_full["dates"] = pd.to_datetime(dados_full['dates'], format='%d.%m.%Y')
-        dados_full.columns = ["Qm3_s", "dates"]
-        dados_full.set_index("dates", inplace=True)
-        dados_full.replace('---', np.nan, inplace=True)
-        dados_full = dados_full.astype(float)
-        timeseriesfinal.loc[:, int(namestation)] = dados_full.Qm3_s
-        timeseriesfinal.to_csv(f'{PATH_EXP}/Qm3s_{station}_{namestation}.csv')
\ No newline at end of file
+    Returns:
+    - tuple: Status of each station (item is the row of network_HR, status, seconds, error and path 
+      to the file) and the streamflow of all the stations (dates as index and stations as columns)
+    """
+    collector = create_collector_HR([int(namestation) for namestation in network_HR.iloc[:, 1]])
+
+    pool = create_pool(num_sessions, headless=headless, setup=open_daily_data_HR)
+    try:
+        status = run_pool(pool, download_station_HR, range(len(network_HR)), network_HR, PATH_EXP, collector, run=run)
+    finally:
+        close_pool(pool)
+
+    return status, collector_to_dataframe_HR(collector)
\ No newline at end of file
@@ -4,94 +4,96 @@ This file is part of the EStreams dataset. See https://github.com/EStreams for d
 
 Coded by: Thiago Nascimento
 """
-import os
-import time
-import geopandas as gpd
 import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import WebDriverException
+from .browser import create_session, close_session, create_pool, close_pool, run_pool, wait_for, list_downloads, wait_for_download
 
-def download_data_IEEPA(code):  
-    URL_station_i = "https://epawebapp.epa.ie/hydronet/#STATION"
-    path_information_i = "/html/body/div/div/div/div[3]/div/div/div[2]/table/tbody/tr[ROWTOBEREPLACED]"
-    path_download_i = "/html/body/div/div/div/div[3]/div/div/div[3]/div/div/div/div[2]/table/tr[ROWTOBEREPLACED]/td[2]/a"
-    download_dir = os.path.join(os.path.expanduser("~"), "Downloads")
-
-    chrome_options = Options()
-    prefs = {"download.default_directory": download_dir, "directory_upgrade": True}
-    chrome_options.add_experimental_option("prefs", prefs)
+URL_IEEPA = "https://epawebapp.epa.ie/hydronet/#STATION"
 
-    # Path to the Chrome driver executable
-    chrome_driver_path = 'code/python/D_demonstration_streamflow_data/chromedriver.exe'
-
-    # Create a WebDriver instance with the specified path
-    service = Service(chrome_driver_path)
-    driver = webdriver.Chrome(service=service, options=chrome_options)
+def download_station_IEEPA(session, code, timeout=60):
+    """
+    Downloads the daily mean streamflow ("All data DayMean TS") of one station with an open browser 
+    session (see utils.browser).
+    
+    Args:
+    - session (dict): Browser session
+    - code (str): Station code
+    - timeout (float): Maximum seconds to wait for the download
     
-    # Now we can select the station:
-    URL_station = URL_station_i.replace("STATION", str(code))
+    Returns:
+    - str: Path to the downloaded file
+    """
+    path_information_i = "/html/body/div/div/div/div[3]/div/div/div[2]/table/tbody/tr[ROWTOBEREPLACED]"
+    path_download_i = "/html/body/div/div/div/div[3]/div/div/div[3]/div/div/div/div[2]/table/tr[ROWTOBEREPLACED]/td[2]/a"
+    driver = session["driver"]
+    before = list_downloads(session)
 
+    # Now we can select the station (the station is chosen after "#", so the page is loaded from 
+    # scratch, instead of showing the tables of the previous station):
+    URL_station = URL_IEEPA.replace("STATION", str(code))
+    driver.get("about:blank")
     driver.get(URL_station)
-    driver.implicitly_wait(10)
     
-    try:
-        # Here we can retrieve the full information in the format of a table:
-        tbl3 = driver.find_element(By.XPATH, '/html/body/div[1]/div/div/div[3]/div/div/div[2]/table').get_attribute('outerHTML')
-    except Exception as e:
-        print(f"Failed to retrieve the table with the first XPath: {e}")
-        try:
-            tbl3 = driver.find_element(By.XPATH, '/html/body/div/div/div/div[3]/div/div/div[2]/table').get_attribute('outerHTML')
-        except Exception as e:
-            print(f"Failed to retrieve the table with the second XPath: {e}")
-            driver.quit()
-            return
+    # Here we can retrieve the full information in the format of a table (one of two XPaths):
+    tbl3 = wait_for(driver, '/html/body/div[1]/div/div/div[3]/div/div/div[2]/table | /html/body/div/div/div/div[3]/div/div/div[2]/table',
+                    "present").get_attribute('outerHTML')
         
     # Here we get the table to check the position of the "download" tab:
     df3  = pd.read_html(tbl3)
     info_row = df3[0]
     info_row.set_index(1, inplace=True)
     
-    try:
-        # Here we can get the row:
-        row_number = info_row.index.get_loc('Download')
-        path_information = path_information_i.replace("ROWTOBEREPLACED", str(row_number + 1))
-        
-        # Now we can switch to Download:
-        button = driver.find_element(By.XPATH, path_information)
-        driver.execute_script("arguments[0].click();", button)
-    
-        driver.implicitly_wait(10)
-    
-        # Here we can click to download our dataset:
-        # The solution since the products to download vary from station to station is to retrieve the table, and select directly the row:
-        tbl2 = driver.find_element(By.XPATH, '/html/body/div/div/div/div[3]/div/div/div[3]/div/div/div/div[2]/table').get_attribute('outerHTML')
-        df2  = pd.read_html(tbl2)
-        info_download = df2[0]
-        info_download.set_index(0, inplace=True)
-    
-        try:
-            # Here we can get the row:
-            row_number = info_download.index.get_loc('All data DayMean TS')
-            path_download = path_download_i.replace("ROWTOBEREPLACED", str(row_number + 1))
-    
-            # Finally we can download it:
-            WebDriverWait(driver, 20).until(EC.element_to_be_clickable((By.XPATH, path_download))).click()
-                        
-            # Wait for download to complete
-            time.sleep(5)
-            print(f"Successfully downloaded data for station {code}")
-    
-        except Exception as e:
-            print(f"Failed to find and click the download link: {e}")
-    except Exception as e:
-        print(f"Failed to find the download row: {e}")
-    
-    driver.quit()
+    # Here we can get the row:
+    row_number = info_row.index.get_loc('Download')
+    path_information = path_information_i.replace("ROWTOBEREPLACED", str(row_number + 1))
     
+    # Now we can switch to Download:
+    button = wait_for(driver, path_information, "present")
+    driver.execute_script("arguments[0].click();", button)
+
+    # Here we can click to download our dataset:
+    # The solution since the products to download vary from station to station is to retrieve the table, and select directly the row:
+    tbl2 = wait_for(driver, '/html/body/div/div/div/div[3]/div/div/div[3]/div/div/div/div[2]/table', "present").get_attribute('outerHTML')
+    df2  = pd.read_html(tbl2)
+    info_download = df2[0]
+    info_download.set_index(0, inplace=True)
+
+    # Here we can get the row:
+    row_number = info_download.index.get_loc('All data DayMean TS')
+    path_download = path_download_i.replace("ROWTOBEREPLACED", str(row_number + 1))
 
+    # Finally we can download it:
+    wait_for(driver, path_download).click()
+                
+    # Wait for download to complete
+    return wait_for_download(session, before, timeout)
+
+def download_data_IEEPA(code):  
+    session = create_session(headless=False)
+    try:
+        download_station_IEEPA(session, code)
+        print(f"Successfully downloaded data for station {code}")
+    except (WebDriverException, TimeoutError, KeyError) as e:
+        print(f"Failed to download data for station {code}: {e}")
+    finally:
+        close_session(session)
+
+def download_many_IEEPA(codes, num_sessions=4, download_dir=None, headless=True, run=None):
+    """
+    Downloads the daily mean streamflow of many stations, sharing a pool of browser sessions (see utils.browser).
+    
+    Args:
+    - codes (list): Station codes
+    - num_sessions (int): Number of browser sessions working at the same time
+    - download_dir (str): Folder of the downloaded files (default: the Downloads folder)
+    - headless (bool): Run the browsers without a window
+    - run (dict): Run from utils.instrumentation.create_run, where the latency of each station is recorded (optional)
     
+    Returns:
+    - pd.DataFrame: Status of each station (item, status, seconds, error and path to the file)
+    """
+    pool = create_pool(num_sessions, headless=headless, download_dir=download_dir)
+    try:
+        return run_pool(pool, download_station_IEEPA, codes, run=run)
+    finally:
+        close_pool(pool)
@@ -4,65 +4,281 @@ This file is part of the EStreams dataset. See https://github.com/EStreams for d
 
 Coded by: Thiago Nascimento
 """
-import geopandas as gpd
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
 import requests
 import xml.etree.ElementTree as ET
 import pandas as pd
 import re
+import numpy as np
+import os
+import asyncio
+import random
+import time
+import concurrent.futures
+import tqdm
+
+try:
+    import aiohttp
+except ImportError:
+    # aiohttp is only needed for downloading many stations at once (download_many_ITIS):
+    aiohttp = None
+
+from .instrumentation import record_item, stage
+
+# URL pattern of the WaterML (CUAHSI 1.1) service, with the station code and region (first 7 characters):
+URL_ITIS = "http://hydroserver.ddns.net/italia/REGION/index.php/default/services/cuahsi_1_1.asmx/GetValuesObject?authToken=&location=STATION&variable=REGION:Discharge"
+NAMESPACE_WATERML = "{http://www.cuahsi.org/waterML/1.1/}"
 
-def download_data_ITIS(station_code, PATH_EXP):
+# HTTP status codes worth trying again (rate limits and server errors):
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+# Time zone offset at the end of the dates (e.g., "+01:00" or "Z"):
+PATTERN_OFFSET = re.compile(r"(Z|[+-]\d{2}:?\d{2})$")
+
+
+def get_url_ITIS(station_code, url=URL_ITIS):
     """
-    Fetches streamflow time series data for a single station code.
+    Returns the URL of the GetValuesObject request of a station code.
     
     Args:
     - station_code (str): Station code
-    - PATH_EXP (str): Path to export the downloaded data
+    - url (str): URL pattern with the placeholders STATION and REGION (e.g., for a local server)
     
     Returns:
-    - None
+    - str: URL of the request
     """
-    # Define the URL pattern for fetching data
-    URL = "http://hydroserver.ddns.net/italia/REGION/index.php/default/services/cuahsi_1_1.asmx/GetValuesObject?authToken=&location=STATION&variable=REGION:Discharge"
-    
     # Replace placeholders in the URL with the current station code
-    url = URL.replace("STATION", station_code)
+    url = url.replace("STATION", station_code)
     url = url.replace("REGION", station_code[0:7])
     
-    # Send an HTTP GET request to the URL
-    response = requests.get(url)
+    return url
+
+
+def create_parser_ITIS(capacity=4096, block_size=8192):
+    """
+    Creates a streaming parser of a GetValuesObject response. The response is given in chunks 
+    (feed_parser_ITIS), each 'value' element is cleared as soon as it is read, and the values are 
+    converted by blocks into numpy arrays (dates as datetime64, values as float32 and quality codes 
+    as int8), so that the memory does not depend on the XML tree.
+    
+    Args:
+    - capacity (int): Initial length of the arrays (doubled when needed)
+    - block_size (int): Number of values converted at once
+    
+    Returns:
+    - dict: State of the parser
+    """
+    return {"parser": ET.XMLPullParser(events=("start", "end")), "block_size": block_size, "size": 0,
+            "dateTime": np.empty(capacity, dtype="datetime64[s]"), "Value": np.empty(capacity, dtype=np.float32),
+            "QualityControlLevelCode": np.empty(capacity, dtype=np.int8), "block": ([], [], []),
+            "values_elem": None, "metadata": None}
+
+
+def parse_dates_ITIS(date_times):
+    """
+    Converts the dates of the values to datetime64[s]. The time zone offset of the dates is removed, 
+    so that the local dates are kept (converted to UTC, the daily values at "00:00:00+01:00" would 
+    move to the previous day).
+    
+    Args:
+    - date_times (list): Dates as given in the response (e.g., "2020-01-01T00:00:00+01:00")
     
-    # Initialize variable to store time series data
-    time_series_df = None
+    Returns:
+    - np.array: Dates as datetime64[s]
     
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the XML content
-        root = ET.fromstring(response.text)
+    Example:
+    >>> parse_dates_ITIS(["2020-01-01T00:00:00+01:00", "2020-01-02T00:00:00Z"]).astype(str).tolist()
+    ['2020-01-01T00:00:00', '2020-01-02T00:00:00']
+    """
+    date_times = [PATTERN_OFFSET.sub("", date_time) for date_time in date_times]
+
+    try:
+        return np.array(date_times, dtype="datetime64[s]")
+    except ValueError:
+        # Other formats:
+        return pd.to_datetime(date_times).values.astype("datetime64[s]")
+
+
+def flush_block_ITIS(state):
+    """
+    Converts the values read since the last block and copies them into the arrays of the parser.
+    """
+    date_times, values, quality_control_levels = state["block"]
+    if not date_times:
+        return
+
+    start, end = state["size"], state["size"] + len(date_times)
+    if end > len(state["Value"]):
+        # Grow the arrays (doubling their length):
+        for key in ["dateTime", "Value", "QualityControlLevelCode"]:
+            grown = np.empty(max(2 * len(state[key]), end), dtype=state[key].dtype)
+            grown[:start] = state[key][:start]
+            state[key] = grown
 
-        # Initialize lists to store data
-        date_times = []
-        values = []
-        quality_control_levels = []
+    state["dateTime"][start:end] = parse_dates_ITIS(date_times)
+    state["Value"][start:end] = np.array(values, dtype=np.float64)
+    state["QualityControlLevelCode"][start:end] = np.array(quality_control_levels, dtype=np.int64)
+    state["size"] = end
 
-        # Iterate through the 'value' elements in the XML and extract relevant data
-        for value_elem in root.findall('.//{http://www.cuahsi.org/waterML/1.1/}value'):
-            date_time = value_elem.get('dateTime')
-            value = float(value_elem.text)
-            quality_control_level = int(value_elem.get('qualityControlLevelCode'))
-            date_times.append(date_time)
-            values.append(value)
-            quality_control_levels.append(quality_control_level)
+    for block in state["block"]:
+        block.clear()
+
+    # Remove the (already cleared) 'value' elements read so far from the tree:
+    if state["values_elem"] is not None:
+        del state["values_elem"][:]
+
+
+def feed_parser_ITIS(state, chunk=None):
+    """
+    Gives one chunk (bytes) of the response to the parser and reads the elements completed by it.
+    """
+    parser = state["parser"]
+    if chunk is not None:
+        parser.feed(chunk)
+
+    for event, elem in parser.read_events():
+        if event == "start":
+            if elem.tag == NAMESPACE_WATERML + 'values':
+                state["values_elem"] = elem
+            continue
+
+        if elem.tag == NAMESPACE_WATERML + 'value':
+            state["block"][0].append(elem.get('dateTime'))
+            state["block"][1].append(float(elem.text))
+            state["block"][2].append(int(elem.get('qualityControlLevelCode')))
+            elem.clear()
+            if len(state["block"][0]) >= state["block_size"]:
+                flush_block_ITIS(state)
+
+        elif elem.tag == NAMESPACE_WATERML + 'sourceInfo':
+            # Extract metadata from the XML
+            state["metadata"] = {
+                'siteName': elem.find(NAMESPACE_WATERML + 'siteName').text,
+                'siteCode': elem.find(NAMESPACE_WATERML + 'siteCode').text,
+                'siteID': elem.find(NAMESPACE_WATERML + 'siteCode').get('siteID'),
+                'latitude': elem.find('.//' + NAMESPACE_WATERML + 'latitude').text,
+                'longitude': elem.find('.//' + NAMESPACE_WATERML + 'longitude').text
+            }
+
+
+def close_parser_ITIS(state):
+    """
+    Finishes the parsing (raises xml.etree.ElementTree.ParseError for incomplete responses).
+    
+    Returns:
+    - dict: Arrays "dateTime", "Value" and "QualityControlLevelCode" and the "metadata" (dict, or None when the response has no sourceInfo)
+    """
+    state["parser"].close()
+    feed_parser_ITIS(state)
+    flush_block_ITIS(state)
+
+    size = state["size"]
+    return {"dateTime": state["dateTime"][:size].copy(), "Value": state["Value"][:size].copy(),
+            "QualityControlLevelCode": state["QualityControlLevelCode"][:size].copy(), "metadata": state["metadata"]}
+
+
+def parse_waterml_ITIS(chunks):
+    """
+    Parses a GetValuesObject response given as an iterable of chunks (bytes), e.g., 
+    response.iter_content(65536), or as a single bytes object.
+    
+    Returns:
+    - dict: Arrays "dateTime", "Value" and "QualityControlLevelCode" and the "metadata" (see close_parser_ITIS)
+    """
+    if isinstance(chunks, bytes):
+        chunks = [chunks]
+
+    state = create_parser_ITIS()
+    for chunk in chunks:
+        feed_parser_ITIS(state, chunk)
+
+    return close_parser_ITIS(state)
+
+
+def export_ITIS(series, station_code, PATH_EXP, data=True, metadata=True, binary=False):
+    """
+    Exports the time series and/or the metadata of one parsed response (see parse_waterml_ITIS).
+    
+    Args:
+    - series (dict): Parsed response
+    - station_code (str): Station code
+    - PATH_EXP (str): Path to export the downloaded data
+    - data (bool): Export the time series (qm3s_<station>.csv)
+    - metadata (bool): Export the metadata (metadata_<station>.csv)
+    - binary (bool): Export the time series as numpy arrays (qm3s_<station>.npz) instead of a csv-file
+    
+    Returns:
+    - int: Number of values of the time series
+    """
+    # Modify the station code if necessary
+    modified_station_code = re.sub(r'[^\w]', '_', station_code)
 
+    if data and binary:
+        np.savez(f'{PATH_EXP}/qm3s_{modified_station_code}.npz', dateTime=series["dateTime"], Value=series["Value"],
+                 QualityControlLevelCode=series["QualityControlLevelCode"])
+    elif data:
         # Create a DataFrame from the extracted time series data
-        time_series_df = pd.DataFrame({'dateTime': date_times, 'Value': values, 'QualityControlLevelCode': quality_control_levels})
-        # Modify the station code if necessary
-        modified_station_code = re.sub(r'[^\w]', '_', station_code)
+        time_series_df = pd.DataFrame({'dateTime': np.datetime_as_string(series["dateTime"], unit='s'),
+                                       'Value': series["Value"],
+                                       'QualityControlLevelCode': series["QualityControlLevelCode"]})
         # Export data to CSV file
         time_series_df.to_csv(f'{PATH_EXP}/qm3s_{modified_station_code}.csv', index=False)
 
+    if metadata and series["metadata"] is not None:
+        # Create a DataFrame for the metadata
+        info = series["metadata"]
+        metadata_df = pd.DataFrame({
+            'siteName': [info['siteName']],
+            'code': [station_code],
+            'siteCode': [info['siteCode']],
+            'siteID': [info['siteID']],
+            'latitude': [info['latitude']],
+            'longitude': [info['longitude']]
+        })
+        # Export data to CSV file
+        metadata_df.to_csv(f'{PATH_EXP}/metadata_{modified_station_code}.csv', index=False)
+
+    return len(series["Value"])
+
+
+def read_data_ITIS(filename):
+    """
+    Reads one exported time series (qm3s_<station>.csv or qm3s_<station>.npz).
+    
+    Args:
+    - filename (str): Path to the file
+    
+    Returns:
+    - pd.DataFrame: Time series data (dateTime, Value and QualityControlLevelCode)
+    """
+    if filename.endswith(".npz"):
+        with np.load(filename) as arrays:
+            return pd.DataFrame({key: arrays[key] for key in ["dateTime", "Value", "QualityControlLevelCode"]})
+
+    time_series_df = pd.read_csv(filename)
+    time_series_df["dateTime"] = pd.to_datetime(time_series_df["dateTime"], format='%Y-%m-%dT%H:%M:%S')
+
+    return time_series_df
+
+
+def download_data_ITIS(station_code, PATH_EXP, binary=False):
+    """
+    Fetches streamflow time series data for a single station code.
+    
+    Args:
+    - station_code (str): Station code
+    - PATH_EXP (str): Path to export the downloaded data
+    - binary (bool): Export the time series as numpy arrays (.npz) instead of a csv-file
+    
+    Returns:
+    - None
+    """
+    # Send an HTTP GET request to the URL (the response is parsed while it is received)
+    with requests.get(get_url_ITIS(station_code), stream=True) as response:
+        # Check if the request was successful
+        if response.status_code == 200:
+            series = parse_waterml_ITIS(response.iter_content(chunk_size=65536))
+            export_ITIS(series, station_code, PATH_EXP, data=True, metadata=False, binary=binary)
+
 
 def download_metadata_ITIS(station_code, PATH_EXP):
     """
@@ -75,44 +291,139 @@ def download_metadata_ITIS(station_code, PATH_EXP):
     Returns:
     - None
     """
-    # Define the URL pattern for fetching data
-    URL = "http://hydroserver.ddns.net/italia/REGION/index.php/default/services/cuahsi_1_1.asmx/GetValuesObject?authToken=&location=STATION&variable=REGION:Discharge"
+    # Send an HTTP GET request to the URL (the response is parsed while it is received)
+    with requests.get(get_url_ITIS(station_code), stream=True) as response:
+        # Check if the request was successful
+        if response.status_code == 200:
+            series = parse_waterml_ITIS(response.iter_content(chunk_size=65536))
+            export_ITIS(series, station_code, PATH_EXP, data=False, metadata=True)
+
+
+async def fetch_ITIS(session, semaphore, url, retries, backoff):
+    """
+    Sends one GET request and parses the response while it is received, trying again with 
+    exponential backoff (and jitter) on connection errors, timeouts and the status codes in 
+    RETRY_STATUS_CODES. The chunks are parsed in a thread, so that the other downloads continue 
+    meanwhile.
     
-    # Replace placeholders in the URL with the current station code
-    url = URL.replace("STATION", station_code)
-    url = url.replace("REGION", station_code[0:7])
+    Returns:
+    - tuple: Parsed response (see parse_waterml_ITIS, or None), number of attempts and error message (or None)
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        loop = asyncio.get_running_loop()
+                        state = create_parser_ITIS()
+                        async for chunk in response.content.iter_chunked(65536):
+                            await loop.run_in_executor(None, feed_parser_ITIS, state, chunk)
+                        return await loop.run_in_executor(None, close_parser_ITIS, state), attempt + 1, None
+                    error = f"HTTP {response.status}"
+                    if response.status not in RETRY_STATUS_CODES:
+                        return None, attempt + 1, error
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exception:
+            error = f"{type(exception).__name__}: {exception}"
+        except (ET.ParseError, ValueError, TypeError) as exception:
+            # Malformed response (e.g., truncated XML or empty values):
+            return None, attempt + 1, f"{type(exception).__name__}: {exception}"
+
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+    return None, retries + 1, error
+
+
+async def download_station_ITIS(session, semaphore, station_code, PATH_EXP, metadata, binary, retries, backoff, url):
+    """
+    Downloads one station (a single request for the time series and the metadata) and exports it.
     
-    # Send an HTTP GET request to the URL
-    response = requests.get(url)
-    
-    # Initialize variable to store metadata
-    metadata_series = None
-    
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the XML content
-        root = ET.fromstring(response.text)
-
-        # Extract metadata from the XML
-        source_info_elem = root.find('.//{http://www.cuahsi.org/waterML/1.1/}sourceInfo')
-        if source_info_elem is not None:
-            site_name = source_info_elem.find('{http://www.cuahsi.org/waterML/1.1/}siteName').text
-            site_code = source_info_elem.find('{http://www.cuahsi.org/waterML/1.1/}siteCode').text
-            site_id = source_info_elem.find('{http://www.cuahsi.org/waterML/1.1/}siteCode').get('siteID')
-            latitude = source_info_elem.find('.//{http://www.cuahsi.org/waterML/1.1/}latitude').text
-            longitude = source_info_elem.find('.//{http://www.cuahsi.org/waterML/1.1/}longitude').text
-
-            # Create a DataFrame for the metadata
-            metadata_df = pd.DataFrame({
-                'siteName': [site_name],
-                'code': [station_code],
-                'siteCode': [site_code],
-                'siteID': [site_id],
-                'latitude': [latitude],
-                'longitude': [longitude]
-            })
-            # Modify the station code if necessary
-            modified_station_code = re.sub(r'[^\w]', '_', station_code)
-            
-            # Export data to CSV file
-            metadata_df.to_csv(f'{PATH_EXP}/metadata_{modified_station_code}.csv', index=False)
+    Returns:
+    - dict: station_code, status ("done" or "failed"), attempts, num_values, seconds and error
+    """
+    start = time.perf_counter()
+    series, attempts, error = await fetch_ITIS(session, semaphore, get_url_ITIS(station_code, url), retries, backoff)
+
+    num_values = None
+    if series is not None:
+        # The files are written in a thread, so that the other downloads continue meanwhile:
+        try:
+            num_values = await asyncio.get_running_loop().run_in_executor(
+                None, export_ITIS, series, station_code, PATH_EXP, True, metadata, binary)
+        except Exception as exception:
+            # A station that cannot be written (e.g., disk full) is reported without stopping the others:
+            error = f"{type(exception).__name__}: {exception}"
+
+    return {"station_code": station_code, "status": "failed" if error else "done", "attempts": attempts,
+            "num_values": num_values, "seconds": time.perf_counter() - start, "error": error}
+
+
+async def download_many_async_ITIS(station_codes, PATH_EXP, metadata, binary, max_per_region, max_connections, retries,
+                                   backoff, timeout, url, run=None):
+    """
+    Downloads all the stations with one pooled session (see download_many_ITIS).
+    """
+    # One semaphore per region, limiting the simultaneous requests to each region server:
+    semaphores = {region: asyncio.Semaphore(max_per_region) for region in set(code[0:7] for code in station_codes)}
+
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        tasks = [download_station_ITIS(session, semaphores[station_code[0:7]], station_code, PATH_EXP, metadata,
+                                       binary, retries, backoff, url)
+                 for station_code in station_codes]
+
+        results = []
+        for task in tqdm.tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+            result = await task
+            record_item(run, "download_many_ITIS", result["station_code"], seconds=result["seconds"],
+                        status=result["status"], attempts=result["attempts"], num_values=result["num_values"],
+                        error=result["error"])
+            results.append(result)
+
+    return results
+
+
+def download_many_ITIS(station_codes, PATH_EXP, metadata=True, binary=False, max_per_region=4, max_connections=32,
+                       retries=3, backoff=1.0, timeout=300, url=URL_ITIS, run=None):
+    """
+    Fetches the streamflow time series (and the metadata) of many station codes at the same time. 
+    Each station needs a single request, the connections are re-used, the number of simultaneous 
+    requests per region server is limited and the failed requests are tried again with backoff.
+    
+    Args:
+    - station_codes (list): Station codes
+    - PATH_EXP (str): Path to export the downloaded data
+    - metadata (bool): Also export the metadata of each station
+    - binary (bool): Export the time series as numpy arrays (.npz) instead of csv-files
+    - max_per_region (int): Maximum number of simultaneous requests per region
+    - max_connections (int): Maximum number of simultaneous requests in total
+    - retries (int): Number of attempts after the first one
+    - backoff (float): Seconds waited before the first retry (doubled at each retry)
+    - timeout (float): Maximum seconds for each request
+    - url (str): URL pattern with the placeholders STATION and REGION (e.g., for a local server)
+    - run (dict): Run from utils.instrumentation.create_run, where the wall time of the downloads and the 
+      latency, attempts and status of each station are recorded (optional)
+    
+    Returns:
+    - pd.DataFrame: Status of each station (station_code, status, attempts, num_values, seconds and error)
+    """
+    if aiohttp is None:
+        raise ImportError("download_many_ITIS requires aiohttp (pip install aiohttp)")
+
+    os.makedirs(PATH_EXP, exist_ok=True)
+
+    def download():
+        return asyncio.run(download_many_async_ITIS(list(station_codes), PATH_EXP, metadata, binary, max_per_region,
+                                                    max_connections, retries, backoff, timeout, url, run))
+
+    with stage(run, "download_many_ITIS"):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            results = download()
+        else:
+            # Inside Jupyter an event loop is already running, so the downloads run in their own thread:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                results = executor.submit(download).result()
+
+    return pd.DataFrame(results, columns=["station_code", "status", "attempts", "num_values", "seconds", "error"])
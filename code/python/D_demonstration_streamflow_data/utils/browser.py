@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below keep a pool of Chrome sessions (Selenium) alive and share them between the 
+downloads of many stations, instead of starting a new browser per station. The stations are 
+distributed between the sessions and run at the same time, the pages are awaited with explicit 
+conditions (instead of fixed sleeps) and the latency of each station is recorded.
+"""
+import os
+import queue
+import time
+import concurrent.futures
+import pandas as pd
+import tqdm
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from .instrumentation import record_item, stage
+
+# Path to the Chrome driver executable (when it does not exist, Selenium finds the driver itself):
+CHROME_DRIVER_PATH = 'code/python/D_demonstration_streamflow_data/chromedriver.exe'
+
+# Default folder of the downloaded files:
+DOWNLOAD_DIR = os.path.join(os.path.expanduser("~"), "Downloads")
+
+# Extensions of the files still being downloaded:
+PARTIAL_EXTENSIONS = ('.crdownload', '.tmp', '.part')
+
+
+def create_session(headless=True, download_dir=None, export_dir=None, chrome_driver_path=CHROME_DRIVER_PATH):
+    """
+    Starts one Chrome session.
+    
+    Args:
+    - headless (bool): Run Chrome without a window
+    - download_dir (str): Folder where Chrome saves the downloaded files (default: DOWNLOAD_DIR)
+    - export_dir (str): Folder where the downloaded files are moved to (default: download_dir)
+    - chrome_driver_path (str): Path to the Chrome driver executable
+    
+    Returns:
+    - dict: Session with the "driver", "download_dir", "export_dir" and "ready" (set up by the pool)
+    """
+    download_dir = os.path.abspath(download_dir or DOWNLOAD_DIR)
+    os.makedirs(download_dir, exist_ok=True)
+
+    # Configure Chrome options
+    options = Options()
+    if headless:
+        options.add_argument('--headless=new')
+    options.add_experimental_option("prefs", {"download.default_directory": download_dir, "directory_upgrade": True})
+
+    # Set up the service
+    service = Service(chrome_driver_path) if os.path.exists(chrome_driver_path) else Service()
+
+    return {"driver": webdriver.Chrome(service=service, options=options), "download_dir": download_dir,
+            "export_dir": os.path.abspath(export_dir or download_dir), "ready": False,
+            "options": {"headless": headless, "chrome_driver_path": chrome_driver_path}}
+
+
+def close_session(session):
+    """
+    Closes the browser of one session (ignoring sessions already closed).
+    """
+    try:
+        session["driver"].quit()
+    except WebDriverException:
+        pass
+
+
+def wait_for(driver, xpath, condition="clickable", timeout=20):
+    """
+    Waits until an element is clickable, present or visible and returns it (raises TimeoutException).
+    
+    Args:
+    - driver (webdriver.Chrome): Browser
+    - xpath (str): XPath of the element
+    - condition (str): "clickable", "present" or "visible"
+    - timeout (float): Maximum seconds to wait
+    """
+    conditions = {"clickable": EC.element_to_be_clickable, "present": EC.presence_of_element_located,
+                  "visible": EC.visibility_of_element_located}
+
+    return WebDriverWait(driver, timeout).until(conditions[condition]((By.XPATH, xpath)))
+
+
+def get_html(driver, xpath):
+    """
+    Returns the HTML (outerHTML) of an element, or None when it does not exist.
+    """
+    try:
+        return driver.find_element(By.XPATH, xpath).get_attribute('outerHTML')
+    except WebDriverException:
+        return None
+
+
+def wait_for_change(driver, xpath, previous, timeout=10):
+    """
+    Waits until the HTML of an element exists and differs from the previous one (e.g., a table 
+    refreshed after a click).
+    
+    Returns:
+    - str or None: New HTML of the element, or None when it did not change within the timeout
+    """
+    def changed(driver):
+        html = get_html(driver, xpath)
+        return html if html is not None and html != previous else False
+
+    try:
+        return WebDriverWait(driver, timeout).until(changed)
+    except TimeoutException:
+        return None
+
+
+def list_downloads(session):
+    """
+    Names of the files in the download folder of a session.
+    """
+    return set(os.listdir(session["download_dir"]))
+
+
+def wait_for_download(session, before, timeout=60):
+    """
+    Waits until a new file (not in before, see list_downloads) is completely downloaded and moves 
+    it to the export folder of the session (raises TimeoutError).
+    
+    Returns:
+    - str: Path to the downloaded file
+    """
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        names = list_downloads(session) - before
+        complete = [name for name in names if not name.endswith(PARTIAL_EXTENSIONS)]
+        if complete and len(complete) == len(names):
+            path = os.path.join(session["export_dir"], complete[0])
+            os.replace(os.path.join(session["download_dir"], complete[0]), path)
+            return path
+        time.sleep(0.2)
+
+    raise TimeoutError(f"No download finished within {timeout} s")
+
+
+def create_pool(num_sessions, headless=True, download_dir=None, setup=None, chrome_driver_path=CHROME_DRIVER_PATH):
+    """
+    Starts a pool of Chrome sessions (at the same time, since starting the browser is the slowest part).
+    
+    Args:
+    - num_sessions (int): Number of sessions
+    - headless (bool): Run Chrome without a window
+    - download_dir (str): Folder of the downloaded files. Each session downloads into its own 
+      sub-folder, so that the files of simultaneous downloads are not mixed, and they are moved here.
+    - setup (callable): Function called with a session before its first station and after a failure
+      (e.g., navigate the menus to the list of stations)
+    - chrome_driver_path (str): Path to the Chrome driver executable
+    
+    Returns:
+    - dict: Pool to be given to run_pool and close_pool
+    """
+    export_dir = os.path.abspath(download_dir or DOWNLOAD_DIR)
+
+    def start(number):
+        return create_session(headless, os.path.join(export_dir, f".session_{number}"), export_dir, chrome_driver_path)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_sessions) as executor:
+        sessions = list(executor.map(start, range(num_sessions)))
+
+    available = queue.Queue()
+    for session in sessions:
+        available.put(session)
+
+    return {"sessions": sessions, "available": available, "setup": setup}
+
+
+def close_pool(pool):
+    """
+    Closes all the sessions of a pool (and their empty download sub-folders).
+    """
+    for session in pool["sessions"]:
+        close_session(session)
+        try:
+            os.rmdir(session["download_dir"])
+        except OSError:
+            pass
+
+
+def is_alive(session):
+    """
+    True if the browser of the session still responds.
+    """
+    try:
+        session["driver"].current_url
+        return True
+    except WebDriverException:
+        return False
+
+
+def restart_session(pool, session):
+    """
+    Replaces a session whose browser stopped responding by a new one.
+    """
+    close_session(session)
+    new_session = create_session(session["options"]["headless"], session["download_dir"], session["export_dir"],
+                                 session["options"]["chrome_driver_path"])
+    pool["sessions"][pool["sessions"].index(session)] = new_session
+
+    return new_session
+
+
+def run_pool(pool, function, items, *args, run=None, **kwargs):
+    """
+    Calls function(session, item, *args, **kwargs) for each item (e.g., station), distributing the 
+    items between the sessions of the pool. The errors are recorded and do not stop the other items.
+    
+    Args:
+    - pool (dict): Pool from create_pool
+    - function (callable): Function downloading one item with a session
+    - items (list): Items (e.g., station codes)
+    - run (dict): Run from utils.instrumentation.create_run, where the wall time of the pool and the 
+      latency and status of each item are recorded, under the name of the function (optional)
+    
+    Returns:
+    - pd.DataFrame: Status of each item (item, status, seconds, error and result of the function)
+    """
+    def run_item(item):
+        session = pool["available"].get()
+        start = time.perf_counter()
+        try:
+            if not session["ready"] and pool["setup"] is not None:
+                pool["setup"](session)
+            session["ready"] = True
+            result, error = function(session, item, *args, **kwargs), None
+        except Exception as exception:
+            result, error = None, f"{type(exception).__name__}: {exception}"
+            # The page is in an unknown state: the session is set up again (or restarted) for the next item
+            session["ready"] = False
+            if not is_alive(session):
+                try:
+                    session = restart_session(pool, session)
+                except Exception:
+                    # The browser could not be started again: the dead session is put back, so the
+                    # remaining items still run (and fail) instead of waiting for a session
+                    pass
+        finally:
+            pool["available"].put(session)
+
+        seconds = time.perf_counter() - start
+        record_item(run, function.__name__, item, seconds=seconds, status="failed" if error else "done", error=error)
+
+        return {"item": item, "status": "failed" if error else "done", "seconds": seconds, "error": error,
+                "result": result}
+
+    with stage(run, function.__name__):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(pool["sessions"])) as executor:
+            futures = [executor.submit(run_item, item) for item in items]
+            results = [future.result() for future in tqdm.tqdm(concurrent.futures.as_completed(futures), total=len(futures))]
+
+    return pd.DataFrame(results, columns=["item", "status", "seconds", "error", "result"])
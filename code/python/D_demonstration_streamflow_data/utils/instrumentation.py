@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below record the runtime of the processing stages (e.g., the extraction of the
+catchments): wall time per stage, latency per item (e.g., per catchment) with histograms, bytes read
+and written, peak memory (RSS) and items per second. The results are written as a JSON report, which
+shows which items (e.g., large polygons or long records) dominate the runtime.
+
+The functions of the other folders accept an optional run (e.g., run=None), where nothing is recorded
+when it is None. Each folder has its own utils, so this module is copied in each of them (A, B, C and
+D) and the copies should be kept identical.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    # Without psutil the I/O counters are read from the operating system (Linux):
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak memory is read with psutil:
+    resource = None
+
+# Edges of the latency histograms (seconds), from 1 ms to 1000 s:
+HISTOGRAM_EDGES = 10 ** np.arange(-3, 3.5, 0.5)
+
+
+def create_run(name, **metadata):
+    """
+    Create a new run, where the stages and items are recorded.
+
+    Parameters:
+    - name (str): Name of the run (e.g., "meteorology_rr").
+    - metadata: Other information saved in the report (e.g., variable or number of workers).
+
+    Returns:
+    - dict: Run to be given to stage, record_item, timed_call and write_report.
+    """
+    return {"name": name, "metadata": metadata, "start": datetime.datetime.now().isoformat(timespec="seconds"),
+            "stages": {}, "items": {}, "lock": threading.Lock()}
+
+
+def get_peak_rss():
+    """
+    Peak resident memory of the process in bytes, or None when it is not available. It is read with
+    the module resource on Linux/macOS, and with psutil (peak working set) on Windows.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux:
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    if psutil is not None:
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)
+
+    return None
+
+
+def get_io_counters():
+    """
+    Bytes read and written by the process (from the disk), or None when they are not available.
+    """
+    if psutil is not None:
+        try:
+            counters = psutil.Process().io_counters()
+            return counters.read_bytes, counters.write_bytes
+        except (AttributeError, psutil.Error):
+            return None
+    try:
+        with open("/proc/self/io") as file:
+            counters = dict(line.split(": ") for line in file.read().splitlines())
+        return int(counters["read_bytes"]), int(counters["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+@contextlib.contextmanager
+def stage(run, name):
+    """
+    Record the wall time, the bytes read and written by the process and the peak memory of one stage.
+
+    Parameters:
+    - run (dict): Run from create_run (nothing is recorded when None).
+    - name (str): Name of the stage (e.g., "process_catchment").
+
+    Usage:
+        with stage(run, "process_catchment"):
+            ...
+    """
+    if run is None:
+        yield
+        return
+
+    io_start = get_io_counters()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start
+        io_end = get_io_counters()
+
+        with run["lock"]:
+            run["stages"][name] = {"wall_time_s": wall_time, "peak_rss_bytes": get_peak_rss(),
+                                   "disk_read_bytes": None if io_start is None or io_end is None else io_end[0] - io_start[0],
+                                   "disk_written_bytes": None if io_start is None or io_end is None else io_end[1] - io_start[1]}
+
+
+def record_item(run, stage_name, item, seconds=None, **info):
+    """
+    Record the latency and other information of one item (e.g., one catchment) of a stage. Several
+    calls for the same item are merged (e.g., the latency from timed_call and the number of pixels
+    from the utility function). This function can be called from several threads.
+
+    Parameters:
+    - run (dict): Run from create_run (nothing is recorded when None).
+    - stage_name (str): Name of the stage.
+    - item (str): Name of the item (e.g., the basin_id).
+    - seconds (float): Latency of the item.
+    - info: Other information of the item. "bytes_read" and "bytes_written" are summed per stage.
+    """
+    if run is None:
+        return
+
+    if seconds is not None:
+        info["seconds"] = seconds
+
+    with run["lock"]:
+        run["items"].setdefault(stage_name, {}).setdefault(str(item), {}).update(info)
+
+
+def timed_call(run, stage_name, item, function, /, *args, **kwargs):
+    """
+    Call a function and record its latency as one item of a stage.
+
+    Parameters:
+    - run (dict): Run from create_run.
+    - stage_name (str): Name of the stage.
+    - item (str): Name of the item (e.g., the basin_id).
+    - function (callable): Function to be called with args and kwargs (which may also contain "run").
+
+    Returns:
+    - The result of the function.
+    """
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        record_item(run, stage_name, item, seconds=time.perf_counter() - start)
+
+
+def summarize_run(run, num_slowest=20):
+    """
+    Summarize a run: per stage, the wall time, items per second, latency statistics and histogram,
+    bytes read and written, peak memory and the slowest items.
+
+    Parameters:
+    - run (dict): Run from create_run.
+    - num_slowest (int): Number of slowest items listed per stage.
+
+    Returns:
+    - dict: Report of the run (JSON serializable).
+    """
+    with run["lock"]:
+        stages = {name: dict(values) for name, values in run["stages"].items()}
+        items = {name: {item: dict(info) for item, info in values.items()} for name, values in run["items"].items()}
+
+    report = {"name": run["name"], "start": run["start"], "metadata": run["metadata"],
+              "peak_rss_bytes": get_peak_rss(), "stages": {}}
+
+    for name in list(stages) + [name for name in items if name not in stages]:
+        summary = stages.get(name, {})
+        stage_items = items.get(name, {})
+        latencies = np.array([info["seconds"] for info in stage_items.values() if "seconds" in info])
+
+        summary["num_items"] = len(stage_items)
+        summary["bytes_read"] = int(sum(info.get("bytes_read", 0) for info in stage_items.values()))
+        summary["bytes_written"] = int(sum(info.get("bytes_written", 0) for info in stage_items.values()))
+
+        if "wall_time_s" in summary and summary["wall_time_s"] > 0:
+            summary["items_per_second"] = len(stage_items) / summary["wall_time_s"]
+
+        if len(latencies):
+            counts, _ = np.histogram(np.clip(latencies, HISTOGRAM_EDGES[0], HISTOGRAM_EDGES[-1]), bins=HISTOGRAM_EDGES)
+            summary["latency_s"] = {"total": float(latencies.sum()), "mean": float(latencies.mean()),
+                                    "min": float(latencies.min()), "p50": float(np.percentile(latencies, 50)),
+                                    "p90": float(np.percentile(latencies, 90)), "p99": float(np.percentile(latencies, 99)),
+                                    "max": float(latencies.max())}
+            summary["latency_histogram"] = {"edges_s": HISTOGRAM_EDGES.tolist(), "counts": counts.tolist()}
+
+        slowest = sorted(stage_items.items(), key=lambda pair: pair[1].get("seconds", 0), reverse=True)[:num_slowest]
+        summary["slowest_items"] = [{"item": item, **info} for item, info in slowest]
+
+        report["stages"][name] = summary
+
+    return report
+
+
+def write_report(run, path, num_slowest=20):
+    """
+    Write the report of a run (see summarize_run) to a JSON file.
+
+    Parameters:
+    - run (dict): Run from create_run.
+    - path (str): Path to the JSON file.
+    - num_slowest (int): Number of slowest items listed per stage.
+
+    Returns:
+    - dict: Report of the run.
+    """
+    report = summarize_run(run, num_slowest)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2, default=str)
+
+    return report
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+Normalizers of the raw streamflow files received/downloaded from the providers. Each provider format
+has one parser, which reads each file only once (with the C engine of pandas, after a scan of the
+header lines when needed) and returns the daily streamflow of its station(s). The files are parsed
+in parallel (one process per core) and the series are written directly into a preallocated
+date x station matrix, so the full continental matrix can be built in a single run.
+"""
+import io
+import os
+import glob
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import tqdm
+
+
+def find_line_end(content, start):
+    """
+    Position right after the first line of the content starting with the given bytes (header scan).
+
+    Args:
+    - content (bytes): Content of the file
+    - start (bytes): Beginning of the line (e.g., b"Werte:")
+
+    Returns:
+    - int: Position of the first byte after the line
+    """
+    position = 0 if content.startswith(start) else content.index(b"\n" + start) + 1
+
+    return content.index(b"\n", position) + 1
+
+
+def parse_AT(filename):
+    """
+    Parses one Austrian (eHYD) file: header lines until "Werte:", then "dd.mm.YYYY HH:MM:SS;value".
+
+    Args:
+    - filename (str): Path to the file (e.g., "Q-Tagesmittel-205997.csv")
+
+    Returns:
+    - list: One tuple (station, dates, values)
+    """
+    with open(filename, "rb") as file:
+        content = file.read()
+
+    data = pd.read_csv(io.BytesIO(content[find_line_end(content, b"Werte:"):]), encoding="latin-1", delimiter=";",
+                       header=None, usecols=[0, 1], names=["dates", "Qm3s"], dtype={"Qm3s": str})
+    dates = pd.to_datetime(data["dates"], format="%d.%m.%Y %H:%M:%S")
+
+    # Values with padding and decimal comma, and "Lücke" (gap) converted to nan:
+    values = pd.to_numeric(data["Qm3s"].str.strip().str.replace(",", ".", regex=False), errors="coerce")
+
+    namestation = os.path.basename(filename).split("-", 2)[2].replace(".csv", "")
+
+    return [(int(namestation), dates.values, values.values)]
+
+
+def parse_GRDC(filename):
+    """
+    Parses one GRDC file: 36 header lines, then "YYYY-MM-DD;hh:mm;value" with -999.0 as gaps.
+    """
+    data = pd.read_csv(filename, encoding="latin-1", skiprows=36, delimiter=";", usecols=[0, 2],
+                       names=["dates", "Qm3s"], header=0, na_values=[-999.0])
+    dates = pd.to_datetime(data["dates"], format="%Y-%m-%d")
+
+    namestation = os.path.basename(filename).split("_", 1)[0]
+
+    return [(int(namestation), dates.values, data["Qm3s"].values)]
+
+
+def parse_CH(filename):
+    """
+    Parses one CAMELS-CH file: "date;discharge_vol;discharge_spec;...".
+    """
+    data = pd.read_csv(filename, encoding="latin-1", delimiter=";", usecols=[0, 1], names=["dates", "Qm3s"], header=0)
+    dates = pd.to_datetime(data["dates"], format="%Y-%m-%d")
+
+    namestation = os.path.basename(filename).split("_", 5)[4].replace(".csv", "")
+
+    return [(int(namestation), dates.values, data["Qm3s"].values)]
+
+
+def parse_FR(filename):
+    """
+    Parses one French (eaufrance) file, with the columns "Date (TU)" and "Valeur (en m³/s)".
+    """
+    data = pd.read_csv(filename, encoding="latin-1", usecols=["Date (TU)", "Valeur (en mÂ³/s)"])
+    dates = pd.to_datetime(data["Date (TU)"].str[:10], format="%Y/%m/%d")
+
+    namestation = os.path.basename(filename).split("_", 1)[0]
+
+    return [(str(namestation), dates.values, data["Valeur (en mÂ³/s)"].values)]
+
+
+def parse_UK(filename):
+    """
+    Parses one UK (NRFA) file: the station is in the 4th line and the records start after the line
+    with "last" as second value.
+    """
+    with open(filename, "rb") as file:
+        content = file.read()
+
+    lines = content.split(b"\n", 4)
+    namestation = lines[3].decode("latin-1").split(",")[2].strip()
+
+    # Header scan: the first line whose second value is "last"
+    position = 0
+    for line in io.BytesIO(content):
+        position = position + len(line)
+        values = line.rstrip(b"\r\n").split(b",")
+        if len(values) > 1 and values[1] == b"last":
+            break
+
+    data = pd.read_csv(io.BytesIO(content[position:]), encoding="latin-1", delimiter=",", header=None,
+                       usecols=[0, 1], names=["dates", "Qm3s"])
+    dates = pd.to_datetime(data["dates"], format="%Y-%m-%d")
+
+    return [(int(namestation), dates.values, data["Qm3s"].values)]
+
+
+def parse_IS(filename):
+    """
+    Parses one Icelandic file, with the columns "YYYY", "MM", "DD" and "qobs".
+    """
+    data = pd.read_csv(filename, encoding="latin-1", delimiter=";", usecols=["YYYY", "MM", "DD", "qobs"])
+    dates = pd.to_datetime(pd.DataFrame({"year": data["YYYY"], "month": data["MM"], "day": data["DD"]}))
+
+    namestation = os.path.basename(filename).split("_", 1)[1].replace(".csv", "")
+
+    return [(int(namestation), dates.values, data["qobs"].values)]
+
+
+def parse_GR_HCMR(filename):
+    """
+    Parses one Greek (HCMR) file: sub-daily "YYYY-mm-dd HH:MM:SS,<value> cms", averaged per day.
+    """
+    data = pd.read_csv(filename, encoding="latin-1", header=1, delimiter=",", names=["dates", "Qm3s"], dtype={"Qm3s": str})
+    dates = pd.to_datetime(data["dates"], format="%Y-%m-%d %H:%M:%S")
+    values = pd.to_numeric(data["Qm3s"].str.replace(" cms", "", regex=False), errors="coerce")
+
+    daily = pd.Series(values.values, index=dates).resample("D").mean()
+
+    namestation = os.path.basename(filename).split("-", 3)[1].lstrip()
+
+    return [(namestation, daily.index.values, daily.values)]
+
+
+def parse_IE_EPA(filename):
+    """
+    Parses one Irish EPA file: the station and the parameter are in the header lines, and the records
+    start at the 8th line ("YYYY-mm-dd;value;quality"). The files which are not river discharge
+    (e.g., stage) give no series.
+    """
+    with open(filename, "rb") as file:
+        content = file.read()
+
+    header = pd.read_csv(io.BytesIO(content), delimiter=";", nrows=3, header=None)
+    if header.iloc[2, 1] != "River Discharge":
+        return []
+
+    data = pd.read_csv(io.BytesIO(content), skiprows=7, delimiter=";", usecols=range(3), names=["dates", "Qm3s", "quality"])
+    dates = pd.to_datetime(data["dates"], format="%Y-%m-%d")
+
+    daily = pd.Series(data["Qm3s"].values, index=dates).resample("D").mean()
+
+    return [(str(header.iloc[1, 1]), daily.index.values, daily.values)]
+
+
+def parse_IE_OPW(filename):
+    """
+    Parses one Irish OPW file (tab-separated): the station and the unit are in the header lines, and
+    the records start at the 9th line. The files which are not in m³/s (e.g., stage) give no series.
+    """
+    with open(filename, "rb") as file:
+        content = file.read()
+
+    header = pd.read_csv(io.BytesIO(content), delimiter="\t", nrows=6, header=None)
+    if header.iloc[5, 1] != "cubic meter per second":
+        return []
+
+    data = pd.read_csv(io.BytesIO(content), skiprows=8, delimiter="\t", usecols=range(3), names=["dates", "Qm3s", "quality"])
+    dates = pd.to_datetime(data["dates"], format="%Y/%m/%d")
+
+    return [(str(header.iloc[1, 1]), dates.values, data["Qm3s"].values)]
+
+
+def parse_IT_VA(filename):
+    """
+    Parses one Italian file of Aosta Valley: the station is in the 3rd line ("Stazione: <name>") and
+    the records ("YYYY-mm-dd;value" with decimal comma) start at the 8th line. The dates found more
+    than once are removed.
+    """
+    with open(filename, "rb") as file:
+        content = file.read()
+
+    data = pd.read_csv(io.BytesIO(content), encoding="latin-1", skiprows=7, delimiter=";", header=None,
+                       names=["dates", "Qm3s"], decimal=",")
+    dates = pd.to_datetime(data["dates"], format="%Y-%m-%d")
+    unique = ~dates.duplicated(keep=False).values
+
+    station = pd.read_csv(io.BytesIO(content), encoding="latin-1", skiprows=2, delimiter=";", header=None, nrows=1)
+    namestation = station.iloc[0, 0].replace("Stazione: ", " ")
+
+    return [(namestation, dates.values[unique], data["Qm3s"].values[unique])]
+
+
+def parse_IT_PI(filename):
+    """
+    Parses one Italian file of Piedmont: "dd/mm/YYYY;value" with decimal comma.
+    """
+    data = pd.read_csv(filename, delimiter=";", encoding="latin-1", usecols=[0, 1], decimal=",")
+    dates = pd.to_datetime(data.iloc[:, 0], format="%d/%m/%Y")
+
+    namestation = os.path.basename(filename).split("_", 1)[0]
+
+    return [(namestation, dates.values, data.iloc[:, 1].values)]
+
+
+def parse_IT_TR(filename):
+    """
+    Parses one Italian file of Trento: the station is in the 5th line and the records ("YYYY-mm-dd,value")
+    start after the header in the 7th line, averaged per day.
+    """
+    with open(filename, "rb") as file:
+        content = file.read()
+
+    data = pd.read_csv(io.BytesIO(content), delimiter=",", encoding="latin-1", skiprows=6, decimal=".")
+    dates = pd.to_datetime(data.iloc[:, 0], format="%Y-%m-%d")
+
+    daily = pd.Series(data.iloc[:, 1].values, index=dates).resample("D").mean()
+
+    namestation = pd.read_csv(io.BytesIO(content), delimiter=",", encoding="latin-1", skiprows=3, nrows=1).iloc[0, 1]
+
+    return [(namestation, daily.index.values, daily.values)]
+
+
+def parse_IT_TO(filename):
+    """
+    Parses one Italian file of Tuscany: the station is in the 2nd line and the records
+    ("dd/mm/YYYY;value;validation" with decimal comma) start at the 20th line, averaged per day.
+    """
+    with open(filename, "rb") as file:
+        content = file.read()
+
+    data = pd.read_csv(io.BytesIO(content), encoding="latin-1", skiprows=19, delimiter=";",
+                       names=["dates", "Qm3s", "Val"], decimal=",")
+    dates = pd.to_datetime(data["dates"], format="%d/%m/%Y")
+
+    daily = pd.Series(data["Qm3s"].values, index=dates).resample("D").mean()
+
+    namestation = pd.read_csv(io.BytesIO(content), encoding="latin-1", delimiter=";", nrows=1).iloc[0, 1]
+
+    return [(namestation, daily.index.values, daily.values)]
+
+
+def parse_IT_ISPRA(filename):
+    """
+    Parses one Italian file of ISPRA (qm3s_<station>.csv, see utils.IT): "YYYY-mm-ddTHH:MM:SS,value,quality",
+    averaged per day after setting the negative values to nan.
+    """
+    data = pd.read_csv(filename, encoding="latin-1", header=0, delimiter=",", decimal=".", names=["dates", "Qm3s", "quality"])
+    dates = pd.to_datetime(data["dates"], format="%Y-%m-%dT%H:%M:%S")
+    values = data["Qm3s"].where(data["Qm3s"] >= 0)
+
+    daily = pd.Series(values.values, index=dates).resample("D").mean()
+
+    namestation = os.path.basename(filename)[len("qm3s_"):].replace(".csv", "").replace("_", ":")
+
+    return [(namestation, daily.index.values, daily.values)]
+
+
+def parse_SI(filename):
+    """
+    Parses one Slovenian file (Excel), with the columns "Datum" (dd.mm.YYYY) and "pretok (m3/s)".
+    """
+    data = pd.read_excel(filename, sheet_name=0, usecols=["Datum", "pretok (m3/s)"])
+    dates = pd.to_datetime(data["Datum"], format="%d.%m.%Y")
+
+    namestation = os.path.basename(filename).split("_", 4)[1]
+
+    return [(int(namestation), dates.values, data["pretok (m3/s)"].values)]
+
+
+# Parser, folder (inside the raw data folder), files and period of each provider format:
+NORMALIZERS = {
+    "AT": {"parse": parse_AT, "path": "AT/Q-Tagesmittel", "pattern": "*.csv", "start": "1900-01-01", "end": "2022-12-31"},
+    "GRDC": {"parse": parse_GRDC, "path": "GRDC", "pattern": "*.txt", "start": "1900-01-01", "end": "2022-12-31"},
+    "CH": {"parse": parse_CH, "path": "CH", "pattern": "*.csv", "start": "1981-01-01", "end": "2022-12-31"},
+    "FR": {"parse": parse_FR, "path": "FR", "pattern": "*.csv", "start": "1840-01-01", "end": "2023-12-31"},
+    "UK": {"parse": parse_UK, "path": "UK", "pattern": "*.csv", "start": "1900-01-01", "end": "2022-12-31"},
+    "IS": {"parse": parse_IS, "path": "IS", "pattern": "*.csv", "start": "1950-01-01", "end": "2023-12-31"},
+    "GR_HCMR": {"parse": parse_GR_HCMR, "path": "GR/HCMR", "pattern": "*.csv", "start": "2014-01-01", "end": "2023-12-31"},
+    "IE_EPA": {"parse": parse_IE_EPA, "path": "IE/EPA", "pattern": "*.csv", "start": "1900-01-01", "end": "2023-12-31"},
+    "IE_OPW": {"parse": parse_IE_OPW, "path": "IE/OPW", "pattern": "*.txt", "start": "1900-01-01", "end": "2023-12-31"},
+    "IT_VA": {"parse": parse_IT_VA, "path": "IT/VAL", "pattern": "*.csv", "start": "1978-01-01", "end": "2022-12-31"},
+    "IT_PI": {"parse": parse_IT_PI, "path": "IT/PIE", "pattern": "*.csv", "start": "1990-01-01", "end": "2022-12-31"},
+    "IT_TR": {"parse": parse_IT_TR, "path": "TRE", "pattern": "*.csv", "start": "1978-10-01", "end": "2022-12-31"},
+    "IT_TO": {"parse": parse_IT_TO, "path": "IT/TOS", "pattern": "*.csv", "start": "1920-01-01", "end": "2023-09-30"},
+    "IT_ISPRA": {"parse": parse_IT_ISPRA, "path": "IT/ISPRA", "pattern": "qm3s_*.csv", "start": "1900-01-01", "end": "2022-12-31"},
+    "SI": {"parse": parse_SI, "path": "SI", "pattern": "*.xls", "start": "1950-01-01", "end": "2022-12-31"},
+}
+
+
+def parse_file(name, filename, start, num_dates):
+    """
+    Parses one raw file (in a worker process) and converts its dates to rows of the matrix.
+
+    Args:
+    - name (str): Provider format (key of NORMALIZERS)
+    - filename (str): Path to the file
+    - start (np.datetime64): First date of the matrix
+    - num_dates (int): Number of dates (rows) of the matrix
+
+    Returns:
+    - list: One tuple (station, rows, values) per station of the file, only within the matrix period
+    """
+    series = []
+    for station, dates, values in NORMALIZERS[name]["parse"](filename):
+        rows = (dates.astype("datetime64[D]") - start).astype(np.int64)
+        inside = (rows >= 0) & (rows < num_dates)
+        series.append((station, rows[inside], np.asarray(values, dtype=np.float64)[inside]))
+
+    return series
+
+
+def create_matrix(start, end, num_columns, dtype=np.float64):
+    """
+    Creates an empty daily matrix (dates x stations), filled with nan.
+
+    Args:
+    - start (str): First date (e.g., "1900-01-01")
+    - end (str): Last date (e.g., "2023-12-31")
+    - num_columns (int): Number of stations expected (more columns are added when needed)
+    - dtype (type): Type of the values
+
+    Returns:
+    - dict: Matrix with the dates, the column of each station and the values
+    """
+    dates = pd.date_range(start, end, freq="D")
+
+    return {"dates": dates, "start": np.datetime64(start, "D"), "columns": {},
+            "values": np.full((len(dates), max(num_columns, 1)), np.nan, dtype=dtype)}
+
+
+def add_series(matrix, station, rows, values):
+    """
+    Writes the series of one station into its column of the matrix (the capacity is doubled when full).
+    """
+    column = matrix["columns"].setdefault(station, len(matrix["columns"]))
+
+    if column >= matrix["values"].shape[1]:
+        extra = np.full_like(matrix["values"], np.nan)
+        matrix["values"] = np.concatenate([matrix["values"], extra], axis=1)
+
+    matrix["values"][rows, column] = values
+
+
+def matrix_to_dataframe(matrix):
+    """
+    Converts the matrix to a DataFrame with the dates as index and the stations as columns.
+    """
+    columns = list(matrix["columns"])
+    if columns and isinstance(columns[0], tuple):
+        columns = pd.MultiIndex.from_tuples(columns, names=["provider", "station"])
+
+    return pd.DataFrame(matrix["values"][:, :len(columns)], index=matrix["dates"], columns=columns)
+
+
+def normalize_providers(names, PATH_RAW, start=None, end=None, num_workers=None, dtype=np.float64):
+    """
+    Parses the raw files of several providers in parallel into a single daily matrix.
+
+    Args:
+    - names (list): Provider formats (keys of NORMALIZERS), e.g., ["AT", "CH", "FR"]
+    - PATH_RAW (str): Folder with the raw data (e.g., "data/streamflow/raw_data")
+    - start (str): First date of the matrix (by default the earliest of the providers)
+    - end (str): Last date of the matrix (by default the latest of the providers)
+    - num_workers (int): Number of processes (by default the number of cores)
+    - dtype (type): Type of the values (e.g., np.float32 for halving the memory)
+
+    Returns:
+    - pd.DataFrame: Daily streamflow with the columns (provider, station)
+    - pd.DataFrame: Status of each file ("done" or "failed" with the error)
+    """
+    start = start or min(NORMALIZERS[name]["start"] for name in names)
+    end = end or max(NORMALIZERS[name]["end"] for name in names)
+
+    files = [(name, filename) for name in names
+             for filename in sorted(glob.glob(os.path.join(PATH_RAW, NORMALIZERS[name]["path"], NORMALIZERS[name]["pattern"])))]
+
+    matrix = create_matrix(start, end, len(files), dtype)
+    num_dates = len(matrix["dates"])
+
+    status = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(parse_file, name, filename, matrix["start"], num_dates): (name, filename)
+                   for name, filename in files}
+
+        for future in tqdm.tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            name, filename = futures[future]
+            try:
+                series = future.result()
+            except Exception as error:
+                status.append({"provider": name, "filename": filename, "status": "failed",
+                               "error": f"{type(error).__name__}: {error}"})
+                continue
+
+            for station, rows, values in series:
+                add_series(matrix, (name, station), rows, values)
+            status.append({"provider": name, "filename": filename, "status": "done", "error": None})
+
+    status = pd.DataFrame(status, columns=["provider", "filename", "status", "error"])
+
+    return matrix_to_dataframe(matrix), status
+
+
+def normalize_provider(name, PATH_RAW, num_workers=None, dtype=np.float64):
+    """
+    Parses the raw files of one provider in parallel into a daily matrix over the provider period.
+
+    Args:
+    - name (str): Provider format (key of NORMALIZERS), e.g., "AT"
+    - PATH_RAW (str): Folder with the raw data (e.g., "data/streamflow/raw_data")
+    - num_workers (int): Number of processes (by default the number of cores)
+    - dtype (type): Type of the values
+
+    Returns:
+    - pd.DataFrame: Daily streamflow with the stations as columns
+    - pd.DataFrame: Status of each file ("done" or "failed" with the error)
+    """
+    timeseries, status = normalize_providers([name], PATH_RAW, num_workers=num_workers, dtype=dtype)
+    if isinstance(timeseries.columns, pd.MultiIndex):
+        timeseries.columns = timeseries.columns.droplevel("provider")
+
+    return timeseries, status
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+Adapters of the streamflow providers. Each provider may declare a plain HTTP recipe ("fetch" and 
+"save"), used in preference to the browser (Selenium), which is then only the fallback for the 
+stations where the HTTP request failed. The output of both is checked with the reader of the 
+provider ("read"), and the recipes can be checked against recorded responses (check_provider).
+"""
+import os
+import re
+import json
+import time
+import types
+import datetime
+import tempfile
+import urllib.parse
+import concurrent.futures
+import pandas as pd
+import requests
+import tqdm
+from .browser import create_pool, close_pool, run_pool
+from .instrumentation import record_item, stage
+from .FR import download_station_FR
+from .IE import download_station_IEEPA
+from .IT import get_url_ITIS, parse_waterml_ITIS, export_ITIS
+
+# Daily mean streamflow (QmJ) of the French stations from the Hub'Eau API (the same data as the eaufrance export):
+URL_HUBEAU_FR = "https://hubeau.eaufrance.fr/api/v1/hydrometrie/obs_elab"
+
+# Hub'Eau returns at most 20000 values per request (page x size), so the series is requested in fixed
+# windows of WINDOW_YEARS_FR years (at most 18263 daily values each) from FIRST_YEAR_FR onwards:
+FIRST_YEAR_FR = 1850
+WINDOW_YEARS_FR = 50
+
+
+def fetch_FR(http_session, code, timeout=60):
+    """
+    Requests the daily mean streamflow of one French station from Hub'Eau, one request per window 
+    of dates (see WINDOW_YEARS_FR), and concatenates the windows.
+    
+    Returns:
+    - bytes: Response (JSON with the list "data")
+    """
+    data = []
+    for first_year in range(FIRST_YEAR_FR, datetime.date.today().year + 1, WINDOW_YEARS_FR):
+        params = {"code_entite": code, "grandeur_hydro_elab": "QmJ", "size": 20000,
+                  "date_debut_obs_elab": f"{first_year}-01-01",
+                  "date_fin_obs_elab": f"{first_year + WINDOW_YEARS_FR - 1}-12-31"}
+        response = http_session.get(URL_HUBEAU_FR, params=params, timeout=timeout)
+        response.raise_for_status()
+        page = response.json()
+
+        # A next page could not be requested (beyond the limit), so the series would be incomplete:
+        if page.get("next"):
+            raise ValueError(f"More than 20000 values between {params['date_debut_obs_elab']} and "
+                             f"{params['date_fin_obs_elab']} for station {code}")
+        data.extend(page.get("data") or [])
+
+    return json.dumps({"data": data}).encode()
+
+
+def save_FR(content, code, PATH_EXP):
+    """
+    Writes a Hub'Eau response as a csv-file with the columns of the eaufrance export (l/s to m³/s), 
+    sorted by date (the pages are not in order and may repeat a date, kept only once).
+    
+    Returns:
+    - str: Path to the csv-file
+    """
+    data = pd.DataFrame(json.loads(content)["data"])
+    if data.empty:
+        raise ValueError(f"No data for station {code}")
+
+    timeseries = pd.DataFrame({'Date (TU)': pd.to_datetime(data["date_obs_elab"]).dt.strftime('%Y/%m/%d'),
+                               'Valeur (en m³/s)': data["resultat_obs_elab"] / 1000,
+                               'Qualification': data.get("libelle_qualification")})
+    timeseries = timeseries.sort_values('Date (TU)', kind='stable').drop_duplicates('Date (TU)')
+
+    path = os.path.join(PATH_EXP, f"{code}_QmJ.csv")
+    timeseries.to_csv(path, index=False, encoding='utf-8')
+
+    return path
+
+
+def read_FR(path):
+    """
+    Reads one French csv-file (eaufrance export or save_FR).
+    
+    Returns:
+    - pd.DataFrame: Streamflow (Qm3s) and quality with the dates as index
+    """
+    data = pd.read_csv(path, encoding='latin-1', engine='python', usecols=['Date (TU)', 'Valeur (en mÂ³/s)', 'Qualification'])
+    data.columns = ['dates', 'Qm3s', 'quality']
+    data["dates"] = pd.to_datetime(data["dates"].str[:10], format='%Y/%m/%d')
+
+    return data.set_index("dates")
+
+
+def read_IEEPA(path):
+    """
+    Reads one csv-file of the Irish EPA (only the river discharge files).
+    
+    Returns:
+    - pd.DataFrame: Streamflow (Qm3s) and quality with the dates as index
+    """
+    header = pd.read_csv(path, delimiter=";", nrows=3, header=None)
+    if header.iloc[2, 1] != "River Discharge":
+        raise ValueError(f"The file is not a river discharge series: {header.iloc[2, 1]}")
+
+    data = pd.read_csv(path, skiprows=7, delimiter=";", usecols=range(3), names=["dates", "Qm3s", "quality"])
+    data["dates"] = pd.to_datetime(data["dates"], format='%Y-%m-%d')
+
+    return data.set_index("dates")
+
+
+def fetch_ITIS(http_session, code, timeout=300):
+    """
+    Requests the WaterML response of one Italian (ISPRA hydroserver) station.
+    
+    Returns:
+    - bytes: Response
+    """
+    response = http_session.get(get_url_ITIS(code), timeout=timeout)
+    response.raise_for_status()
+
+    return response.content
+
+
+def save_ITIS(content, code, PATH_EXP):
+    """
+    Writes a WaterML response as a csv-file (see utils.IT).
+    
+    Returns:
+    - str: Path to the csv-file
+    """
+    export_ITIS(parse_waterml_ITIS(content), code, PATH_EXP, data=True, metadata=False)
+
+    # Modify the station code if necessary (as in export_ITIS)
+    modified_station_code = re.sub(r'[^\w]', '_', code)
+
+    return os.path.join(PATH_EXP, f"qm3s_{modified_station_code}.csv")
+
+
+def read_ITIS(path):
+    """
+    Reads one Italian csv-file (see utils.IT).
+    
+    Returns:
+    - pd.DataFrame: Streamflow (Qm3s) and quality with the dates as index
+    """
+    data = pd.read_csv(path, names=["dates", "Qm3s", "quality"], header=0)
+    data["dates"] = pd.to_datetime(data["dates"], format='%Y-%m-%dT%H:%M:%S')
+
+    return data.set_index("dates")
+
+
+# Adapters of the providers:
+# - fetch (callable or None): Plain HTTP request of one station, fetch(http_session, code) -> bytes
+# - save (callable or None): Writes a response as the provider file, save(content, code, PATH_EXP) -> path
+# - read (callable): Reads a provider file, read(path) -> DataFrame (Qm3s and quality with the dates as index)
+# - selenium (callable or None): Fallback with a browser session, selenium(session, code) -> path
+PROVIDERS = {
+    "FR": {"fetch": fetch_FR, "save": save_FR, "read": read_FR, "selenium": download_station_FR},
+    # No direct export URL was captured for the Irish EPA (Hydronet) yet, so only the browser is used:
+    "IE_EPA": {"fetch": None, "save": None, "read": read_IEEPA, "selenium": download_station_IEEPA},
+    "IT_ISPRA": {"fetch": fetch_ITIS, "save": save_ITIS, "read": read_ITIS, "selenium": None},
+}
+
+
+def check_output(provider, path):
+    """
+    Checks that a downloaded file can be read by the provider reader and holds a streamflow series 
+    (raises ValueError otherwise).
+    
+    Returns:
+    - int: Number of values
+    """
+    data = provider["read"](path)
+
+    if data.empty:
+        raise ValueError("The series is empty")
+    if not isinstance(data.index, pd.DatetimeIndex) or not data.index.is_monotonic_increasing:
+        raise ValueError("The dates are not sorted")
+    if not pd.api.types.is_numeric_dtype(data["Qm3s"]):
+        raise ValueError("The streamflow is not numeric")
+
+    return len(data)
+
+
+def download_http(provider, codes, PATH_EXP, num_workers=8, run=None):
+    """
+    Downloads the stations with the HTTP recipe of a provider (several requests at the same time, 
+    sharing the connections). The latency and status of each station are recorded in run (from 
+    utils.instrumentation.create_run), when given.
+    
+    Returns:
+    - list: Status of each station (dict)
+    """
+    def download(code):
+        start = time.perf_counter()
+        try:
+            path = provider["save"](provider["fetch"](http_session, code), code, PATH_EXP)
+            check_output(provider, path)
+            result, error = path, None
+        except Exception as exception:
+            result, error = None, f"{type(exception).__name__}: {exception}"
+
+        seconds = time.perf_counter() - start
+        record_item(run, "download_http", code, seconds=seconds, status="failed" if error else "done", error=error)
+
+        return {"item": code, "method": "http", "status": "failed" if error else "done", "seconds": seconds,
+                "error": error, "result": result}
+
+    with stage(run, "download_http"), requests.Session() as http_session:
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=num_workers)
+        http_session.mount("http://", adapter)
+        http_session.mount("https://", adapter)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return list(tqdm.tqdm(executor.map(download, codes), total=len(codes)))
+
+
+def download_provider(name, codes, PATH_EXP, num_workers=8, num_sessions=2, headless=True, use_http=True,
+                      use_selenium=True, run=None):
+    """
+    Downloads the streamflow of many stations of one provider: first with plain HTTP requests (when 
+    the provider has a recipe) and then with a pool of browser sessions for the stations that failed 
+    (when the provider has a browser flow).
+    
+    Args:
+    - name (str): Provider (key of PROVIDERS, e.g., "FR")
+    - codes (list): Station codes
+    - PATH_EXP (str): Path to export the downloaded data
+    - num_workers (int): Number of simultaneous HTTP requests
+    - num_sessions (int): Number of browser sessions of the fallback
+    - headless (bool): Run the browsers without a window
+    - use_http (bool): Use the HTTP recipe
+    - use_selenium (bool): Use the browser for the stations without HTTP download
+    - run (dict): Run from utils.instrumentation.create_run, where the latency of each station is recorded 
+      (stages "download_http" and the name of the browser flow) (optional)
+    
+    Returns:
+    - pd.DataFrame: Status of each station (item, method, status, seconds, error and path to the file)
+    """
+    provider = PROVIDERS[name]
+    codes = list(codes)
+    os.makedirs(PATH_EXP, exist_ok=True)
+
+    results = {}
+    if use_http and provider["fetch"] is not None:
+        results = {result["item"]: result for result in download_http(provider, codes, PATH_EXP, num_workers, run)}
+
+    pending = [code for code in codes if code not in results or results[code]["status"] != "done"]
+    if pending and use_selenium and provider["selenium"] is not None:
+        pool = create_pool(num_sessions, headless=headless, download_dir=PATH_EXP)
+        try:
+            status = run_pool(pool, provider["selenium"], pending, run=run)
+        finally:
+            close_pool(pool)
+
+        for row in status.to_dict("records"):
+            if row["status"] == "done":
+                try:
+                    check_output(provider, row["result"])
+                except Exception as exception:
+                    row["status"], row["error"] = "failed", f"{type(exception).__name__}: {exception}"
+            results[row["item"]] = dict(row, method="selenium")
+
+    return pd.DataFrame([results.get(code, {"item": code, "status": "failed", "error": "No download method"})
+                         for code in codes], columns=["item", "method", "status", "seconds", "error", "result"])
+
+
+def get_request_url(url, params=None):
+    """
+    Full URL of a GET request (with the parameters), used as the key of the recorded responses.
+    """
+    return requests.Request("GET", url, params=params).prepare().url
+
+
+def record_responses(name, codes, path_recorded, timeout=300):
+    """
+    Saves the HTTP responses of some stations (one JSON file per station, with the URL, status code 
+    and content of each request of the station), to be replayed by check_provider.
+    """
+    provider = PROVIDERS[name]
+    os.makedirs(path_recorded, exist_ok=True)
+
+    with requests.Session() as http_session:
+        for code in tqdm.tqdm(codes):
+            responses = []
+
+            def get(url, params=None, timeout=timeout):
+                response = http_session.get(url, params=params, timeout=timeout)
+                responses.append({"url": get_request_url(url, params), "status_code": response.status_code,
+                                  "content": response.content.decode("utf-8")})
+                return response
+
+            provider["fetch"](types.SimpleNamespace(get=get), code)
+
+            with open(os.path.join(path_recorded, urllib.parse.quote(code, safe="") + ".json"), "w", encoding="utf-8") as file:
+                json.dump(responses, file, indent=1, ensure_ascii=False)
+
+
+def replay_session(responses):
+    """
+    Session replaying the recorded responses of one station (see record_responses): a request that 
+    was not recorded raises requests.ConnectionError, so that a change of the requests is detected.
+    """
+    recorded = {response["url"]: response for response in responses}
+
+    def get(url, params=None, timeout=None):
+        request_url = get_request_url(url, params)
+        if request_url not in recorded:
+            raise requests.ConnectionError(f"Request not recorded: {request_url}")
+
+        response = requests.Response()
+        response.url, response.status_code = request_url, recorded[request_url]["status_code"]
+        response._content = recorded[request_url]["content"].encode("utf-8")
+        return response
+
+    return types.SimpleNamespace(get=get)
+
+
+def check_provider(name, path_recorded):
+    """
+    Checks the HTTP recipe of a provider against recorded responses (see record_responses): the 
+    requests of each station are replayed, and the response is saved as the provider file and read 
+    back by the provider reader.
+    
+    Returns:
+    - pd.DataFrame: Status of each recorded station (item, status, num_values and error)
+    """
+    provider = PROVIDERS[name]
+    results = []
+
+    with tempfile.TemporaryDirectory() as PATH_EXP:
+        for filename in sorted(os.listdir(path_recorded)):
+            if not filename.endswith(".json"):
+                continue
+            code = urllib.parse.unquote(filename[:-len(".json")])
+            with open(os.path.join(path_recorded, filename), encoding="utf-8") as file:
+                responses = json.load(file)
+            try:
+                content = provider["fetch"](replay_session(responses), code)
+                num_values, error = check_output(provider, provider["save"](content, code, PATH_EXP)), None
+            except Exception as exception:
+                num_values, error = None, f"{type(exception).__name__}: {exception}"
+            results.append({"item": code, "status": "failed" if error else "done", "num_values": num_values, "error": error})
+
+    return pd.DataFrame(results, columns=["item", "status", "num_values", "error"])
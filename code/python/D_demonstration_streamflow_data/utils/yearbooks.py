@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+Conversion of the hydrological yearbooks (PDF) to CSV with tabula. The yearbooks are converted in
+parallel (one process per yearbook) and the tables extracted are cached, with the hash of the PDF
+and the page range as key. Running the conversion again only extracts the yearbooks (or page ranges)
+that changed, and the processing of the CSV-files can be adjusted without converting the PDFs again.
+"""
+import os
+import shutil
+import hashlib
+import concurrent.futures
+import pandas as pd
+import tabula
+import tqdm
+
+
+def hash_file(filename, chunk_size=1 << 20):
+    """
+    Computes the SHA-256 hash of a file (read in chunks).
+
+    Args:
+    - filename (str): Path to the file
+    - chunk_size (int): Number of bytes read at once
+
+    Returns:
+    - str: Hexadecimal hash of the content
+    """
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def get_cache_path(PATH_CACHE, pdf_hash, pages):
+    """
+    Path of the cached tables of one PDF and page range (e.g., "<hash>_56-83.csv").
+    """
+    return os.path.join(PATH_CACHE, f"{pdf_hash}_{str(pages).replace(',', '_')}.csv")
+
+
+def convert_pdf(filename, pages, PATH_CACHE, output=None):
+    """
+    Converts the tables of one PDF to a CSV-file, using the cache when the same PDF and page range
+    were already extracted. An existing output is kept when it comes from the cache (e.g., after
+    manual checks), and replaced only when the tables were extracted again.
+
+    Args:
+    - filename (str): Path to the PDF
+    - pages (str): Page range with the tables (e.g., "56-83")
+    - PATH_CACHE (str): Folder of the cache
+    - output (str): Path to the CSV-file (by default, the PDF path with ".csv")
+
+    Returns:
+    - dict: Filename, output, page range and if the tables were extracted or taken from the cache
+    """
+    output = output or filename.replace(".pdf", ".csv")
+    cache_path = get_cache_path(PATH_CACHE, hash_file(filename), pages)
+
+    extracted = not os.path.exists(cache_path)
+    if extracted:
+        # Written first to a temporary file, so an interrupted conversion is not taken as cached:
+        tabula.convert_into(filename, cache_path + ".tmp", output_format="csv", pages=pages)
+        os.replace(cache_path + ".tmp", cache_path)
+
+    if extracted or not os.path.exists(output):
+        shutil.copyfile(cache_path, output)
+
+    return {"filename": filename, "output": output, "pages": pages, "extracted": extracted}
+
+
+def convert_pdfs(filenames, pages_pdfs, PATH_CACHE, num_workers=None):
+    """
+    Converts several PDFs to CSV-files in parallel (see convert_pdf).
+
+    Args:
+    - filenames (list): Paths to the PDFs
+    - pages_pdfs (list): Page range of each PDF (same order as the filenames)
+    - PATH_CACHE (str): Folder of the cache
+    - num_workers (int): Number of processes (by default the number of cores)
+
+    Returns:
+    - pd.DataFrame: Status of each PDF ("extracted", "cached" or "failed" with the error)
+    """
+    if len(filenames) != len(pages_pdfs):
+        raise ValueError(f"{len(filenames)} PDFs were given with {len(pages_pdfs)} page ranges.")
+
+    os.makedirs(PATH_CACHE, exist_ok=True)
+
+    status = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(convert_pdf, filename, pages, PATH_CACHE): (filename, pages)
+                   for filename, pages in zip(filenames, pages_pdfs)}
+
+        for future in tqdm.tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            filename, pages = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:
+                status.append({"filename": filename, "pages": pages, "status": "failed",
+                               "error": f"{type(error).__name__}: {error}"})
+                continue
+
+            status.append({"filename": filename, "pages": pages,
+                           "status": "extracted" if result["extracted"] else "cached", "error": None})
+
+    # Same order as the PDFs:
+    status = pd.DataFrame(status, columns=["filename", "pages", "status", "error"])
+
+    return status.set_index("filename").loc[list(filenames)].reset_index()
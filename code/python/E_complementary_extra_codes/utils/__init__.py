@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Nov 10 18:23:59 2023
+
+@author: thiagomedeirosdonascimento
+"""
+
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below resolve the duplicated catchments of the network. The catchments and their
+duplicated suspects are the nodes and edges of a graph, whose connected components (found with a
+union-find) are the groups of duplicates. From each group, only the catchment with the longest
+time-series is kept.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Basin IDs inside the stringified lists of the csv-files (e.g., "['FR001477', 'FR001478']"):
+ID_PATTERN = r"[^\s,'\"\[\]]+"
+
+
+def parse_id_lists(series):
+    """
+    Convert a column of stringified lists of basin IDs to a column of lists (nan is kept).
+
+    Parameters:
+    - series (pd.Series): Column as read from the csv-file (e.g., "duplicated_suspect").
+
+    Returns:
+    - pd.Series: Column with one list of basin IDs per row.
+    """
+    lists = series.astype("string").str.findall(ID_PATTERN)
+
+    return lists.astype(object).where(series.notna(), np.nan)
+
+
+def find_root(parent, node):
+    """
+    Root of a node in the union-find, compressing the path on the way.
+    """
+    root = node
+    while parent[root] != root:
+        root = parent[root]
+
+    while parent[node] != root:
+        parent[node], node = root, parent[node]
+
+    return root
+
+
+def find_components(num_nodes, sources, targets):
+    """
+    Connected components of a graph given by its edges (sparse adjacency), with a union-find.
+
+    Parameters:
+    - num_nodes (int): Number of nodes.
+    - sources (np.array): First node of each edge.
+    - targets (np.array): Second node of each edge.
+
+    Returns:
+    - np.array: Component of each node, labelled by its first node.
+    """
+    parent = list(range(num_nodes))
+
+    for source, target in zip(sources.tolist(), targets.tolist()):
+        root_source, root_target = find_root(parent, source), find_root(parent, target)
+        if root_source != root_target:
+            # The first node stays as root, so the labels follow the order of the network:
+            parent[max(root_source, root_target)] = min(root_source, root_target)
+
+    return np.array([find_root(parent, node) for node in range(num_nodes)])
+
+
+def find_duplicate_groups(network, column="duplicated_suspect"):
+    """
+    Group of duplicates of each catchment (connected components of the duplicated suspects).
+    Suspects which are not in the network are ignored.
+
+    Parameters:
+    - network (pd.DataFrame): Network with the basin_id as index and the column with the lists of suspects.
+    - column (str): Column with the lists of duplicated suspects (already parsed, see parse_id_lists).
+
+    Returns:
+    - pd.Series: Label of the group of each catchment (the position of its first catchment).
+    """
+    suspects = network[column].dropna().explode().dropna()
+
+    sources = network.index.get_indexer(suspects.index)
+    targets = network.index.get_indexer(suspects.values)
+    found = targets >= 0
+
+    groups = find_components(len(network), sources[found], targets[found])
+
+    return pd.Series(groups, index=network.index, name="group")
+
+
+def select_unique_catchments(network, column="duplicated_suspect", by="num_years"):
+    """
+    Keep only one catchment per group of duplicates: the one with the largest value of "by" (the
+    first of the network in case of a tie). The catchments without suspects are all kept.
+
+    Parameters:
+    - network (pd.DataFrame): Network with the basin_id as index and the column with the lists of suspects.
+    - column (str): Column with the lists of duplicated suspects (already parsed, see parse_id_lists).
+    - by (str): Column used for choosing the catchment kept (e.g., "num_years").
+
+    Returns:
+    - pd.DataFrame: Network without the duplicates, in the original order.
+    """
+    groups = find_duplicate_groups(network, column)
+
+    # Catchments without a value of "by" are only kept when they are alone in their group:
+    keepers = network[by].fillna(-np.inf).groupby(groups.values).idxmax()
+
+    return network[network.index.isin(keepers.values)]
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below update and extend the EStreams tables with the attributes of new or updated
+catchments (upsert), keyed by the basin_id. The rows of each basin_id are hashed, so the changed
+catchments are found at once. The tables can be kept in a store partitioned by the country code of
+the basin_id (one parquet-file per country), where only the partitions with changes are written again.
+The changes (inserted, updated or unchanged catchments) are returned as a report.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Number of characters of the basin_id defining the partition (the country code, e.g., "AT" of "AT000001"):
+PARTITION_LENGTH = 2
+
+
+def hash_rows(table):
+    """
+    Hash of the values of each row (the index is not included).
+
+    Parameters:
+    - table (pd.DataFrame): Table with the basin_id as index.
+
+    Returns:
+    - pd.Series: Hash (uint64) of each row.
+    """
+    return pd.util.hash_pandas_object(table, index=False)
+
+
+def upsert_table(old, new, insert=True):
+    """
+    Upsert the rows of a new table into an old one, keyed by the index (basin_id). The rows already
+    in the old table are updated with the values of the new one (nan values of the new table do not
+    replace the old ones and the columns not in the old table are ignored, as with DataFrame.update),
+    and the other rows are inserted at the end.
+
+    Parameters:
+    - old (pd.DataFrame): Old table with the basin_id as index.
+    - new (pd.DataFrame): New table with the basin_id as index.
+    - insert (bool): If False, the rows not in the old table are skipped (only updates).
+
+    Returns:
+    - pd.DataFrame: Updated table.
+    - pd.DataFrame: Report with the change of each basin_id of the new table ("inserted", "updated",
+                    "unchanged" or "skipped") and the number of values changed.
+    """
+    common = new.index[new.index.isin(old.index)]
+    inserted = new.index[~new.index.isin(old.index)]
+
+    # Delta of the rows in both tables:
+    current = old.loc[common]
+    updated = current.copy()
+    updated.update(new.loc[common])
+    current = current.astype(updated.dtypes.to_dict())
+
+    changed = (hash_rows(current).values != hash_rows(updated).values)
+    num_values = ((current != updated) & ~(current.isna() & updated.isna())).sum(axis=1).values
+
+    table = old.copy()
+    if changed.any():
+        table = table.astype(updated.dtypes.to_dict())
+        table.loc[common[changed]] = updated[changed]
+    if insert and len(inserted):
+        table = pd.concat([table, new.loc[inserted]], axis=0).rename_axis(old.index.name)
+
+    report = pd.DataFrame({"change": np.where(changed, "updated", "unchanged"), "num_values_changed": num_values},
+                          index=common)
+    report = pd.concat([report, pd.DataFrame({"change": "inserted" if insert else "skipped",
+                                              "num_values_changed": new.loc[inserted].notna().sum(axis=1).values if insert else 0},
+                                             index=inserted)])
+    report.index.name = old.index.name or new.index.name
+
+    return table, report.loc[new.index]
+
+
+def get_partitions(basin_ids, length=PARTITION_LENGTH):
+    """
+    Partition of each basin_id (its first characters, e.g., the country code).
+    """
+    return pd.Index(basin_ids).astype(str).str[:length]
+
+
+def get_partition_path(PATH_STORE, name, partition):
+    """
+    Path of one partition of a table in the store (e.g., "<store>/estreams_soil_attributes/AT.parquet").
+    """
+    return os.path.join(PATH_STORE, name, f"{partition}.parquet")
+
+
+def read_partition(PATH_STORE, name, partition, axis=0):
+    """
+    Read one partition of a table with the basin_id as rows, or None if it does not exist.
+    """
+    path = get_partition_path(PATH_STORE, name, partition)
+    if not os.path.exists(path):
+        return None
+
+    table = pd.read_parquet(path)
+
+    return table.T if axis == 1 else table
+
+
+def write_partition(table, PATH_STORE, name, partition, axis=0):
+    """
+    Write one partition of a table given with the basin_id as rows (replaced only when complete).
+    """
+    path = get_partition_path(PATH_STORE, name, partition)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    table = table.sort_index()
+    (table.T if axis == 1 else table).to_parquet(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def upsert_store(new, PATH_STORE, name, axis=0, insert=True):
+    """
+    Upsert a new table into a table of the store (see upsert_table). Only the partitions with
+    catchments of the new table are read, and only those with changes are written again.
+
+    Parameters:
+    - new (pd.DataFrame): New table, with the basin_id as index (axis=0, e.g., static attributes) or
+                          as columns (axis=1, e.g., time-series with the dates as index).
+    - PATH_STORE (str): Folder of the store (e.g., "results/store").
+    - name (str): Name of the table (e.g., "estreams_soil_attributes").
+    - axis (int): 0 if the basin_ids are the rows, 1 if they are the columns.
+    - insert (bool): If False, the catchments not in the store are skipped (only updates).
+
+    Returns:
+    - pd.DataFrame: Report with the partition and the change of each basin_id of the new table.
+    """
+    new = new.T if axis == 1 else new
+    partitions = get_partitions(new.index)
+
+    reports = []
+    for partition in pd.unique(partitions):
+        new_partition = new[partitions == partition]
+        old_partition = read_partition(PATH_STORE, name, partition, axis)
+
+        if old_partition is None:
+            old_partition = new_partition.iloc[:0]
+
+        table, report = upsert_table(old_partition, new_partition, insert)
+
+        if report.change.isin(["inserted", "updated"]).any():
+            write_partition(table, PATH_STORE, name, partition, axis)
+
+        reports.append(report.assign(partition=partition))
+
+    if not reports:
+        return pd.DataFrame(columns=["change", "num_values_changed", "partition"])
+
+    return pd.concat(reports)
+
+
+def read_store(PATH_STORE, name, axis=0):
+    """
+    Read all the partitions of a table of the store.
+
+    Parameters:
+    - PATH_STORE (str): Folder of the store.
+    - name (str): Name of the table.
+    - axis (int): 0 if the basin_ids are the rows, 1 if they are the columns.
+
+    Returns:
+    - pd.DataFrame: Table sorted by basin_id.
+    """
+    folder = os.path.join(PATH_STORE, name)
+    partitions = sorted(filename[:-len(".parquet")] for filename in os.listdir(folder) if filename.endswith(".parquet"))
+
+    table = pd.concat([read_partition(PATH_STORE, name, partition, axis) for partition in partitions], axis=0).sort_index()
+
+    return table.T if axis == 1 else table
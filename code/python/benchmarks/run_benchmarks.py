@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+Benchmarks of the computation utilities on synthetic inputs (see synthetic.py). Each run appends one
+record (date, commit, machine, versions, sizes and timings) to a JSON-lines file, so that the
+timings can be tracked over time, and prints the change against the previous run with the same
+sizes on the same machine.
+
+Usage (from the folder "code/python"):
+    python benchmarks/run_benchmarks.py --gauges 100 --years 30 --gap-ratio 0.05
+"""
+
+import os
+
+# The progress bars of the utilities are not needed here:
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import argparse
+import contextlib
+import datetime
+import importlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from synthetic import make_gauge_matrix, make_catchments, make_grid
+
+# Folder "code/python", with one "utils" package per sub-folder:
+CODE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_utils(folder, module):
+    """
+    Import one module of the "utils" package of a sub-folder (e.g., "C_computation_signatures_and_indices").
+    Each sub-folder has its own "utils" package, so the previous one is removed from sys.modules first.
+    """
+    for name in [name for name in sys.modules if name == "utils" or name.startswith("utils.")]:
+        del sys.modules[name]
+
+    sys.path.insert(0, os.path.join(CODE_PATH, folder))
+    try:
+        return importlib.import_module(f"utils.{module}")
+    finally:
+        sys.path.pop(0)
+
+
+def get_benchmarks(args, path_out):
+    """
+    Generate the synthetic inputs and return the benchmarks as a dict with the name as key and a
+    function running the computation once as value.
+    """
+    general = import_utils("C_computation_signatures_and_indices", "general")
+    streamflowindices = import_utils("C_computation_signatures_and_indices", "streamflowindices")
+    fdc = import_utils("C_computation_signatures_and_indices", "fdc")
+    meteorology = import_utils("B_extraction_meteorological_records", "meteorology")
+    terrain = import_utils("A_extraction_landscape_attributes", "terrain")
+
+    streamflow, _ = make_gauge_matrix(args.gauges, args.years, args.gap_ratio, seed=args.seed)
+    quality = streamflow.isna().astype(int)
+    hydro_year = np.array(streamflow.index.year)
+
+    # Day-of-year mean and standard deviation of the log-streamflow (as for the outliers check):
+    log_streamflow = np.log(streamflow.where(streamflow > 0))
+    log_mean = log_streamflow.groupby(log_streamflow.index.dayofyear).mean()
+    log_std = log_streamflow.groupby(log_streamflow.index.dayofyear).std()
+
+    catchments = make_catchments(args.catchments, seed=args.seed)
+    values, latitude, longitude = make_grid(args.grid_days, seed=args.seed)
+
+    def annual_indices():
+        for gauge in streamflow.columns:
+            q, qc = streamflow[gauge].values, quality[gauge].values
+            streamflowindices.calculate_ct(q, qc, hydro_year)
+            streamflowindices.calculate_min_streamflow_day(q, qc, hydro_year)
+            streamflowindices.calculate_max_streamflow_day(q, qc, hydro_year)
+            streamflowindices.calculate_gini_coefficient(q, qc, hydro_year)
+
+    def annual_percentiles():
+        yearly = fdc.build_fdc(streamflow, rule="YS")
+        fdc.fdc_percentile(yearly, np.arange(10, 100, 10), min_count=360, complete=True)
+        fdc.fdc_percentile(yearly, [75, 25], min_count=360)
+
+    def process_catchments():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for basin_id in catchments.basin_id:
+                meteorology.process_catchment(basin_id, catchments, values, latitude, longitude, path_out, "pr")
+
+    return {
+        "general.longest_gap_measurements": lambda: general.longest_gap_measurements(streamflow),
+        "general.count_num_measurements": lambda: general.count_num_measurements(streamflow),
+        "general.check_for_potential_outliers": lambda: general.check_for_potential_outliers(log_streamflow, log_mean, log_std),
+        "streamflowindices.annual_indices": annual_indices,
+        "fdc.annual_percentiles": annual_percentiles,
+        "meteorology.process_catchment": process_catchments,
+        "terrain.calculate_dimensions": lambda: terrain.calculate_dimensions(catchments.geometry),
+    }
+
+
+def time_function(function, repeat):
+    """
+    Run a function repeat times and return the elapsed times (seconds).
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def get_commit():
+    """
+    Return the current git commit, or None outside a git repository.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=CODE_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_previous(path, machine, parameters):
+    """
+    Return the last record of the file with the same machine and parameters, or None.
+    """
+    if not os.path.exists(path):
+        return None
+
+    previous = None
+    with open(path) as file:
+        for line in file:
+            record = json.loads(line)
+            if record["machine"] == machine and record["parameters"] == parameters:
+                previous = record
+
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the EStreams computation utilities.")
+    parser.add_argument("--gauges", type=int, default=100, help="Number of gauges of the daily matrix.")
+    parser.add_argument("--years", type=int, default=30, help="Number of years of the daily matrix.")
+    parser.add_argument("--gap-ratio", type=float, default=0.05, help="Fraction of days with gaps.")
+    parser.add_argument("--catchments", type=int, default=20, help="Number of catchment polygons.")
+    parser.add_argument("--grid-days", type=int, default=365, help="Number of time-steps of the 0.25° grid.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic inputs.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each benchmark.")
+    parser.add_argument("--filter", default="", help="Run only the benchmarks containing this text.")
+    parser.add_argument("--output", default=os.path.join(CODE_PATH, "benchmarks", "benchmark_results.jsonl"),
+                        help="JSON-lines file where the results are appended.")
+    args = parser.parse_args()
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ["repeat", "filter", "output"]}
+    machine = platform.node()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as path_out:
+        benchmarks = get_benchmarks(args, path_out + os.sep)
+
+        for name, function in benchmarks.items():
+            if args.filter not in name:
+                continue
+            times = time_function(function, args.repeat)
+            results[name] = {"min": min(times), "median": float(np.median(times)), "repeat": args.repeat}
+
+    previous = read_previous(args.output, machine, parameters)
+
+    print(f"{'benchmark':<42}{'min (s)':>12}{'median (s)':>12}{'change':>10}")
+    for name, result in results.items():
+        change = ""
+        if previous is not None and name in previous["results"]:
+            change = f"{result['min'] / previous['results'][name]['min'] - 1:+.0%}"
+        print(f"{name:<42}{result['min']:>12.4f}{result['median']:>12.4f}{change:>10}")
+
+    record = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": get_commit(),
+              "machine": machine, "python": platform.python_version(), "numpy": np.__version__,
+              "pandas": pd.__version__, "parameters": parameters, "results": results}
+
+    with open(args.output, "a") as file:
+        file.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+The functions below generate synthetic inputs with the same structure as the EStreams data (daily
+gauge matrices with gaps, catchment polygons and 0.25° meteorological grids), so that the
+computation utilities can be benchmarked without the continental datasets.
+"""
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Polygon
+
+
+def make_gauge_matrix(num_gauges=100, num_years=30, gap_ratio=0.05, start_year=1990, seed=0):
+    """
+    Generate daily streamflow and precipitation time series [days x gauges] with gaps.
+
+    Parameters:
+    - num_gauges (int): Number of gauges (columns).
+    - num_years (int): Number of calendar years (rows are the days).
+    - gap_ratio (float): Fraction of days with gaps in the streamflow, half as isolated days and half
+    as gaps of 30 consecutive days.
+    - start_year (int): First year of the time series.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - tuple: Streamflow and precipitation (pd.DataFrame) with datetime as the index and the basin_id
+    as columns. The gaps are stored as np.nan in the streamflow only.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(f"{start_year}-01-01", f"{start_year + num_years - 1}-12-31", freq="D")
+    columns = [f"BENCH{i:05d}" for i in range(num_gauges)]
+
+    # Precipitation with a seasonal cycle and streamflow as a smoothed and scaled precipitation:
+    seasonality = 1 + 0.5 * np.sin(2 * np.pi * dates.dayofyear.to_numpy() / 365.25)[:, None]
+    precipitation = rng.gamma(0.5, 6, (len(dates), num_gauges)) * seasonality
+    streamflow = pd.DataFrame(precipitation).ewm(alpha=0.05).mean().to_numpy() * rng.uniform(0.2, 1, num_gauges)
+
+    # Isolated gaps:
+    streamflow[rng.random(streamflow.shape) < gap_ratio / 2] = np.nan
+
+    # Gaps of 30 days:
+    num_blocks = int(gap_ratio / 2 * len(dates) / 30)
+    for gauge in range(num_gauges):
+        for start in rng.integers(0, max(len(dates) - 30, 1), num_blocks):
+            streamflow[start:start + 30, gauge] = np.nan
+
+    streamflow = pd.DataFrame(streamflow, index=dates, columns=columns)
+    precipitation = pd.DataFrame(precipitation, index=dates, columns=columns)
+
+    return streamflow, precipitation
+
+
+def make_catchments(num_catchments=50, extent=(5.0, 45.0, 15.0, 55.0), radius=(0.1, 0.6), num_vertices=32, seed=0):
+    """
+    Generate irregular catchment polygons (lon/lat, EPSG:4326).
+
+    Parameters:
+    - num_catchments (int): Number of catchments.
+    - extent (tuple): Bounds (min_lon, min_lat, max_lon, max_lat) of the centres of the catchments.
+    - radius (tuple): Minimum and maximum mean radius of the catchments (degrees).
+    - num_vertices (int): Number of vertices of each polygon.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - gpd.GeoDataFrame: Catchments with the columns "basin_id" and "geometry".
+    """
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, num_vertices, endpoint=False)
+
+    geometries = []
+    for _ in range(num_catchments):
+        centre_x = rng.uniform(extent[0], extent[2])
+        centre_y = rng.uniform(extent[1], extent[3])
+        distances = rng.uniform(*radius) * rng.uniform(0.6, 1.4, num_vertices)
+        geometries.append(Polygon(zip(centre_x + distances * np.cos(angles), centre_y + distances * np.sin(angles))))
+
+    basin_id = [f"BENCH{i:05d}" for i in range(num_catchments)]
+
+    return gpd.GeoDataFrame({"basin_id": basin_id}, geometry=geometries, crs="EPSG:4326")
+
+
+def make_grid(num_days=365, extent=(4.0, 44.0, 16.0, 56.0), resolution=0.25, missing_ratio=0.01, seed=0):
+    """
+    Generate a daily meteorological grid as read from the E-OBS NetCDF files.
+
+    Parameters:
+    - num_days (int): Number of time-steps.
+    - extent (tuple): Bounds (min_lon, min_lat, max_lon, max_lat) of the grid.
+    - resolution (float): Size of the pixels (degrees).
+    - missing_ratio (float): Fraction of values stored as -9999.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - tuple: Values (np.array, float32) [time x latitude x longitude], latitude and longitude of the
+    centres of the pixels (np.array).
+    """
+    rng = np.random.default_rng(seed)
+    longitude = np.arange(extent[0] + resolution / 2, extent[2], resolution)
+    latitude = np.arange(extent[1] + resolution / 2, extent[3], resolution)
+
+    values = rng.gamma(0.5, 6, (num_days, len(latitude), len(longitude))).astype(np.float32)
+    values[rng.random(values.shape) < missing_ratio] = -9999
+
+    return values, latitude, longitude
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+Command-line runner of the EStreams notebooks (tasks in tasks.py). The tasks form a graph from
+their inputs and outputs and are executed in order, with the independent tasks running at the same
+time. A task is skipped when its notebook, utils, parameters and the content of its inputs did not
+change since its last successful run, so that a failed or interrupted run can be started again and
+only the remaining tasks are executed.
+
+Usage (from the folder "code/python"):
+    python pipeline/run_pipeline.py --list
+    python pipeline/run_pipeline.py hydrometeorological_signatures --workers 4
+    python pipeline/run_pipeline.py --dry-run
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import nbformat
+
+from tasks import TASKS
+
+# Folder "code/python" and root of the repository:
+CODE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_PATH = os.path.dirname(os.path.dirname(CODE_PATH))
+
+# Executed notebooks, logs and state of the runs:
+PATH_PIPELINE = os.path.join(ROOT_PATH, "results", "pipeline")
+
+
+def load_state(path):
+    """
+    Load the state of the previous runs (status and hash of each task, hashes of the files).
+    """
+    if not os.path.exists(path):
+        return {"tasks": {}, "files": {}}
+
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_state(path, state):
+    """
+    Save the state atomically (a new file replaces the previous one), so that an interrupted run
+    never leaves a partial state.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as file:
+        json.dump(state, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def list_files(path):
+    """
+    List the files of an input or output (relative to the root): a file, all the files of a folder
+    or a shapefile with its companion files (.dbf, .shx, .prj, ...).
+    """
+    full_path = os.path.join(ROOT_PATH, path)
+
+    if os.path.isdir(full_path):
+        files = [os.path.join(folder, name) for folder, _, names in os.walk(full_path) for name in names]
+    elif path.endswith(".shp"):
+        files = glob.glob(glob.escape(full_path[:-4]) + ".*")
+    else:
+        files = [full_path] if os.path.exists(full_path) else []
+
+    return sorted(files)
+
+
+def hash_file(path, files_cache, read=True):
+    """
+    Content hash (sha256) of a file. The hash is kept in files_cache with the size and modification
+    time of the file, so that large files (e.g., the E-OBS NetCDF files) are only read again when
+    they change. With read=False, only the cached hash is used (None if the file changed).
+    """
+    stat = os.stat(path)
+    key = os.path.relpath(path, ROOT_PATH)
+    cached = files_cache.get(key)
+    if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    if not read:
+        return None
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha.update(block)
+
+    files_cache[key] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+
+    return sha.hexdigest()
+
+
+def hash_task(task, files_cache, read=True):
+    """
+    Hash of everything a task depends on: the notebook, the utils of its folder, the parameters and
+    the content of the inputs. With read=False, no file is read and the hash is None when a file
+    changed since it was last hashed (see hash_file).
+
+    Returns:
+    - tuple: Hash (str or None) and list of the missing inputs.
+    """
+    sha = hashlib.sha256()
+    notebook = os.path.join(CODE_PATH, task["notebook"])
+    utils = sorted(glob.glob(os.path.join(os.path.dirname(notebook), "utils", "*.py")))
+
+    sha.update(json.dumps(task.get("parameters", {}), sort_keys=True).encode())
+    files = [notebook] + utils
+
+    missing = []
+    for path in task["inputs"]:
+        input_files = list_files(path)
+        if not input_files:
+            missing.append(path)
+        files.extend(input_files)
+
+    changed = False
+    for file in files:
+        file_hash = hash_file(file, files_cache, read)
+        if file_hash is None:
+            changed = True
+            continue
+        sha.update(os.path.relpath(file, ROOT_PATH).encode() + file_hash.encode())
+
+    return (None if changed else sha.hexdigest()), missing
+
+
+def overlaps(path_a, path_b):
+    """
+    True if two paths (relative to the root, folders ending with "/") are the same or one is inside
+    the other.
+    """
+    return path_a == path_b or (path_a.endswith("/") and path_b.startswith(path_a)) or \
+        (path_b.endswith("/") and path_a.startswith(path_b))
+
+
+def get_dependencies(tasks):
+    """
+    Dependencies of each task: the tasks whose outputs are in its inputs.
+
+    Returns:
+    - dict: Name of the task as key and the set of names of the upstream tasks as values.
+    """
+    dependencies = {}
+    for task in tasks:
+        dependencies[task["name"]] = {other["name"] for other in tasks if other is not task and
+                                      any(overlaps(path, output) for path in task["inputs"] for output in other["outputs"])}
+
+    return dependencies
+
+
+def sort_tasks(names, dependencies):
+    """
+    Sort the tasks so that each one comes after its dependencies (raises ValueError for cycles).
+    """
+    ordered, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"The tasks have a cycle at {name}.")
+        visiting.add(name)
+        for upstream in sorted(dependencies[name] & set(names)):
+            visit(upstream)
+        visiting.discard(name)
+        done.add(name)
+        ordered.append(name)
+
+    for name in names:
+        visit(name)
+
+    return ordered
+
+
+def select_tasks(tasks, names, dependencies, include_optional=False):
+    """
+    Select the chosen tasks and all their upstream tasks. Without names, all the tasks (except the
+    optional ones, unless include_optional) are selected.
+    """
+    by_name = {task["name"]: task for task in tasks}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown tasks: {', '.join(unknown)}")
+
+    if not names:
+        names = [task["name"] for task in tasks if include_optional or not task.get("optional", False)]
+
+    selected = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(dependencies[name])
+
+    return sort_tasks([task["name"] for task in tasks if task["name"] in selected], dependencies)
+
+
+def outputs_exist(task):
+    """
+    True if all the outputs of a task exist (folders must not be empty).
+    """
+    return all(list_files(path) for path in task["outputs"])
+
+
+def inject_parameters(notebook, parameters, path_out):
+    """
+    Write a copy of a notebook with a cell setting the parameters right after the cell with the
+    "Only editable variables" (or after the first code cell). The cell gets a new id when the
+    notebook has cell ids (nbformat 4.5 or later).
+    """
+    content = nbformat.read(notebook, as_version=4)
+
+    code_cells = [i for i, cell in enumerate(content.cells) if cell.cell_type == "code"]
+    position = next((i for i in code_cells if "Only editable variables" in content.cells[i].source),
+                    code_cells[0] if code_cells else -1) + 1
+
+    source = "# Parameters set by the pipeline runner:\n" + "".join(f"{key} = {value!r}\n" for key, value in parameters.items())
+    cell = nbformat.v4.new_code_cell(source, metadata={"tags": ["injected-parameters"]})
+    if content.nbformat_minor < 5:
+        cell.pop("id", None)
+    content.cells.insert(position, cell)
+
+    nbformat.write(content, path_out)
+
+
+def execute_task(task, path_pipeline):
+    """
+    Execute the notebook of a task (with its parameters) in a new process with nbconvert. The
+    executed notebook and the log are written to path_pipeline.
+
+    Returns:
+    - str or None: Error message, or None if the notebook ran without errors.
+    """
+    notebook = os.path.join(CODE_PATH, task["notebook"])
+
+    # The copy is in the same folder, so that the relative paths and the utils are the same:
+    notebook_copy = os.path.join(os.path.dirname(notebook), f".pipeline_{task['name']}.ipynb")
+    inject_parameters(notebook, task.get("parameters", {}), notebook_copy)
+
+    os.makedirs(os.path.join(path_pipeline, "notebooks"), exist_ok=True)
+    os.makedirs(os.path.join(path_pipeline, "logs"), exist_ok=True)
+
+    command = [sys.executable, "-m", "nbconvert", "--to", "notebook", "--execute", "--ExecutePreprocessor.timeout=-1",
+               "--output-dir", os.path.join(path_pipeline, "notebooks"), "--output", task["name"], notebook_copy]
+    try:
+        with open(os.path.join(path_pipeline, "logs", task["name"] + ".log"), "w") as log:
+            process = subprocess.run(command, cwd=os.path.dirname(notebook), stdout=log, stderr=subprocess.STDOUT)
+    finally:
+        os.remove(notebook_copy)
+
+    if process.returncode == 0:
+        return None
+
+    with open(os.path.join(path_pipeline, "logs", task["name"] + ".log")) as log:
+        # Last line of the traceback, without the terminal colours:
+        lines = [re.sub(r"\x1b\[[0-9;]*m", "", line).strip() for line in log if line.strip()]
+
+    return lines[-1] if lines else f"nbconvert exited with code {process.returncode}"
+
+
+def run_pipeline(names=(), workers=1, force=False, dry_run=False, include_optional=False, path_pipeline=PATH_PIPELINE,
+                 tasks=TASKS, execute=execute_task):
+    """
+    Run the chosen tasks (and their upstream tasks) in order, skipping the tasks whose hash did not
+    change since their last successful run.
+
+    Parameters:
+    - names (list): Tasks to be run. Default is all the non-optional tasks.
+    - workers (int): Maximum number of tasks running at the same time.
+    - force (bool): Run the tasks even if their inputs did not change.
+    - dry_run (bool): Only print what would be run, without reading the inputs or writing the state.
+    - include_optional (bool): Also run the optional tasks (when no names are given).
+    - path_pipeline (str): Folder of the state, logs and executed notebooks.
+    - tasks (list): Definition of the tasks (see tasks.py).
+    - execute (callable): Function executing one task, returning an error message or None.
+
+    Returns:
+    - dict: Status of each task ("done", "skipped", "failed", "blocked" or "missing inputs").
+    """
+    by_name = {task["name"]: task for task in tasks}
+    dependencies = get_dependencies(tasks)
+    order = select_tasks(tasks, list(names), dependencies, include_optional)
+
+    path_state = os.path.join(path_pipeline, "pipeline_state.json")
+    state = load_state(path_state)
+    lock = threading.Lock()
+    status = {}
+
+    def run_one(name, task_hash, task):
+        start = time.time()
+        error = execute(task, path_pipeline)
+        with lock:
+            state["tasks"][name] = {"status": "failed" if error else "done", "hash": task_hash, "error": error,
+                                    "seconds": round(time.time() - start, 1),
+                                    "finished": datetime.datetime.now().isoformat(timespec="seconds")}
+            save_state(path_state, state)
+        return name, error
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        running = {}
+        pending = list(order)
+
+        while pending or running:
+            # Start all the tasks whose dependencies are finished:
+            for name in list(pending):
+                upstream = dependencies[name] & set(order)
+                if any(status.get(other) in ("failed", "blocked", "missing inputs") for other in upstream):
+                    status[name] = "blocked"
+                    pending.remove(name)
+                    print(f"[blocked] {name}")
+                    continue
+                if any(other not in status or status[other] == "running" for other in upstream):
+                    continue
+
+                pending.remove(name)
+                if dry_run and any(status.get(other) == "would run" for other in upstream):
+                    status[name] = "would run"
+                    print(f"[would run] {name} (upstream changes)")
+                    continue
+
+                with lock:
+                    # A dry run only uses the cached hashes (a changed file means the task would run):
+                    task_hash, missing = hash_task(by_name[name], state["files"], read=not dry_run)
+                    if not dry_run:
+                        save_state(path_state, state)
+                previous = state["tasks"].get(name, {})
+
+                if missing:
+                    status[name] = "missing inputs"
+                    print(f"[missing inputs] {name}: {', '.join(missing)}")
+                elif dry_run and task_hash is None:
+                    status[name] = "would run"
+                    print(f"[would run] {name} (changed files)")
+                elif not force and previous.get("status") == "done" and previous.get("hash") == task_hash \
+                        and outputs_exist(by_name[name]):
+                    status[name] = "skipped"
+                    print(f"[up to date] {name}")
+                elif dry_run:
+                    status[name] = "would run"
+                    print(f"[would run] {name}")
+                else:
+                    task = by_name[name]
+
+                    # A task failed or interrupted with the same hash continues from its ledger (only
+                    # the missing items, e.g. catchments) instead of starting again:
+                    resume = not force and previous.get("status") in ("failed", "running") \
+                        and previous.get("hash") == task_hash
+                    if "restart" in task:
+                        task = dict(task, parameters={**task.get("parameters", {}), task["restart"]: resume})
+
+                    with lock:
+                        state["tasks"][name] = {"status": "running", "hash": task_hash}
+                        save_state(path_state, state)
+
+                    status[name] = "running"
+                    print(f"[running] {name}" + (" (resuming)" if resume and "restart" in task else ""))
+                    running[executor.submit(run_one, name, task_hash, task)] = name
+
+            if not running:
+                break
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name, error = future.result()
+                del running[future]
+                status[name] = "failed" if error else "done"
+                print(f"[failed] {name}: {error}" if error else f"[done] {name}")
+
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the EStreams notebooks as a pipeline of tasks.")
+    parser.add_argument("tasks", nargs="*", help="Tasks to be run (with their upstream tasks). Default is all.")
+    parser.add_argument("--workers", type=int, default=1, help="Maximum number of tasks running at the same time.")
+    parser.add_argument("--force", action="store_true", help="Run the tasks even if their inputs did not change.")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the tasks that would be run.")
+    parser.add_argument("--all", action="store_true", help="Also run the optional tasks (downloads and extras).")
+    parser.add_argument("--list", action="store_true", help="List the tasks and their dependencies.")
+    args = parser.parse_args()
+
+    if args.list:
+        dependencies = get_dependencies(TASKS)
+        for name in sort_tasks([task["name"] for task in TASKS], dependencies):
+            optional = " (optional)" if next(task for task in TASKS if task["name"] == name).get("optional") else ""
+            print(f"{name}{optional} <- {', '.join(sorted(dependencies[name])) or '-'}")
+        return
+
+    status = run_pipeline(args.tasks, args.workers, args.force, args.dry_run, args.all)
+    sys.exit(1 if any(value in ("failed", "blocked", "missing inputs") for value in status.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
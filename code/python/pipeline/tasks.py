@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file is part of the EStreams dataset. See https://github.com/EStreams for details.
+
+Coded by: Thiago Nascimento
+
+Tasks of the EStreams pipeline (see run_pipeline.py). Each task is one notebook executed with a set
+of parameters (which replace the "Only editable variables" of the notebook), with the files or
+folders it reads (inputs) and writes (outputs), relative to the root of the repository. A task
+depends on the tasks whose outputs are inside its inputs. The optional tasks (downloads and extras)
+are only run when chosen explicitly. The tasks with "restart" have a notebook parameter that, when
+a previous run of the task failed or was interrupted, makes the notebook continue from its ledger
+(see utils/checkpoint.py) instead of processing everything again.
+"""
+
+# Variables of the E-OBS dataset extracted per catchment, with their NetCDF files:
+EOBS_VARIABLES = {
+    "rr": "rr_ens_mean_0.25deg_reg_v28.0e.nc",
+    "tg": "tg_ens_mean_0.25deg_reg_v28.0e.nc",
+    "tn": "tn_ens_mean_0.25deg_reg_v28.0e.nc",
+    "tx": "tx_ens_mean_0.25deg_reg_v28.0e.nc",
+    "pp": "pp_ens_mean_0.25deg_reg_v28.0e.nc",
+    "hu": "hu_ens_mean_0.25deg_reg_v28.0e.nc",
+    "fg": "fg_ens_mean_0.25deg_reg_v28.0e.nc",
+    "qq": "qq_ens_mean_0.25deg_reg_v28.0e.nc",
+    "pet": "pet_hargreaves_025deg_v280e.nc",
+    "pet_iceland": "pet_hargreaves_iceland_025deg_v280e.nc",
+}
+
+CATCHMENTS = "data/shapefiles/estreams_catchments.shp"
+STREAMFLOW = "data/streamflow/estreams_timeseries_streamflow.csv"
+NETWORK = "data/streamflow/estreams_gauging_stations.csv"
+EOBS = "data/meteorology/eobs/"
+
+TASKS = [
+    # A - Landscape attributes:
+    {"name": "geology", "notebook": "A_extraction_landscape_attributes/estreams_geology.ipynb",
+     "inputs": [CATCHMENTS, "data/geology/GLiM.shp"],
+     "outputs": ["results/staticattributes/estreams_geology_attributes.csv"]},
+    {"name": "geology_continental", "notebook": "A_extraction_landscape_attributes/estreams_geology_continental.ipynb",
+     "inputs": [CATCHMENTS, "data/geology/ihme1500_litho12345_ec4060_v12_poly.shp"],
+     "outputs": ["results/staticattributes/estreams_geologycontinental_attributes.csv"]},
+    {"name": "hydrology", "notebook": "A_extraction_landscape_attributes/estreams_hydrology.ipynb",
+     "inputs": [CATCHMENTS, "data/hydrology/"],
+     "outputs": ["results/staticattributes/estreams_hydrology_attributes.csv"]},
+    {"name": "irrigation", "notebook": "A_extraction_landscape_attributes/estreams_irrigation.ipynb",
+     "inputs": [CATCHMENTS, "data/irrigation/"],
+     "outputs": ["results/timeseries/irrigation/estreams_irrigation_yearly.csv"]},
+    {"name": "landcover", "notebook": "A_extraction_landscape_attributes/estreams_landcover.ipynb",
+     "inputs": [CATCHMENTS, "data/gee/landcover/"],
+     "outputs": ["results/staticattributes/estreams_landcover_attributes.csv"]},
+    {"name": "meteorology_coverage", "notebook": "A_extraction_landscape_attributes/estreams_meteorology_coverage.ipynb",
+     "inputs": [CATCHMENTS, "data/eobs_stations/"],
+     "outputs": ["results/staticattributes/estreams_meteorology_density.csv", "results/timeseries/meteorologycoverage/"]},
+    {"name": "snow_cover", "notebook": "A_extraction_landscape_attributes/estreams_snow_cover.ipynb",
+     "inputs": [CATCHMENTS, "data/gee/snowcover/"],
+     "outputs": ["results/timeseries/snowcover/", "results/staticattributes/estreams_snowcover_attributes.csv"]},
+    {"name": "soil", "notebook": "A_extraction_landscape_attributes/estreams_soil.ipynb",
+     "inputs": [CATCHMENTS, "data/soils/"],
+     "outputs": ["results/staticattributes/estreams_soil_attributes.csv"]},
+    {"name": "topography", "notebook": "A_extraction_landscape_attributes/estreams_topography.ipynb",
+     "inputs": [CATCHMENTS, "data/topography/", "data/gee/topography/"],
+     "outputs": ["results/staticattributes/estreams_topography_attributes.csv"]},
+    {"name": "vegetation", "notebook": "A_extraction_landscape_attributes/estreams_vegetation.ipynb",
+     "inputs": [CATCHMENTS, "data/gee/vegetation/"],
+     "outputs": ["results/timeseries/vegetationindices/", "results/staticattributes/estreams_vegetation_attributes.csv"]},
+
+    # B - Meteorological records:
+    {"name": "pet_hargreaves", "notebook": "B_extraction_meteorological_records/estreams_meteorology_timeseries_a.ipynb",
+     "parameters": {"CHOSEN_CLIP": "not_iceland"},
+     "inputs": [EOBS + EOBS_VARIABLES["tg"], EOBS + EOBS_VARIABLES["tx"], EOBS + EOBS_VARIABLES["tn"]],
+     "outputs": [EOBS + EOBS_VARIABLES["pet"]]},
+    {"name": "pet_hargreaves_iceland", "notebook": "B_extraction_meteorological_records/estreams_meteorology_timeseries_a.ipynb",
+     "parameters": {"CHOSEN_CLIP": "only_iceland"},
+     "inputs": [EOBS + EOBS_VARIABLES["tg"], EOBS + EOBS_VARIABLES["tx"], EOBS + EOBS_VARIABLES["tn"]],
+     "outputs": [EOBS + EOBS_VARIABLES["pet_iceland"]]},
+] + [
+    {"name": f"meteorology_{variable}", "notebook": "B_extraction_meteorological_records/estreams_meteorology_timeseries_b.ipynb",
+     "parameters": {"chosen_variable": variable}, "restart": "RESTART",
+     "inputs": [CATCHMENTS, EOBS + filename],
+     "outputs": [EOBS + f"preprocessing/{variable}/"]}
+    for variable, filename in EOBS_VARIABLES.items()
+] + [
+    {"name": "meteorology_concatenation", "notebook": "B_extraction_meteorological_records/estreams_meteorology_timeseries_c.ipynb",
+     "inputs": [CATCHMENTS] + [EOBS + f"preprocessing/{variable}/" for variable in EOBS_VARIABLES],
+     "outputs": ["results/timeseries/meteorology/"]},
+
+    # C - Signatures and indices:
+    {"name": "hydrometeorological_signatures",
+     "notebook": "C_computation_signatures_and_indices/estreams_hydrometeorological_signatures.ipynb",
+     "inputs": [CATCHMENTS, STREAMFLOW, NETWORK, "results/timeseries/meteorology/"],
+     "outputs": ["results/staticattributes/estreams_hydrometeo_signatures.csv",
+                 "results/staticattributes/estreams_hydrometeo_signatures.parquet"]},
+    {"name": "streamflow_indices", "notebook": "C_computation_signatures_and_indices/estreams_streamflow_indices.ipynb",
+     "inputs": [CATCHMENTS, STREAMFLOW, NETWORK],
+     "outputs": ["results/timeseries/streamflowindices/"]},
+
+    # D - Streamflow data (downloads from the providers, only when chosen):
+    {"name": "streamflow_catalogue", "notebook": "D_demonstration_streamflow_data/estreams_demonstration_streamflow_a_catalogue.ipynb",
+     "inputs": [NETWORK, "data/streamflow/estreams_streamflow_catalogue.csv"],
+     "outputs": ["data/streamflow/raw_data/HR/", "data/streamflow/raw_data/IT/"], "optional": True},
+    {"name": "streamflow_organization",
+     "notebook": "D_demonstration_streamflow_data/estreams_demonstration_streamflow_b_organization.ipynb",
+     "inputs": ["data/streamflow/raw_data/"], "outputs": [], "optional": True},
+
+    # E - Complementary codes (only when chosen):
+    {"name": "duplicates_find", "notebook": "E_complementary_extra_codes/estreams_extras_duplicates_a_find.ipynb",
+     "inputs": ["results/estreams_gauging_stations.csv"],
+     "outputs": ["results/extras/distance_mattrix_duplicates.csv", "results/extras/estreams_gauging_stations_duplicates.csv"],
+     "optional": True},
+    {"name": "duplicates_filter", "notebook": "E_complementary_extra_codes/estreams_extras_duplicates_b_filter.ipynb",
+     "inputs": [NETWORK], "outputs": ["results/extras/estreams_attributes.csv"], "optional": True},
+    {"name": "nested_catchments", "notebook": "E_complementary_extra_codes/estreams_extras_nested_catchments.ipynb",
+     "inputs": ["results/estreams_catchments.shp", "results/estreams_gauging_stations_duplicates.csv"],
+     "outputs": ["results/extras/estreams_catchments_hierarchy.csv",
+                 "results/extras/estreams_gauging_stations_nested_catchments.csv",
+                 "results/extras/estreams_gauging_stations_nested.csv"], "optional": True},
+]